@@ -1,16 +1,25 @@
-import requests
 import json
+import re
 import http.client
+from urllib.parse import urlsplit
+import time
 import uuid
+import functools
 import threading
-from typing import List, Union, Annotated
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Union, Annotated
 from langchain_core.tools import tool
 from dotenv import load_dotenv
 import os
-from supabase import create_client, Client
 from tool_prompts import *
 from langgraph.prebuilt import InjectedState
 from logger_util import get_logger
+import rate_limiter
+import cassette
+import tracing
+import metrics
+import backend_router
 
 load_dotenv()
 kie_api_key = os.getenv("KIE_API_KEY")
@@ -19,22 +28,36 @@ supabase_url = os.getenv("VITE_SUPABASE_URL") or "https://rgmbmxczzgjtinoncdor.s
 supabase_key = os.getenv("VITE_SUPABASE_ANON_KEY")
 logger = get_logger("mynamechat.kie_tools")
 
-# 初始化 Supabase
-supabase: Client = create_client(supabase_url, supabase_key) if supabase_key else None
+# Supabase 客户端在首次使用时创建 (见 _get_supabase)：导入本模块 (三个图在启动时都会导入) 不再加载 supabase SDK
+_supabase_client = None
+_SUPABASE_LOCK = threading.Lock()
 
-# API 配置常量
-API_BASE_URL = "https://api.kie.ai/api/v1"
+# API 配置常量 (Base URL 可通过环境变量覆盖，用于接入本地 fake_providers 做压测)
+API_BASE_URL = os.getenv("KIE_API_BASE_URL") or "https://api.kie.ai/api/v1"
 CREATE_TASK_URL = f"{API_BASE_URL}/jobs/createTask"
 RECORD_INFO_URL = f"{API_BASE_URL}/jobs/recordInfo"
-GEMINI_API_HOST = "api.ppinfra.com"
+GEMINI_API_BASE_URL = os.getenv("PPIO_API_BASE_URL") or "https://api.ppinfra.com"
+GEMINI_API_HOST = urlsplit(GEMINI_API_BASE_URL).netloc
 GEMINI_API_PATH = "/v3/gemini-3-pro-image-edit"
+OSS_TRANSFER_BASE_URL = os.getenv("OSS_TRANSFER_BASE_URL") or "https://oss-trar-server-vwsitywsrq.cn-hangzhou.fcapp.run"
+OSS_TRANSFER_PATH = "/transfer"
 CALLBACK_URL = None
 
 # 图像生成默认配置
 DEFAULT_SeedDream_IMAGE_SIZE = "landscape_16_9"  # https://kie.ai/seedream-api
 DEFAULT_NanoPro_IMAGE_SIZE = "16:9"  # 16:9, 9:16, 1:1, 4:3, 3:4, 21:9
 DEFAULT_IMAGE_RESOLUTION = "2K"  # 1K, 2K, 4K
-DEFAULT_MAX_IMAGES = 1
+# 单个 Seedream 任务输出的图片数 (max_images)：一次任务得到多张候选图，状态查询返回全部 URL
+MAX_IMAGES = 6
+try:
+    DEFAULT_MAX_IMAGES = int(os.getenv("KIE_DEFAULT_MAX_IMAGES") or 1)
+except ValueError:
+    # 配置错误不能让三个图在导入时一起失败
+    logger.warning("Invalid KIE_DEFAULT_MAX_IMAGES=%r, falling back to 1", os.getenv("KIE_DEFAULT_MAX_IMAGES"))
+    DEFAULT_MAX_IMAGES = 1
+
+# 多变体 (同一请求并发提交 N 个 seed) 配置
+MAX_VARIANTS = 4
 
 # 视频生成默认配置
 DEFAULT_ASPECT_RATIO = "landscape"  # portrait
@@ -60,11 +83,284 @@ def _get_headers_gemini():
     }
     return headers
 
+
+def _open_connection(base_url: str) -> http.client.HTTPConnection:
+    """按 Base URL 的 scheme 打开 HTTP/HTTPS 连接"""
+    parts = urlsplit(base_url)
+    if parts.scheme == "http":
+        return http.client.HTTPConnection(parts.netloc)
+    return http.client.HTTPSConnection(parts.netloc)
+
+
+def _post_json(base_url: str, path: str, payload: dict, headers: dict) -> dict:
+    """通过 http.client 发送 JSON POST 并解析 JSON 响应 (PPIO / OSS 转存)"""
+    conn = _open_connection(base_url)
+    conn.request("POST", path, json.dumps(payload), headers)
+    res = conn.getresponse()
+    data = res.read()
+    return json.loads(data.decode("utf-8"))
+
+
+def _provider_call(kind: str, request, call):
+    """所有外部调用 (KIE / PPIO / OSS / Supabase) 的统一边界：tracing span + 延迟指标 + cassette 录制回放"""
+    provider, _, endpoint = kind.partition(".")
+    with tracing.span(kind, kind=tracing.KIND_CLIENT, **{"provider": provider, "provider.endpoint": endpoint}):
+        try:
+            with metrics.PROVIDER_LATENCY.time(provider=provider, endpoint=endpoint):
+                return cassette.through(kind, request, call)
+        except Exception:
+            metrics.PROVIDER_ERRORS.inc(provider=provider, endpoint=endpoint)
+            raise
+
+
+def _tool_error(result) -> bool:
+    """工具以字符串返回的错误 (Error creating task / API Error / ...)"""
+    return isinstance(result, str) and (result.startswith("Error") or result.startswith("API Error"))
+
+
+def _instrument_tool(fn):
+    """工具埋点：每次调用一个 tracing span，记录 task_id 与错误，并累计调用 / 错误指标"""
+    name = fn.__name__
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        metrics.TOOL_CALLS.inc(tool=name)
+        with tracing.span(f"tool.{name}", **{"tool.name": name}) as s:
+            try:
+                result = fn(*args, **kwargs)
+            except Exception:
+                metrics.TOOL_ERRORS.inc(tool=name)
+                raise
+            if _tool_error(result):
+                metrics.TOOL_ERRORS.inc(tool=name)
+            if s is not None:
+                if isinstance(result, dict):
+                    s.set(task_id=result.get("task_id"), **{"tool.num_tasks": len(result.get("task_ids") or [1])})
+                elif _tool_error(result):
+                    s.status, s.status_message = tracing.STATUS_ERROR, result[:200]
+            return result
+
+    return wrapper
+
+
+# --- Supabase ppio_task_status 表操作 (统一经过 _provider_call 边界) ---
+
+def _get_supabase():
+    global _supabase_client
+    if _supabase_client is None:
+        with _SUPABASE_LOCK:
+            if _supabase_client is None:
+                from supabase import create_client
+
+                _supabase_client = create_client(supabase_url, supabase_key)
+    return _supabase_client
+
+
+def _supabase_available() -> bool:
+    return bool(supabase_key) or cassette.replaying()
+
+
+def _supabase_insert_task(task_id: str) -> None:
+    db_data = {
+        "id": task_id,
+        "url": ""  # 初始为空，等待后台更新
+    }
+    _provider_call(
+        "supabase.insert", db_data,
+        lambda: _get_supabase().table("ppio_task_status").insert(db_data).execute().data,
+    )
+
+
+def _record_urls(record: dict) -> list[str]:
+    """
+    ppio_task_status 行中的全部结果 URL：url 列始终是第一张 (其他读取方按单个 URL 使用)，
+    多张时完整列表在 urls 列 (jsonb)。兼容早期把 JSON 数组直接写进 url 列的行
+    """
+    urls = record.get("urls")
+    if isinstance(urls, list) and urls:
+        return [u for u in urls if isinstance(u, str) and u]
+    value = record.get("url")
+    value = value.strip() if isinstance(value, str) else ""
+    if value.startswith("["):
+        try:
+            return [u for u in json.loads(value) if isinstance(u, str) and u]
+        except json.JSONDecodeError:
+            return []
+    return [value] if value else []
+
+
+def _result_urls(result) -> list[str]:
+    """状态查询结果中的全部结果 URL：单张为 URL 字符串，多张为 URL 列表；处理中 / 失败时返回 []"""
+    if isinstance(result, str):
+        return [result] if result.startswith("http") else []
+    if isinstance(result, list):
+        return [u for u in result if isinstance(u, str) and u.startswith("http")]
+    return []
+
+
+def _status_result(urls: list[str]) -> Union[str, list[str]]:
+    """成功的状态结果：单张返回 URL 字符串 (与原来一致)，多张返回 URL 列表"""
+    return urls[0] if len(urls) == 1 else list(urls)
+
+
+def _supabase_update_urls(task_id: str, urls: list[str]) -> None:
+    # 根据 ID 更新 URL：url 列只写第一张，多张时完整列表另写 urls 列 (见 _record_urls)
+    data = {"url": urls[0]}
+    if len(urls) > 1:
+        data["urls"] = list(urls)
+    try:
+        _provider_call(
+            "supabase.update", {"id": task_id, **data},
+            lambda: _get_supabase().table("ppio_task_status").update(data).eq("id", task_id).execute().data,
+        )
+    except Exception as e:
+        if "urls" not in data:
+            raise
+        # 表还没有 urls 列时至少写入第一张，任务不至于一直处于处理中
+        logger.warning("Failed to write urls for %s (%s), storing the first image only", task_id, e)
+        _supabase_update_urls(task_id, urls[:1])
+
+
+def _supabase_select_url(task_id: str) -> list[dict]:
+    # select("*")：表没有 urls 列时也能读取
+    return _provider_call(
+        "supabase.select", {"id": task_id},
+        lambda: _get_supabase().table("ppio_task_status").select("*").eq("id", task_id).execute().data,
+    )
+
+
+def _create_kie_task(payload: dict, error_tag: str) -> Union[str, dict]:
+    """提交 KIE createTask，成功返回 {"task_id": ...}，失败返回错误字符串"""
+    import requests  # 延迟导入，缩短图模块的启动时间
+
+    rate_limiter.acquire("kie")
+    result = _provider_call(
+        "kie.createTask",
+        payload,
+        lambda: requests.post(CREATE_TASK_URL, headers=_get_headers(), data=json.dumps(payload)).json(),
+    )
+
+    if not result or "data" not in result or not result["data"]:
+        logger.error("KIE API Error in %s: %s", error_tag, result)
+        return f"Error creating task: {result.get('msg', 'Unknown error')} (Response: {result})"
+
+    tracing.set_attributes(task_id=result["data"]["taskId"])
+    return {"task_id": result["data"]["taskId"]}
+
+
+# 进程内任务组登记：group_id -> 成员 task_id 列表 (recorder 同时会把成员写入 state)
+# 长期运行的服务中按 LRU 限制条目数，避免随总请求量无限增长
+MAX_TASK_GROUPS = 1024
+_TASK_GROUPS: "OrderedDict[str, list[str]]" = OrderedDict()
+_TASK_GROUPS_LOCK = threading.Lock()
+
+
+def _register_task_group(group_id: str, task_ids: list[str]) -> None:
+    with _TASK_GROUPS_LOCK:
+        _TASK_GROUPS[group_id] = task_ids
+        while len(_TASK_GROUPS) > MAX_TASK_GROUPS:
+            _TASK_GROUPS.popitem(last=False)
+
+
+# 变体 (num_variants) 与候选图 (max_images 展开后最多 MAX_VARIANTS * MAX_IMAGES 张) 共用编号解析
+# "第N" 必须跟量词 (第三张 / 第2个)，否则 "第一帧改亮一点" 之类的普通描述会被当成选择变体
+_NUMBER = r"([0-9]{1,2}|[一二三四五六七八九十])"
+_VARIANT_CHOICE_PATTERN = re.compile(
+    rf"(?:变体|候选图?|variant\s*#?|candidate\s*#?)\s*{_NUMBER}|第\s*{_NUMBER}\s*(?:张|个)", re.I)
+_CN_DIGITS = {"一": 1, "二": 2, "三": 3, "四": 4, "五": 5, "六": 6, "七": 7, "八": 8, "九": 9, "十": 10}
+
+
+def _pick_variant_index(text: str, num_variants: int) -> int | None:
+    """从用户输入中解析选中的变体 / 候选图编号 (如 "用变体2"、"第三张"、"候选图5")，返回 1-based 编号"""
+    match = _VARIANT_CHOICE_PATTERN.search(text or "")
+    if not match:
+        return None
+    token = match.group(1) or match.group(2)
+    index = _CN_DIGITS.get(token) or int(token)
+    return index if 1 <= index <= num_variants else None
+
+
+def _normalize_max_images(max_images) -> int:
+    try:
+        n = int(max_images or DEFAULT_MAX_IMAGES)
+    except (TypeError, ValueError):
+        n = DEFAULT_MAX_IMAGES
+    return max(1, min(n, MAX_IMAGES))
+
+
+DEFAULT_MAX_IMAGES = _normalize_max_images(DEFAULT_MAX_IMAGES)  # 限制在 1..MAX_IMAGES
+
+
+def _normalize_num_variants(num_variants) -> int:
+    try:
+        n = int(num_variants or 1)
+    except (TypeError, ValueError):
+        n = 1
+    return max(1, min(n, MAX_VARIANTS))
+
+
+def _routed_submit(backend: str, submit_one):
+    """编辑后端的提交：成功时登记在途任务 (完成时记录延迟)，失败时计入该后端的错误率；EDIT_ROUTER 未开启时原样提交"""
+    if not backend_router.EDIT_ROUTER:
+        return submit_one
+
+    def _submit():
+        result = submit_one()
+        if isinstance(result, dict) and result.get("task_id"):
+            backend_router.router.submitted(backend, result["task_id"])
+        else:
+            backend_router.router.submit_failed(backend)
+        return result
+    return _submit
+
+
+def _submit_variants(submit_one, num_variants: int, status: str, model: str) -> Union[str, dict]:
+    """
+    将一次请求并发提交 N 次，作为一个任务组返回。各次请求参数相同 (Provider 不接受 seed)，
+    变体之间的差异来自 Provider 侧的随机性。
+    submit_one() 返回 {"task_id": ...} 或错误字符串。
+    """
+    if num_variants == 1:
+        result = submit_one()
+        if isinstance(result, str):
+            return result
+        return {"task_id": result["task_id"], "status": status, "model": model}
+
+    with ThreadPoolExecutor(max_workers=num_variants, thread_name_prefix="variant") as pool:
+        results = [f.result() for f in [pool.submit(tracing.propagate(submit_one)) for _ in range(num_variants)]]
+
+    task_ids, errors = [], []
+    for result in results:
+        if isinstance(result, dict):
+            task_ids.append(result["task_id"])
+        else:
+            errors.append(result)
+
+    if not task_ids:
+        return errors[0]
+
+    group_id = f"group-{uuid.uuid4()}"
+    _register_task_group(group_id, task_ids)
+    logger.info("Variant group %s submitted: %d/%d tasks (%s)", group_id, len(task_ids), num_variants, model)
+    group = {
+        "task_id": group_id,
+        "task_ids": task_ids,
+        "num_variants": len(task_ids),
+        "status": f"{status} ({len(task_ids)} variants)",
+        "model": model,
+    }
+    if errors:
+        group["errors"] = errors
+    return group
+
+
 @tool(description=TEXT_TO_IMAGE_DESC)
+@_instrument_tool
 def text_to_image_by_kie_seedream_v4_create_task(
     prompt: str, 
     resolution: str = DEFAULT_IMAGE_RESOLUTION, 
-    aspect_ratio: str = DEFAULT_SeedDream_IMAGE_SIZE
+    aspect_ratio: str = DEFAULT_SeedDream_IMAGE_SIZE,
+    max_images: int = DEFAULT_MAX_IMAGES
     ) -> str:
     payload = {
         "model": "bytedance/seedream-v4-text-to-image",
@@ -73,32 +369,37 @@ def text_to_image_by_kie_seedream_v4_create_task(
             "prompt": prompt,
             "image_size": aspect_ratio or DEFAULT_SeedDream_IMAGE_SIZE,
             "image_resolution": resolution or DEFAULT_IMAGE_RESOLUTION,
-            "max_images": DEFAULT_MAX_IMAGES
+            "max_images": _normalize_max_images(max_images)
         }
     }
 
-    response = requests.post(CREATE_TASK_URL, headers=_get_headers(), data=json.dumps(payload))
-    result = response.json()
-
-    if not result or "data" not in result or not result["data"]:
-        logger.error(f"KIE API Error in text_to_image_by_kie_seedream_v4_create_task: {result}")
-        return f"Error creating task: {result.get('msg', 'Unknown error')} (Response: {result})"
+    result = _create_kie_task(payload, "text_to_image_by_kie_seedream_v4_create_task")
+    if isinstance(result, str):
+        return result
 
     return {
-        "task_id": result["data"]["taskId"],
+        "task_id": result["task_id"],
         "status": "Text to Image Task created successfully!",
         "model": "seedream-v4-text"
     }
 
 
 @tool(description=IMAGE_EDIT_DESC)
+@_instrument_tool
 def image_edit_by_kie_seedream_v4_create_task(
     prompt: str,
     image_urls: list[str],  
     seed: int, 
     resolution: str = DEFAULT_IMAGE_RESOLUTION,
-    aspect_ratio: str = DEFAULT_SeedDream_IMAGE_SIZE
+    aspect_ratio: str = DEFAULT_SeedDream_IMAGE_SIZE,
+    num_variants: int = 1,
+    max_images: int = DEFAULT_MAX_IMAGES
     ) -> str:
+    return _seedream_edit_create_impl(prompt, image_urls, resolution, aspect_ratio, num_variants, max_images)
+
+
+def _seedream_edit_create_impl(prompt, image_urls, resolution, aspect_ratio, num_variants, max_images):
+    """Seedream 编辑任务提交 (不含工具埋点，路由工具直接调用，避免重复计数与嵌套 span)"""
     payload = {
         "model": "bytedance/seedream-v4-edit",
         "callBackUrl": CALLBACK_URL,
@@ -107,130 +408,210 @@ def image_edit_by_kie_seedream_v4_create_task(
             "image_urls": image_urls,
             "image_size": aspect_ratio or DEFAULT_SeedDream_IMAGE_SIZE,
             "image_resolution": resolution or DEFAULT_IMAGE_RESOLUTION,
-            "max_images": DEFAULT_MAX_IMAGES
+            "max_images": _normalize_max_images(max_images)
         }
     }
 
-    response = requests.post(CREATE_TASK_URL, headers=_get_headers(), data=json.dumps(payload))
-    result = response.json()
-    
-    if not result or "data" not in result or not result["data"]:
-        logger.error(f"KIE API Error in image_edit: {result}")
-        return f"Error creating task: {result.get('msg', 'Unknown error')} (Response: {result})"
+    return _submit_variants(
+        _routed_submit(backend_router.KIE_SEEDREAM.name, lambda: _create_kie_task(payload, "image_edit")),
+        _normalize_num_variants(num_variants),
+        status="Image Edit Task created successfully!",
+        model="seedream-v4-edit-image",
+    )
 
-    return {
-        "task_id": result["data"]["taskId"],
-        "status": "Image Edit Task created successfully!",
-        "model": "seedream-v4-edit-image"
-    }
+
+def _transfer_to_oss(image_url: str) -> str:
+    """图片转存到 OSS，失败时返回原始 URL"""
+    try:
+        transfer_payload = {"url": image_url}
+        transfer_headers = {
+            'User-Agent': 'Apifox/1.0.0 (https://apifox.com)',
+            'Content-Type': 'application/json',
+            'Accept': '*/*',
+            'Connection': 'keep-alive'
+        }
+        transfer_result = _provider_call(
+            "oss.transfer", transfer_payload,
+            lambda: _post_json(OSS_TRANSFER_BASE_URL, OSS_TRANSFER_PATH, transfer_payload, transfer_headers),
+        )
+
+        if "url" in transfer_result:
+            logger.info("Image transferred successfully: %s", transfer_result["url"])
+            return transfer_result["url"]
+        logger.warning("Transfer failed, using original URL. Response: %s", transfer_result)
+
+    except Exception as transfer_e:
+        logger.warning("Transfer error: %s", transfer_e)
+        # 如果转存失败，继续使用原始 URL
+    return image_url
+
+
+def _run_ppio_background_task(tid, p_prompt, p_urls, p_resolution, p_aspect_ratio) -> tuple[bool, float | None]:
+    """
+    PPIO 后台任务：调用 Banana Pro 接口 -> 图片转存 (全部结果图) -> 回写 Supabase。
+    返回 (是否出图, 生成耗时)：耗时只算 Banana Pro 接口本身，与 KIE 侧的 completeTime - createTime 口径一致
+    """
+    generation_seconds = None
+    try:
+        # 执行耗时的 API 请求
+        payload = {
+            "prompt": p_prompt,
+            "image_urls": p_urls,
+            "aspect_ratio": p_aspect_ratio or DEFAULT_NanoPro_IMAGE_SIZE,
+            "size": p_resolution or DEFAULT_IMAGE_RESOLUTION
+        }
+        
+        started = time.monotonic()
+        result = _provider_call(
+            "ppio.edit", payload,
+            lambda: _post_json(GEMINI_API_BASE_URL, GEMINI_API_PATH, payload, _get_headers_gemini()),
+        )
+        generation_seconds = time.monotonic() - started
+        
+        # 解析返回的全部 Image URL
+        image_urls = []
+        if "image_urls" in result and isinstance(result["image_urls"], list):
+            image_urls = [u for u in result["image_urls"] if isinstance(u, str) and u]
+        
+        # --- 图片转存 (多张时并发转存，顺序与返回一致) ---
+        if len(image_urls) > 1:
+            with ThreadPoolExecutor(max_workers=len(image_urls), thread_name_prefix="oss-transfer") as pool:
+                image_urls = list(pool.map(tracing.propagate(_transfer_to_oss), image_urls))
+        elif image_urls:
+            image_urls = [_transfer_to_oss(image_urls[0])]
+            
+        # 更新 Supabase (更新 URL)
+        if _supabase_available() and image_urls:
+            try:
+                _supabase_update_urls(tid, image_urls)
+            except Exception as db_e:
+                logger.warning("Error updating Supabase: %s", db_e)
+        return bool(image_urls), generation_seconds
+                
+    except Exception as e:
+        logger.error("Background task error: %s", e)
+        return False, generation_seconds
+
+
+def _submit_ppio_banana_task(prompt, image_urls, resolution, aspect_ratio) -> dict:
+    """生成本地 Task ID、入库占位并启动后台线程，立即返回 {"task_id": ...}"""
+    rate_limiter.acquire("ppio")
+    # 1. 生成本地 Task ID
+    task_id = str(uuid.uuid4())
+
+    # 2. 立即入库占位 (URL为空)
+    if _supabase_available():
+        try:
+            _supabase_insert_task(task_id)
+        except Exception as db_e:
+            logger.warning("Error initializing task in Supabase: %s", db_e)
+
+    # 3. 开启 EDIT_ROUTER 时登记到编辑路由 (须在后台线程启动前，线程结束时记录结果与生成耗时)，再启动后台线程
+    if backend_router.EDIT_ROUTER:
+        backend_router.router.submitted(backend_router.PPIO_BANANA_PRO.name, task_id)
+
+    def _background():
+        with tracing.span("ppio.background", task_id=task_id), \
+                metrics.BACKGROUND_JOBS.track_inprogress(provider="ppio"):
+            ok, generation_seconds = _run_ppio_background_task(task_id, prompt, image_urls, resolution, aspect_ratio)
+        _route_complete(task_id, ok, generation_seconds)
+
+    thread = threading.Thread(target=tracing.propagate(_background))
+    thread.start()
+
+    return {"task_id": task_id}
 
 
 @tool(description=IMAGE_EDIT_BANANA_PRO_DESC)
+@_instrument_tool
 def image_edit_by_ppio_banana_pro_create_task(
     prompt: str,
     image_urls: list[str],  
     seed: int, 
     resolution: str = DEFAULT_IMAGE_RESOLUTION, 
-    aspect_ratio: str = DEFAULT_NanoPro_IMAGE_SIZE
+    aspect_ratio: str = DEFAULT_NanoPro_IMAGE_SIZE,
+    num_variants: int = 1
     ) -> str:
-    # 1. 生成本地 Task ID
-    task_id = str(uuid.uuid4())
+    return _banana_edit_create_impl(prompt, image_urls, resolution, aspect_ratio, num_variants)
 
-    # 2. 立即入库占位 (URL为空)
-    if supabase:
-        try:
-            db_data = {
-                "id": task_id,
-                "url": ""  # 初始为空，等待后台更新
-            }
-            supabase.table("ppio_task_status").insert(db_data).execute()
-        except Exception as db_e:
-            logger.warning("Error initializing task in Supabase: %s", db_e)
-    
-    # 3. 定义后台任务函数
-    def run_background_task(tid, p_prompt, p_urls, p_resolution, p_aspect_ratio):
-        try:
-            # 执行耗时的 API 请求
-            conn = http.client.HTTPSConnection(GEMINI_API_HOST)
-            
-            payload = json.dumps({
-                "prompt": p_prompt,
-                "image_urls": p_urls,
-                "aspect_ratio": p_aspect_ratio or DEFAULT_NanoPro_IMAGE_SIZE,
-                "size": p_resolution or DEFAULT_IMAGE_RESOLUTION
-            })
-            
-            headers = _get_headers_gemini()
-            
-            conn.request("POST", GEMINI_API_PATH, payload, headers)
-            
-            res = conn.getresponse()
-            data = res.read()
-            result = json.loads(data.decode("utf-8"))
-            
-            image_url = ""
-            # 解析返回的 Image URL
-            if "image_urls" in result and isinstance(result["image_urls"], list) and len(result["image_urls"]) > 0:
-                image_url = result["image_urls"][0]
-            
-            # --- 图片转存 ---
-            if image_url:
-                try:
-                    transfer_conn = http.client.HTTPSConnection("oss-trar-server-vwsitywsrq.cn-hangzhou.fcapp.run")
-                    transfer_payload = json.dumps({"url": image_url})
-                    transfer_headers = {
-                        'User-Agent': 'Apifox/1.0.0 (https://apifox.com)',
-                        'Content-Type': 'application/json',
-                        'Accept': '*/*',
-                        'Connection': 'keep-alive'
-                    }
-                    transfer_conn.request("POST", "/transfer", transfer_payload, transfer_headers)
-                    transfer_res = transfer_conn.getresponse()
-                    transfer_data = transfer_res.read()
-                    transfer_result = json.loads(transfer_data.decode("utf-8"))
-                    
-                    if "url" in transfer_result:
-                        image_url = transfer_result["url"]
-                        logger.info("Image transferred successfully: %s", image_url)
-                    else:
-                        logger.warning("Transfer failed, using original URL. Response: %s", transfer_result)
-                        
-                except Exception as transfer_e:
-                    logger.warning("Transfer error: %s", transfer_e)
-                    # 如果转存失败，继续使用原始 URL
-                
-            # 更新 Supabase (更新 URL)
-            if supabase and image_url:
-                try:
-                    # 根据 ID 更新 URL
-                    supabase.table("ppio_task_status").update({"url": image_url}).eq("id", tid).execute()
-                except Exception as db_e:
-                    logger.warning("Error updating Supabase: %s", db_e)
-                    
-        except Exception as e:
-            logger.error("Background task error: %s", e)
 
-    # 4. 启动后台线程
-    thread = threading.Thread(
-        target=run_background_task,
-        args=(task_id, prompt, image_urls, resolution, aspect_ratio)
+def _banana_edit_create_impl(prompt, image_urls, resolution, aspect_ratio, num_variants):
+    """Banana Pro 编辑任务提交 (不含工具埋点，路由工具直接调用)；立即返回 ID (N 个变体并发提交，作为一个任务组返回)"""
+    return _submit_variants(
+        lambda: _submit_ppio_banana_task(prompt, image_urls, resolution, aspect_ratio),
+        _normalize_num_variants(num_variants),
+        status="Image Edit Task created successfully!",
+        model="ppio-banana-pro",
     )
-    thread.start()
-    
-    # 5. 立即返回 ID
-    return {
-        "task_id": task_id,
-        "status": "Image Edit Task created successfully!",
-        "model": "ppio-banana-pro"
-    }
+
+
+# 路由工具统一使用 "16:9" 形式的比例，提交到 Seedream 时换成 image_size
+_RATIO_TO_SEEDREAM_SIZE = {
+    "16:9": "landscape_16_9", "9:16": "portrait_16_9", "1:1": "square_hd",
+    "4:3": "landscape_4_3", "3:4": "portrait_4_3", "21:9": "landscape_21_9",
+}
+_SEEDREAM_SIZE_TO_RATIO = {size: ratio for ratio, size in _RATIO_TO_SEEDREAM_SIZE.items()}
+
+
+# 默认质量下限下没有多图后端时 (EDIT_ROUTER_MIN_QUALITY=high 只剩 Banana Pro)，不向模型介绍 max_images
+_IMAGE_EDIT_ROUTED_DESC = IMAGE_EDIT_ROUTED_DESC + (
+    IMAGE_EDIT_ROUTED_MAX_IMAGES_ARG if backend_router.router.max_images_limit() > 1 else "")
+
+
+@tool(description=_IMAGE_EDIT_ROUTED_DESC)
+@_instrument_tool
+def image_edit_routed_create_task(
+    prompt: str,
+    image_urls: list[str],
+    seed: int,
+    resolution: str = DEFAULT_IMAGE_RESOLUTION,
+    aspect_ratio: str = DEFAULT_NanoPro_IMAGE_SIZE,
+    num_variants: int = 1,
+    max_images: int = 1,
+    min_quality: str = ""
+    ) -> str:
+    # 按滚动完成延迟 / 错误率选择当前最快的健康后端 (见 backend_router)
+    max_images = _normalize_max_images(max_images)
+    num_variants = _normalize_num_variants(num_variants)
+    limit = backend_router.router.max_images_limit(min_quality or None)
+    if 1 <= limit < max_images:
+        # 满足质量下限的后端单个任务出不了这么多张：按后端上限出图，其余用并发变体补足，而不是让本轮失败
+        num_variants = min(-(-num_variants * max_images // limit), MAX_VARIANTS)
+        logger.info("Routed edit: max_images=%d exceeds backend limit %d, using %d variants", max_images, limit,
+                    num_variants)
+        max_images = limit
+    decision = backend_router.router.choose(min_quality or None, max_images)
+    if decision is None:
+        return (f"Error creating task: no image edit backend satisfies min_quality={min_quality or backend_router.router.min_quality} "
+                f"max_images={max_images}")
+
+    backend = decision.backend
+    tracing.set_attributes(**{"edit.backend": backend.name, "edit.route_reason": decision.reason})
+    if backend.name == backend_router.KIE_SEEDREAM.name:
+        result = _seedream_edit_create_impl(
+            prompt, image_urls, resolution,
+            _RATIO_TO_SEEDREAM_SIZE.get(aspect_ratio, aspect_ratio or DEFAULT_SeedDream_IMAGE_SIZE),
+            num_variants, max_images,
+        )
+    else:
+        result = _banana_edit_create_impl(
+            prompt, image_urls, resolution, _SEEDREAM_SIZE_TO_RATIO.get(aspect_ratio, aspect_ratio),
+            num_variants,
+        )
+    if not isinstance(result, dict):
+        return result
+    # backend_tool：recorder 记为 last_tool_name，之后的状态查询 / 自动加载按实际后端分发
+    return {**result, "backend": backend.name, "backend_tool": backend.tool_name, "route_reason": decision.reason}
 
 
 @tool(description=TEXT_TO_VIDEO_DESC)
+@_instrument_tool
 def text_to_video_by_kie_sora2_create_task(
     prompt: str, 
     seed: int,
     aspect_ratio: str = DEFAULT_ASPECT_RATIO, 
-    n_frames: str = DEFAULT_N_FRAMES
+    n_frames: str = DEFAULT_N_FRAMES,
+    num_variants: int = 1
     ) -> str:
     payload = {
         "model": "sora-2-text-to-video",
@@ -243,27 +624,23 @@ def text_to_video_by_kie_sora2_create_task(
         }
     }
 
-    response = requests.post(CREATE_TASK_URL, headers=_get_headers(), data=json.dumps(payload))
-    result = response.json()
-
-    if not result or "data" not in result or not result["data"]:
-        logger.error(f"KIE API Error in text_to_video: {result}")
-        return f"Error creating task: {result.get('msg', 'Unknown error')} (Response: {result})"
-
-    return {
-        "task_id": result["data"]["taskId"],
-        "status": "Text to Video Task created successfully!",
-        "model": "sora2-text-to-video"
-    }
+    return _submit_variants(
+        lambda: _create_kie_task(payload, "text_to_video"),
+        _normalize_num_variants(num_variants),
+        status="Text to Video Task created successfully!",
+        model="sora2-text-to-video",
+    )
 
 
 @tool(description=FIRST_FRAME_TO_VIDEO_DESC)
+@_instrument_tool
 def  first_frame_to_video_by_kie_sora2_create_task(
     prompt: str, 
     image_urls: list[str], 
     seed: int, 
     aspect_ratio: str = DEFAULT_ASPECT_RATIO, 
-    n_frames: str = DEFAULT_N_FRAMES
+    n_frames: str = DEFAULT_N_FRAMES,
+    num_variants: int = 1
     ) -> str:
     payload = {
         "model": "sora-2-image-to-video",
@@ -277,21 +654,16 @@ def  first_frame_to_video_by_kie_sora2_create_task(
         }
     }
     
-    response = requests.post(CREATE_TASK_URL, headers=_get_headers(), data=json.dumps(payload))
-    result = response.json()
-
-    if not result or "data" not in result or not result["data"]:
-        logger.error(f"KIE API Error in first_frame_to_video: {result}")
-        return f"Error creating task: {result.get('msg', 'Unknown error')} (Response: {result})"
-
-    return {
-        "task_id": result["data"]["taskId"],
-        "status": "First Frame to Video Task created successfully!",
-        "model": "sora2-image-to-video"
-    }
+    return _submit_variants(
+        lambda: _create_kie_task(payload, "first_frame_to_video"),
+        _normalize_num_variants(num_variants),
+        status="First Frame to Video Task created successfully!",
+        model="sora2-image-to-video",
+    )
 
 
 @tool(description=REMOVE_WATERMARK_DESC)
+@_instrument_tool
 def remove_watermark_from_image_by_kie_seedream_v4_create_task(
     prompt: str, 
     image_urls: list[str], 
@@ -303,34 +675,56 @@ def remove_watermark_from_image_by_kie_seedream_v4_create_task(
         "input": {
             "prompt": prompt,
             "image_urls": image_urls,
-            "max_images": DEFAULT_MAX_IMAGES
+            "max_images": 1  # 去水印只需要一张结果，不跟随 KIE_DEFAULT_MAX_IMAGES
         }
     }
 
-    response = requests.post(CREATE_TASK_URL, headers=_get_headers(), data=json.dumps(payload))
-    result = response.json()
-    
-    if not result or "data" not in result or not result["data"]:
-        logger.error(f"KIE API Error in remove_watermark: {result}")
-        return f"Error creating task: {result.get('msg', 'Unknown error')} (Response: {result})"
+    result = _create_kie_task(payload, "remove_watermark")
+    if isinstance(result, str):
+        return result
 
     return {
-        "task_id": result["data"]["taskId"],
+        "task_id": result["task_id"],
         "status": "Remove Watermark Task created successfully!",
         "model": "seedream-v4-edit-image"
     }
 
 # --- 内部 Helper Functions (非 Tool) ---
 
-def _get_kie_task_status_impl(task_id: str) -> Union[str, dict]:
+def _route_complete(task_id: str, ok: bool, seconds: float | None = None) -> None:
+    """任务完成时回报给编辑路由；EDIT_ROUTER 未开启时不维护路由状态"""
+    if backend_router.EDIT_ROUTER:
+        backend_router.router.complete(task_id, ok, seconds)
+
+
+def _kie_cost_seconds(data: dict) -> float | None:
+    """KIE 侧记录的任务耗时 (completeTime - createTime，毫秒时间戳)；缺失时返回 None，只记录结果不记录延迟"""
+    created, completed = data.get("createTime"), data.get("completeTime")
+    if isinstance(created, (int, float)) and isinstance(completed, (int, float)) and completed >= created:
+        return (completed - created) / 1000.0
+    return None
+
+
+def _get_kie_task_status_impl(task_id: str) -> Union[str, list[str], dict]:
+    import requests  # 延迟导入，缩短图模块的启动时间
+
     try:
         params = {"taskId": task_id}
-        response = requests.get(RECORD_INFO_URL, headers=_get_headers(content_type=None), params=params)
+
+        def _call():
+            response = requests.get(RECORD_INFO_URL, headers=_get_headers(content_type=None), params=params)
+            return {
+                "status_code": response.status_code,
+                "body": response.json() if response.status_code == 200 else None,
+            }
+
+        metrics.STATUS_POLLS.inc(provider="kie")
+        response = _provider_call("kie.recordInfo", params, _call)
         
-        if response.status_code != 200:
-            return f"API Error: HTTP {response.status_code}"
+        if response["status_code"] != 200:
+            return f"API Error: HTTP {response['status_code']}"
             
-        result = response.json()
+        result = response["body"]
 
         if not result or "data" not in result or not result["data"]:
             return "Task ID not found in KIE system."
@@ -338,17 +732,24 @@ def _get_kie_task_status_impl(task_id: str) -> Union[str, dict]:
         data = result["data"]
         state = data.get("state")
 
+        if state != "success":
+            metrics.WASTED_POLLS.inc(provider="kie")
         if state == "success":
             # 安全解析 JSON
             try:
                 result_json = json.loads(data.get('resultJson', '{}'))
                 if 'resultUrls' in result_json and result_json['resultUrls']:
-                    return result_json['resultUrls'][0]
+                    _route_complete(task_id, True, _kie_cost_seconds(data))
+                    return _status_result(result_json['resultUrls'])
                 else:
+                    _route_complete(task_id, False)
                     return "Task succeeded but no result URL found."
             except json.JSONDecodeError:
+                _route_complete(task_id, False)
                 return "Task succeeded but resultJson is invalid."
         else:
+            if str(state).lower() in ("fail", "failed", "error"):
+                _route_complete(task_id, False)
             return {
                 "status": state,
                 "code": data.get("failCode"),
@@ -359,9 +760,9 @@ def _get_kie_task_status_impl(task_id: str) -> Union[str, dict]:
         return f"Error checking KIE task status: {str(e)}"
 
 
-def _get_ppio_task_status_impl(task_id: str, max_retries: int = 60, delay: float = 2.0) -> str:
+def _get_ppio_task_status_impl(task_id: str, max_retries: int = 60, delay: float = 2.0) -> Union[str, list[str]]:
     """
-    查询 PPIO 任务状态的内部实现。
+    查询 PPIO 任务状态的内部实现。成功时返回结果 URL (多张时为 URL 列表)。
     
     Args:
         task_id: 任务 ID
@@ -370,54 +771,88 @@ def _get_ppio_task_status_impl(task_id: str, max_retries: int = 60, delay: float
         
     总等待时间 ≈ max_retries * delay (默认 20秒)
     """
-    if not supabase:
+    if not _supabase_available():
         return "Database connection failed."
         
-    import time
+
+    # 回放 cassette 时响应已录制好，无需真实等待
+    if cassette.replaying():
+        delay = 0
     
     for attempt in range(max_retries):
         try:
             # 查询 Supabase
-            response = supabase.table("ppio_task_status").select("url").eq("id", task_id).execute()
+            metrics.STATUS_POLLS.inc(provider="ppio")
+            rows = _supabase_select_url(task_id)
             
-            if not response.data:
+            if not rows:
                 # 如果刚创建还没入库（极少见），或者 ID 错误
+                metrics.WASTED_POLLS.inc(provider="ppio")
                 if attempt < 3: # 前几次允许容错
-                    time.sleep(1)
+                    time.sleep(1 if delay else 0)
                     continue
                 return "Task ID not found in PPIO database."
                 
-            record = response.data[0]
-            url = record.get("url")
+            record = rows[0]
             
             # 1. 成功获取到 URL
-            if url and isinstance(url, str) and url.strip():
-                return url
+            urls = _record_urls(record)
+            if urls:
+                return _status_result(urls)
             
             # 2. URL 为空，说明还在生成中，等待后重试
+            metrics.WASTED_POLLS.inc(provider="ppio")
             # 使用简单的线性等待，避免阻塞太久，但给予足够的时间窗口
             if attempt < max_retries - 1:
                 time.sleep(delay)
                 
         except Exception as e:
-            logger.warning(f"Error querying Supabase (attempt {attempt+1}/{max_retries}): {e}")
+            logger.warning("Error querying Supabase (attempt %d/%d): %s", attempt + 1, max_retries, e)
             # 网络错误也进行简短避让后重试
             time.sleep(1)
             
     return "Task is processing."
 
 
+def _get_task_status_by_tool_impl(tool_name: str | None, task_id: str) -> Union[str, list[str], dict]:
+    """根据创建任务的工具名分发到 KIE 或 PPIO 的查询实现"""
+    name = (tool_name or "").lower()
+    
+    # 简单的分发逻辑
+    with tracing.span("task.status", task_id=task_id, **{"tool.name": tool_name}):
+        if "ppio" in name or "banana" in name:
+            return _get_ppio_task_status_impl(task_id)
+        else:
+            # Default to KIE or check if it's a KIE tool
+            return _get_kie_task_status_impl(task_id)
+
+
+def _get_task_group_status_impl(tool_name: str | None, task_ids: list[str]) -> list[Union[str, list[str], dict]]:
+    """并发查询任务组内每个变体的状态，结果顺序与 task_ids 一致"""
+    if not task_ids:
+        return []
+    if len(task_ids) == 1:
+        return [_get_task_status_by_tool_impl(tool_name, task_ids[0])]
+    with ThreadPoolExecutor(max_workers=len(task_ids), thread_name_prefix="variant-status") as pool:
+        return list(pool.map(tracing.propagate(lambda tid: _get_task_status_by_tool_impl(tool_name, tid)), task_ids))
+
+
 @tool(description=GET_TASK_STATUS_DESC)
-def get_task_status(task_id: str, state: Annotated[dict, InjectedState]) -> Union[str, dict]:
+@_instrument_tool
+def get_task_status(task_id: str, state: Annotated[dict, InjectedState]) -> Union[str, list[str], dict]:
     """
     Unified task status checker.
     Dispatches to the correct API (KIE or PPIO) based on the tool used to create the task.
     """
-    last_tool = state.get("last_tool_name", "").lower()
-    
-    # 简单的分发逻辑
-    if "ppio" in last_tool or "banana" in last_tool:
-        return _get_ppio_task_status_impl(task_id)
-    else:
-        # Default to KIE or check if it's a KIE tool
-        return _get_kie_task_status_impl(task_id)
+    last_tool = state.get("last_tool_name", "")
+
+    # 任务组：逐个变体查询
+    group = _TASK_GROUPS.get(task_id)
+    if group is None and task_id == state.get("last_task_id") and len(state.get("last_task_ids") or []) > 1:
+        group = state["last_task_ids"]
+    if group:
+        statuses = _get_task_group_status_impl(last_tool, group)
+        return {"variants": [{"variant": i + 1, "task_id": tid, "result": res}
+                             for i, (tid, res) in enumerate(zip(group, statuses))]}
+
+    return _get_task_status_by_tool_impl(last_tool, task_id)
@@ -0,0 +1,240 @@
+"""
+图入口的准入控制与背压：按图 / 按用户限制在途轮次，有界排队，超载时快速拒绝
+
+流量突增时每个请求都会立刻发起 LLM 调用与 Provider 任务，所有人的延迟一起变差并触发上游限流。
+graph_factory 在 initial_prep 之前加入 admission 节点，在回答结束前加入 admission_release 节点：
+- 每个图最多 ADMISSION_MAX_INFLIGHT 个在途轮次，每个用户 (configurable.user_id，缺省为 thread_id)
+  最多 ADMISSION_MAX_PER_USER 个
+- 图已满时进入有界队列，最多等待 ADMISSION_MAX_WAIT_MS；队列已满或用户超限时立即拒绝
+- 准入后发放带 TTL 的租约 (写入 state.admission)，轮次结束时释放；中途异常未释放的租约在 TTL 后自动回收
+指标：mynamechat_admission_in_flight / queue_depth (gauge)、rejections_total{reason}、wait_seconds
+
+两个限制都为 0 (默认) 时不启用，admission 节点直接放行。
+
+同一会话的轮次串行 (始终开启)：TurnLocks 由 TemplateGraph.invoke / astream_events 在整个 app 调用之外获取
+(图内节点运行时 checkpoint 已加载，在节点里加锁的轮次会基于旧状态执行并覆盖上一轮的结果)，
+按到达顺序排队，等待超过 SESSION_TURN_WAIT_MS 时以 turn_busy 拒绝且不进入图；会话锁与租约共用 TTL。
+进程内调用 (CLI / batch_runner / load_test / eval_runner) 经过这两个包装；LangGraph Server 部署时由服务端按 thread
+串行 run (客户端使用 multitask_strategy="enqueue" 排队，默认 reject 直接拒绝重叠的 run)。
+被拒绝的轮次只在 state.admission.message 中返回繁忙提示，不写入 messages。
+
+环境变量：
+    ADMISSION_MAX_INFLIGHT=0      每个图的在途轮次上限 (0 = 不限)
+    ADMISSION_MAX_PER_USER=0      每个用户的在途轮次上限 (0 = 不限)
+    ADMISSION_MAX_QUEUE=64        每个图排队等待的上限
+    ADMISSION_MAX_WAIT_MS=2000    排队最长等待
+    ADMISSION_LEASE_TTL=600       租约有效期 (秒)
+    SESSION_TURN_WAIT_MS=30000    同一会话等待上一轮完成的最长时间
+"""
+import os
+import threading
+import time
+import uuid
+from collections import Counter, deque
+
+import metrics
+from logger_util import get_logger
+
+logger = get_logger("mynamechat.admission")
+
+ADMISSION_MAX_INFLIGHT = int(os.getenv("ADMISSION_MAX_INFLIGHT") or 0)
+ADMISSION_MAX_PER_USER = int(os.getenv("ADMISSION_MAX_PER_USER") or 0)
+ADMISSION_MAX_QUEUE = int(os.getenv("ADMISSION_MAX_QUEUE") or 64)
+ADMISSION_MAX_WAIT_MS = float(os.getenv("ADMISSION_MAX_WAIT_MS") or 2000)
+ADMISSION_LEASE_TTL = float(os.getenv("ADMISSION_LEASE_TTL") or 600)
+SESSION_TURN_WAIT_MS = float(os.getenv("SESSION_TURN_WAIT_MS") or 30000)
+
+ANONYMOUS_USER = "anonymous"
+
+# 拒绝原因
+REJECT_USER_LIMIT = "user_limit"
+REJECT_QUEUE_FULL = "queue_full"
+REJECT_TIMEOUT = "timeout"
+REJECT_TURN_BUSY = "turn_busy"
+
+
+class AdmissionController:
+    """进程内共享：在途数按图名与用户分别计数，同一用户在不同图上的请求合并计算"""
+
+    def __init__(self, max_inflight: int = 0, max_per_user: int = 0, max_queue: int = 64,
+                 max_wait: float = 2.0, lease_ttl: float = 600.0):
+        self.max_inflight = max_inflight
+        self.max_per_user = max_per_user
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.lease_ttl = lease_ttl
+        self._cond = threading.Condition()
+        self._leases: dict[str, tuple[str, str, float]] = {}  # lease_id -> (graph, user, expires_at)
+        self._graph_counts: Counter = Counter()
+        self._user_counts: Counter = Counter()
+        self._waiting: Counter = Counter()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_inflight > 0 or self.max_per_user > 0
+
+    def _reap(self, now: float) -> None:
+        for lease_id, (graph, user, expires_at) in list(self._leases.items()):
+            if expires_at <= now:
+                logger.warning("Admission lease %s (%s/%s) expired without release, reclaiming", lease_id, graph, user)
+                self._drop(lease_id)
+
+    def _drop(self, lease_id: str) -> bool:
+        lease = self._leases.pop(lease_id, None)
+        if lease is None:
+            return False
+        graph, user, _ = lease
+        self._graph_counts[graph] -= 1
+        self._user_counts[user] -= 1
+        metrics.ADMISSION_IN_FLIGHT.set(self._graph_counts[graph], graph=graph)
+        self._cond.notify_all()
+        return True
+
+    def _graph_full(self, graph: str) -> bool:
+        return self.max_inflight > 0 and self._graph_counts[graph] >= self.max_inflight
+
+    def _user_full(self, user: str) -> bool:
+        return self.max_per_user > 0 and self._user_counts[user] >= self.max_per_user
+
+    def _grant(self, graph: str, user: str, now: float) -> str:
+        lease_id = uuid.uuid4().hex
+        self._leases[lease_id] = (graph, user, now + self.lease_ttl)
+        self._graph_counts[graph] += 1
+        self._user_counts[user] += 1
+        metrics.ADMISSION_IN_FLIGHT.set(self._graph_counts[graph], graph=graph)
+        return lease_id
+
+    def _reject(self, graph: str, reason: str) -> tuple[None, str]:
+        metrics.ADMISSION_REJECTIONS.inc(graph=graph, reason=reason)
+        logger.warning("Admission rejected on %s: %s (in_flight=%d waiting=%d)",
+                       graph, reason, self._graph_counts[graph], self._waiting[graph])
+        return None, reason
+
+    def acquire(self, graph: str, user: str | None) -> tuple[str | None, str]:
+        """返回 (lease_id, "admitted") 或 (None, 拒绝原因)"""
+        user = user or ANONYMOUS_USER
+        started = time.monotonic()
+        with self._cond:
+            self._reap(started)
+            # 同一用户超限时不排队：通常是重复提交，排队只会占住队列位置
+            if self._user_full(user):
+                return self._reject(graph, REJECT_USER_LIMIT)
+            if not self._graph_full(graph):
+                return self._grant(graph, user, started), "admitted"
+            if self._waiting[graph] >= self.max_queue:
+                return self._reject(graph, REJECT_QUEUE_FULL)
+
+            self._waiting[graph] += 1
+            metrics.ADMISSION_QUEUE_DEPTH.set(self._waiting[graph], graph=graph)
+            try:
+                deadline = started + self.max_wait
+                while self._graph_full(graph) or self._user_full(user):
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        return self._reject(graph, REJECT_TIMEOUT)
+                    self._cond.wait(remaining)
+                    self._reap(time.monotonic())
+                now = time.monotonic()
+                metrics.ADMISSION_WAIT_SECONDS.observe(now - started, graph=graph)
+                return self._grant(graph, user, now), "admitted"
+            finally:
+                self._waiting[graph] -= 1
+                metrics.ADMISSION_QUEUE_DEPTH.set(self._waiting[graph], graph=graph)
+
+    def release(self, lease_id: str | None) -> bool:
+        if not lease_id:
+            return False
+        with self._cond:
+            return self._drop(lease_id)
+
+    def snapshot(self) -> dict:
+        with self._cond:
+            return {"in_flight": dict(+self._graph_counts), "users": len(+self._user_counts),
+                    "waiting": dict(+self._waiting), "leases": len(self._leases)}
+
+
+class TurnLocks:
+    """同一会话 (key) 同时只有一个轮次在执行；等待者按到达顺序排队，持有者超过 TTL 未释放时自动回收"""
+
+    def __init__(self, max_wait: float = 30.0, ttl: float = 600.0):
+        self.max_wait = max_wait
+        self.ttl = ttl
+        self._cond = threading.Condition()
+        self._holders: dict[str, tuple[str, float]] = {}  # key -> (token, expires_at)
+        self._queues: dict[str, deque] = {}  # key -> 等待中的 token
+
+    def _reap(self, key: str, now: float) -> None:
+        holder = self._holders.get(key)
+        if holder is not None and holder[1] <= now:
+            logger.warning("Session turn lock %s expired without release, reclaiming", key)
+            del self._holders[key]
+
+    def acquire(self, key: str, graph: str) -> str | None:
+        """返回本轮的 token；等待超时返回 None"""
+        token = uuid.uuid4().hex
+        started = time.monotonic()
+        with self._cond:
+            queue = self._queues.setdefault(key, deque())
+            queue.append(token)
+            try:
+                deadline = started + self.max_wait
+                while True:
+                    now = time.monotonic()
+                    self._reap(key, now)
+                    if key not in self._holders and queue[0] == token:
+                        break
+                    if now >= deadline:
+                        metrics.ADMISSION_REJECTIONS.inc(graph=graph, reason=REJECT_TURN_BUSY)
+                        logger.warning("Session turn on %s rejected: previous turn still running after %.0fms",
+                                       key, (now - started) * 1000)
+                        return None
+                    self._cond.wait(deadline - now)
+                self._holders[key] = (token, now + self.ttl)
+                metrics.SESSION_TURN_WAIT_SECONDS.observe(now - started, graph=graph)
+                return token
+            finally:
+                queue.remove(token)
+                if not queue:
+                    del self._queues[key]
+                # 队首变化 (获取或放弃)，唤醒后面的等待者
+                self._cond.notify_all()
+
+    def release(self, key: str | None, token: str | None) -> bool:
+        if not key or not token:
+            return False
+        with self._cond:
+            holder = self._holders.get(key)
+            if holder is None or holder[0] != token:
+                return False  # 已被 TTL 回收并由下一轮持有
+            del self._holders[key]
+            self._cond.notify_all()
+            return True
+
+    def snapshot(self) -> dict:
+        with self._cond:
+            return {"held": len(self._holders), "waiting": sum(len(q) for q in self._queues.values())}
+
+
+controller = AdmissionController(
+    max_inflight=ADMISSION_MAX_INFLIGHT,
+    max_per_user=ADMISSION_MAX_PER_USER,
+    max_queue=ADMISSION_MAX_QUEUE,
+    max_wait=ADMISSION_MAX_WAIT_MS / 1000.0,
+    lease_ttl=ADMISSION_LEASE_TTL,
+)
+
+
+turns = TurnLocks(max_wait=SESSION_TURN_WAIT_MS / 1000.0, ttl=ADMISSION_LEASE_TTL)
+
+
+def thread_of(config: dict | None) -> str | None:
+    """会话标识：configurable.thread_id；没有 thread_id 的调用每次都是独立状态，不需要串行"""
+    thread_id = ((config or {}).get("configurable") or {}).get("thread_id")
+    return str(thread_id) if thread_id else None
+
+
+def user_of(input_dict: dict, config: dict | None) -> str:
+    """用户标识：configurable.user_id > 输入中的 user_id > thread_id"""
+    configurable = (config or {}).get("configurable") or {}
+    return str(configurable.get("user_id") or input_dict.get("user_id") or configurable.get("thread_id")
+               or ANONYMOUS_USER)
@@ -0,0 +1,242 @@
+"""
+图像编辑后端路由：按滚动完成延迟与错误率，在满足质量约束的后端中选择当前最快的健康后端
+
+KIE Seedream (image_edit_by_kie_seedream_v4_create_task) 与 PPIO Banana Pro (image_edit_by_ppio_banana_pro_create_task)
+能力重叠，原来只由图的静态 tools 列表决定走哪个。KIE_tools.image_edit_routed_create_task 通过这里选择后端。
+路由是可选的：EDIT_ROUTER=1 时模板才额外注册路由工具 (具名模型工具仍然保留)，且默认质量下限为 high (只选 Banana Pro)，
+允许降到 Seedream 需要显式设置 EDIT_ROUTER_MIN_QUALITY=standard：
+- 每个后端保留最近 EDIT_ROUTER_WINDOW_S 秒内的完成记录 (后端侧生成耗时、成功 / 失败)：
+  KIE 在状态查询看到 success / fail 时记录，耗时取 KIE 的 completeTime - createTime (缺失时只记结果)；
+  PPIO 在后台任务结束时记录，耗时取 Banana Pro 接口调用本身 (不含转存与回写)。两者都不含本地轮询间隔，p50 可比。
+  提交失败直接记为失败。长时间没人查询的在途任务按窗口过期，不计入错误
+- 约束：质量档位 >= min_quality (工具参数，缺省为 EDIT_ROUTER_MIN_QUALITY)、max_images > 1 时后端需支持、
+  EDIT_ROUTER_BACKENDS 白名单
+- 健康：完成样本少于 EDIT_ROUTER_MIN_SAMPLES，或错误率 <= EDIT_ROUTER_MAX_ERROR_RATE
+- 选择：样本 (含在途) 不足的后端优先探索；否则取健康后端中 p50 完成延迟最小者；全部不健康时取错误率最低者
+每次决策输出一行日志、计数指标，并在设置 EDIT_ROUTER_AUDIT 时追加一行 JSON (含各候选后端的统计) 便于审计。
+指标：mynamechat_edit_route_decisions_total{backend, reason}、
+      mynamechat_edit_backend_completion_seconds{backend}、mynamechat_edit_backend_completions_total{backend, outcome}
+
+环境变量：
+    EDIT_ROUTER=1                   模板注册 image_edit_routed_create_task (默认不注册)
+    EDIT_ROUTER_BACKENDS=kie_seedream,ppio_banana_pro
+    EDIT_ROUTER_MIN_QUALITY=high    high | standard (默认 high 只会选择 Banana Pro；standard 时 Seedream 参与路由)
+    EDIT_ROUTER_WINDOW_S=1800
+    EDIT_ROUTER_MIN_SAMPLES=5
+    EDIT_ROUTER_MAX_ERROR_RATE=0.3
+    EDIT_ROUTER_AUDIT=logs/edit_routing.jsonl   决策审计文件 (不设置时只写日志与指标)
+"""
+import json
+import os
+import threading
+import time
+from collections import Counter, OrderedDict, deque
+from datetime import datetime
+from typing import NamedTuple
+
+import metrics
+from logger_util import get_logger
+
+logger = get_logger("mynamechat.backend_router")
+
+QUALITY_STANDARD = "standard"
+QUALITY_HIGH = "high"
+_QUALITY_RANK = {QUALITY_STANDARD: 1, QUALITY_HIGH: 2}
+
+EDIT_ROUTER = (os.getenv("EDIT_ROUTER") or "").lower() in ("1", "true", "yes", "on")
+EDIT_ROUTER_BACKENDS = [b.strip() for b in (os.getenv("EDIT_ROUTER_BACKENDS") or "kie_seedream,ppio_banana_pro").split(",")
+                        if b.strip()]
+EDIT_ROUTER_MIN_QUALITY = (os.getenv("EDIT_ROUTER_MIN_QUALITY") or QUALITY_HIGH).lower()
+EDIT_ROUTER_WINDOW_S = float(os.getenv("EDIT_ROUTER_WINDOW_S") or 1800)
+EDIT_ROUTER_MIN_SAMPLES = int(os.getenv("EDIT_ROUTER_MIN_SAMPLES") or 5)
+EDIT_ROUTER_MAX_ERROR_RATE = float(os.getenv("EDIT_ROUTER_MAX_ERROR_RATE") or 0.3)
+EDIT_ROUTER_AUDIT = os.getenv("EDIT_ROUTER_AUDIT") or None
+
+# 在途任务登记上限 (LRU)：KIE 任务只有被查询时才知道完成，没人查询的任务不能无限堆积
+MAX_PENDING = 4096
+
+# 决策原因
+REASON_ONLY = "only_candidate"
+REASON_EXPLORE = "explore"
+REASON_FASTEST = "fastest"
+REASON_DEGRADED = "all_unhealthy"
+
+
+class Backend(NamedTuple):
+    name: str
+    tool_name: str  # 实际执行的工具名：写入工具结果的 backend_tool，recorder / 自动加载据此选择状态查询函数
+    quality: str
+    max_images: int
+
+
+KIE_SEEDREAM = Backend("kie_seedream", "image_edit_by_kie_seedream_v4_create_task", QUALITY_STANDARD, 6)
+PPIO_BANANA_PRO = Backend("ppio_banana_pro", "image_edit_by_ppio_banana_pro_create_task", QUALITY_HIGH, 1)
+BACKENDS = {b.name: b for b in (KIE_SEEDREAM, PPIO_BANANA_PRO)}
+
+
+class RouteDecision(NamedTuple):
+    backend: Backend
+    reason: str
+    candidates: dict  # 后端名 -> 决策时的统计快照
+
+
+class EditRouter:
+    """进程内共享：按后端维护滚动窗口内的完成记录与在途任务"""
+
+    def __init__(self, allowed: list[str], min_quality: str = QUALITY_HIGH, window_s: float = 1800.0,
+                 min_samples: int = 5, max_error_rate: float = 0.3, audit_path: str | None = None):
+        self.allowed = [name for name in allowed if name in BACKENDS]
+        self.min_quality = min_quality if min_quality in _QUALITY_RANK else QUALITY_HIGH
+        self.window_s = window_s
+        self.min_samples = min_samples
+        self.max_error_rate = max_error_rate
+        self.audit_path = audit_path
+        self._lock = threading.Lock()
+        self._events: dict[str, deque] = {name: deque() for name in BACKENDS}  # (完成时间, 耗时秒 | None, 是否成功)
+        self._pending: "OrderedDict[str, tuple[str, float]]" = OrderedDict()  # task_id -> (backend, 提交时间)
+        self._in_flight: Counter = Counter()
+        self._audit_file = None
+
+    # --- 观测 ---
+    def _prune(self, now: float) -> None:
+        cutoff = now - self.window_s
+        for events in self._events.values():
+            while events and events[0][0] < cutoff:
+                events.popleft()
+        while self._pending:
+            backend, submitted_at = next(iter(self._pending.values()))
+            if submitted_at >= cutoff and len(self._pending) <= MAX_PENDING:
+                break
+            self._pending.popitem(last=False)
+            self._in_flight[backend] -= 1
+
+    def _record(self, backend: str, seconds: float | None, ok: bool, now: float) -> None:
+        self._events[backend].append((now, seconds, ok))
+        metrics.EDIT_BACKEND_COMPLETIONS.inc(backend=backend, outcome="success" if ok else "error")
+        if ok and seconds is not None:
+            metrics.EDIT_BACKEND_SECONDS.observe(seconds, backend=backend)
+
+    def submitted(self, backend: str, task_id: str) -> None:
+        """登记一个已提交的任务，完成时调用 complete"""
+        now = time.monotonic()
+        with self._lock:
+            self._pending[task_id] = (backend, now)
+            self._in_flight[backend] += 1
+            self._prune(now)
+
+    def submit_failed(self, backend: str) -> None:
+        now = time.monotonic()
+        with self._lock:
+            self._record(backend, None, False, now)
+
+    def complete(self, task_id: str, ok: bool, seconds: float | None = None) -> bool:
+        """
+        任务完成 (出图或失败)；未登记或已记录过的 task_id 返回 False。
+        seconds 为后端侧的生成耗时，缺失时只计入成功 / 失败：按本地观察时间计算会把 KIE 的轮询间隔也算进去
+        """
+        now = time.monotonic()
+        with self._lock:
+            pending = self._pending.pop(task_id, None)
+            if pending is None:
+                return False
+            backend, _ = pending
+            self._in_flight[backend] -= 1
+            self._record(backend, seconds, ok, now)
+            return True
+
+    # --- 统计 ---
+    def _stats(self, backend: str) -> dict:
+        events = self._events[backend]
+        latencies = sorted(seconds for _, seconds, ok in events if ok and seconds is not None)
+        errors = sum(1 for _, _, ok in events if not ok)
+        samples = len(events)
+        error_rate = errors / samples if samples else 0.0
+        return {
+            "samples": samples,
+            "errors": errors,
+            "error_rate": round(error_rate, 3),
+            "p50_s": round(latencies[len(latencies) // 2], 2) if latencies else None,
+            "in_flight": self._in_flight[backend],
+            "healthy": samples < self.min_samples or error_rate <= self.max_error_rate,
+        }
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            self._prune(time.monotonic())
+            return {name: self._stats(name) for name in BACKENDS}
+
+    # --- 路由 ---
+    def _eligible(self, min_quality: str, max_images: int = 1) -> list[Backend]:
+        rank = _QUALITY_RANK.get(min_quality, _QUALITY_RANK[self.min_quality])
+        return [BACKENDS[name] for name in self.allowed
+                if _QUALITY_RANK[BACKENDS[name].quality] >= rank and BACKENDS[name].max_images >= max_images]
+
+    def max_images_limit(self, min_quality: str | None = None) -> int:
+        """满足质量下限的后端中，单个任务最多能输出的图片数；没有后端满足时为 0"""
+        eligible = self._eligible((min_quality or self.min_quality).lower())
+        return max((b.max_images for b in eligible), default=0)
+
+    def choose(self, min_quality: str | None = None, max_images: int = 1) -> RouteDecision | None:
+        """在满足约束的后端中选择；没有后端满足约束时返回 None"""
+        min_quality = (min_quality or self.min_quality).lower()
+        eligible = self._eligible(min_quality, max_images)
+        if not eligible:
+            logger.warning("No edit backend satisfies min_quality=%s max_images=%d (allowed=%s)",
+                           min_quality, max_images, self.allowed)
+            return None
+
+        with self._lock:
+            self._prune(time.monotonic())
+            stats = {b.name: self._stats(b.name) for b in eligible}
+
+        def _observed(b: Backend) -> int:
+            return stats[b.name]["samples"] + stats[b.name]["in_flight"]
+
+        exploring = [b for b in eligible if _observed(b) < self.min_samples]
+        healthy = [b for b in eligible if stats[b.name]["healthy"] and stats[b.name]["p50_s"] is not None]
+        if len(eligible) == 1:
+            backend, reason = eligible[0], REASON_ONLY
+        elif exploring:
+            backend, reason = min(exploring, key=_observed), REASON_EXPLORE
+        elif healthy:
+            backend, reason = min(healthy, key=lambda b: stats[b.name]["p50_s"]), REASON_FASTEST
+        else:
+            backend, reason = min(eligible, key=lambda b: stats[b.name]["error_rate"]), REASON_DEGRADED
+
+        decision = RouteDecision(backend, reason, stats)
+        self._audit(decision, min_quality, max_images)
+        return decision
+
+    def _audit(self, decision: RouteDecision, min_quality: str, max_images: int) -> None:
+        metrics.EDIT_ROUTES.inc(backend=decision.backend.name, reason=decision.reason)
+        logger.info("Edit routed to %s (%s) min_quality=%s max_images=%d candidates=%s", decision.backend.name,
+                    decision.reason, min_quality, max_images, decision.candidates)
+        if not self.audit_path:
+            return
+        line = json.dumps({
+            "ts": datetime.now().isoformat(timespec="milliseconds"),
+            "backend": decision.backend.name,
+            "tool": decision.backend.tool_name,
+            "reason": decision.reason,
+            "min_quality": min_quality,
+            "max_images": max_images,
+            "candidates": decision.candidates,
+        }, ensure_ascii=False)
+        with self._lock:
+            try:
+                if self._audit_file is None:
+                    os.makedirs(os.path.dirname(self.audit_path) or ".", exist_ok=True)
+                    self._audit_file = open(self.audit_path, "a", encoding="utf-8", buffering=1)
+                self._audit_file.write(line + "\n")
+            except OSError as e:
+                logger.warning("Failed to write edit routing audit %s: %s", self.audit_path, e)
+
+
+router = EditRouter(
+    allowed=EDIT_ROUTER_BACKENDS,
+    min_quality=EDIT_ROUTER_MIN_QUALITY,
+    window_s=EDIT_ROUTER_WINDOW_S,
+    min_samples=EDIT_ROUTER_MIN_SAMPLES,
+    max_error_rate=EDIT_ROUTER_MAX_ERROR_RATE,
+    audit_path=EDIT_ROUTER_AUDIT,
+)
@@ -0,0 +1,296 @@
+"""
+离线批量运行器：把 JSONL 请求文件推过任意一个已编译的 `app` 图
+
+每行一个 payload，格式与 prepare_state_from_payload 一致：
+    {"id": "shot-001", "user_query": "...", "references": [{"url": "...", "desc": "..."}]}
+
+特性：
+- 可配置并发 (--concurrency)
+- 按 provider 限流 (--rate-limit kie=2 --rate-limit ppio=1:3 --rate-limit llm=5)
+- 可恢复：输出 JSONL 与 checkpoint 文件记录已完成的请求，重跑时自动跳过；
+  运行中按完成顺序追加写入，结束时压缩输出文件，每个 id 只保留最后一条记录 (重跑成功的请求不再留下旧的 error 行)
+- 输出每条请求的 task_id、工具、回答、(可选) 生成结果 URL 与耗时
+
+用法：
+    python batch_runner.py storyboard.jsonl --graph my_name_chat_agent -o results.jsonl -c 4
+"""
+import argparse
+import importlib
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from types import ModuleType
+from typing import Iterator
+
+import rate_limiter
+from logger_util import get_logger
+
+logger = get_logger("mynamechat.batch")
+
+LANGGRAPH_CONFIG = os.path.join(os.path.dirname(os.path.abspath(__file__)), "langgraph.json")
+DEFAULT_CONCURRENCY = 4
+CHECKPOINT_EVERY = 10  # 每完成 N 条写一次 checkpoint
+DEFAULT_RESULT_TIMEOUT = 15 * 60
+
+
+def graph_names() -> list[str]:
+    with open(LANGGRAPH_CONFIG, encoding="utf-8") as f:
+        return list(json.load(f)["graphs"])
+
+
+def load_graph_module(graph_name: str) -> ModuleType:
+    """按 langgraph.json 中的图名导入模块 (例如 my_name_chat_agent -> MyNameTemplate)"""
+    with open(LANGGRAPH_CONFIG, encoding="utf-8") as f:
+        graphs = json.load(f)["graphs"]
+    if graph_name not in graphs:
+        raise ValueError(f"Unknown graph '{graph_name}'. Available: {', '.join(graphs)}")
+    path, _, attr = graphs[graph_name].partition(":")
+    module = importlib.import_module(os.path.splitext(os.path.basename(path))[0])
+    if not hasattr(module, attr or "app"):
+        raise ValueError(f"Module {module.__name__} has no attribute '{attr}'")
+    return module
+
+
+def extract_answer(message) -> tuple[str, list[str]]:
+    """从最后一条 AI 消息中取回答；结构化输出的图需要解析 JSON 中的 answer/suggestions"""
+    content = getattr(message, "content", "") or ""
+    if not isinstance(content, str):
+        return str(content), []
+    stripped = content.strip()
+    if stripped.startswith("{"):
+        try:
+            parsed = json.loads(stripped)
+            return parsed.get("answer", content), list(parsed.get("suggestions") or [])
+        except json.JSONDecodeError:
+            pass
+    return content, []
+
+
+def iter_requests(path: str) -> Iterator[tuple[str, dict]]:
+    """流式读取 JSONL，返回 (request_id, payload)；空行跳过"""
+    with open(path, encoding="utf-8") as f:
+        for line_no, line in enumerate(f, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            payload = json.loads(line)
+            request_id = str(payload.get("id") or payload.get("request_id") or f"line-{line_no}")
+            yield request_id, payload
+
+
+class BatchRunner:
+    def __init__(
+        self,
+        graph_name: str,
+        output_path: str,
+        concurrency: int = DEFAULT_CONCURRENCY,
+        checkpoint_path: str | None = None,
+        wait_results: bool = False,
+        result_timeout: float = DEFAULT_RESULT_TIMEOUT,
+        retry_failed: bool = True,
+    ):
+        self.graph_name = graph_name
+        self.module = load_graph_module(graph_name)
+        self.output_path = output_path
+        self.checkpoint_path = checkpoint_path or f"{output_path}.ckpt.json"
+        self.concurrency = max(1, concurrency)
+        self.wait_results = wait_results
+        self.result_timeout = result_timeout
+        self.retry_failed = retry_failed
+
+        self._write_lock = threading.Lock()
+        self._completed: set[str] = set()
+        self._since_checkpoint = 0
+        self.stats = {"ok": 0, "error": 0, "skipped": 0}
+
+    # --- 断点续跑 ---
+    def _load_progress(self) -> None:
+        if os.path.exists(self.checkpoint_path):
+            with open(self.checkpoint_path, encoding="utf-8") as f:
+                self._completed.update(json.load(f).get("completed", []))
+        # 输出文件是最终事实来源：checkpoint 之后才写入的结果同样计为已完成
+        if os.path.exists(self.output_path):
+            with open(self.output_path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue  # 上次中断时写了一半的行
+                    if record.get("status") == "ok" or not self.retry_failed:
+                        self._completed.add(record["id"])
+        if self._completed:
+            logger.info("Resuming batch: %d requests already completed", len(self._completed))
+
+    def _write_checkpoint(self) -> None:
+        tmp_path = f"{self.checkpoint_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({
+                "graph": self.graph_name,
+                "output": self.output_path,
+                "completed": sorted(self._completed),
+                "stats": self.stats,
+                "updated_at": datetime.now().isoformat(timespec="seconds"),
+            }, f, ensure_ascii=False)
+        os.replace(tmp_path, self.checkpoint_path)
+
+    def _record(self, record: dict) -> None:
+        with self._write_lock:
+            with open(self.output_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            self.stats[record["status"]] += 1
+            if record["status"] == "ok" or not self.retry_failed:
+                self._completed.add(record["id"])
+            self._since_checkpoint += 1
+            if self._since_checkpoint >= CHECKPOINT_EVERY:
+                self._since_checkpoint = 0
+                self._write_checkpoint()
+
+    def _compact_output(self) -> dict:
+        """输出文件每个 id 只保留最后一条记录 (按首次出现的顺序)，原子替换；返回压缩后各状态的条数"""
+        if not os.path.exists(self.output_path):
+            return {}
+        latest: dict[str, str] = {}
+        with open(self.output_path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue  # 上次中断时写了一半的行
+                latest[record["id"]] = line if line.endswith("\n") else line + "\n"
+        tmp_path = f"{self.output_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.writelines(latest.values())
+        os.replace(tmp_path, self.output_path)
+        totals: dict[str, int] = {}
+        for line in latest.values():
+            status = json.loads(line).get("status")
+            totals[status] = totals.get(status, 0) + 1
+        return totals
+
+    # --- 单条执行 ---
+    def _wait_for_results(self, tool_name: str, task_ids: list[str]) -> list[str | None]:
+        from pipeline_scheduler import _poll_task_once, SUCCEEDED, FAILED
+
+        deadline = time.monotonic() + self.result_timeout
+        urls: dict[str, str | None] = {}
+        while len(urls) < len(task_ids) and time.monotonic() < deadline:
+            for tid in task_ids:
+                if tid in urls:
+                    continue
+                status, payload = _poll_task_once(tool_name, tid)
+                if status == SUCCEEDED:
+                    urls[tid] = payload
+                elif status == FAILED:
+                    urls[tid] = None
+            if len(urls) < len(task_ids):
+                time.sleep(3.0)
+        return [urls.get(tid) for tid in task_ids]
+
+    def run_one(self, request_id: str, payload: dict) -> dict:
+        started_at = datetime.now().isoformat(timespec="milliseconds")
+        t0 = time.perf_counter()
+        record = {"id": request_id, "graph": self.graph_name, "started_at": started_at}
+        try:
+            state = self.module.prepare_state_from_payload(payload, {"messages": []})
+            # 每条请求一个 thread_id：启用 SESSION_CHECKPOINT_DB 时 checkpointer 需要它，准入控制也按它区分用户
+            final_state = self.module.invoke(state, config={"configurable": {"thread_id": request_id}})
+            t_graph = time.perf_counter()
+
+            admission = final_state.get("admission") or {}
+            if admission.get("status") == "rejected":
+                # 被准入控制拒绝的请求没有执行，记为失败 (默认 retry_failed，重跑时会再次执行)
+                record.update({"status": "error", "error": f"Admission rejected: {admission.get('reason')}",
+                               "graph_seconds": round(t_graph - t0, 3)})
+                record["total_seconds"] = round(time.perf_counter() - t0, 3)
+                return record
+
+            # 只有本轮真正创建了任务时才会写入 last_task_id
+            answer, suggestions = extract_answer(final_state["messages"][-1])
+            task_id = final_state.get("last_task_id")
+            task_ids = final_state.get("last_task_ids") or ([task_id] if task_id else [])
+            tool_name = final_state.get("last_tool_name")
+            record.update({
+                "status": "ok",
+                "task_id": task_id,
+                "task_ids": task_ids,
+                "tool": tool_name,
+                "task_config": final_state.get("last_task_config"),
+                "answer": answer,
+                "suggestions": suggestions or final_state.get("suggestions") or [],
+                "graph_seconds": round(t_graph - t0, 3),
+            })
+            if self.wait_results and task_ids:
+                record["result_urls"] = self._wait_for_results(tool_name, task_ids)
+                record["result_seconds"] = round(time.perf_counter() - t_graph, 3)
+        except Exception as e:
+            logger.error("Batch request %s failed: %s", request_id, e)
+            record.update({"status": "error", "error": f"{type(e).__name__}: {e}"})
+        record["total_seconds"] = round(time.perf_counter() - t0, 3)
+        return record
+
+    def run(self, input_path: str) -> dict:
+        self._load_progress()
+        t0 = time.perf_counter()
+        # 有界提交：同时排队的请求不超过 2 * concurrency，避免一次性读入整个文件
+        slots = threading.BoundedSemaphore(self.concurrency * 2)
+
+        def _task(request_id: str, payload: dict) -> None:
+            try:
+                self._record(self.run_one(request_id, payload))
+            finally:
+                slots.release()
+
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="batch") as pool:
+            for request_id, payload in iter_requests(input_path):
+                if request_id in self._completed:
+                    self.stats["skipped"] += 1
+                    continue
+                slots.acquire()
+                pool.submit(_task, request_id, payload)
+
+        with self._write_lock:
+            self._write_checkpoint()
+            totals = self._compact_output()
+        # stats 为本次运行的计数，output_totals 为压缩后输出文件中每个 id 的最终结果
+        summary = dict(self.stats, output_totals=totals, elapsed_seconds=round(time.perf_counter() - t0, 3))
+        logger.info("Batch finished: %s", summary)
+        return summary
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Run a JSONL file of payloads through a compiled graph.")
+    parser.add_argument("input", help="JSONL file, one {user_query, references} payload per line")
+    parser.add_argument("-g", "--graph", default="my_name_chat_agent", choices=graph_names())
+    parser.add_argument("-o", "--output", help="Result JSONL (default: <input>.results.jsonl)")
+    parser.add_argument("-c", "--concurrency", type=int, default=DEFAULT_CONCURRENCY)
+    parser.add_argument("--rate-limit", action="append", default=[], metavar="PROVIDER=RATE[:BURST]",
+                        help="Per-provider limit in requests/second; providers: kie, ppio, llm")
+    parser.add_argument("--checkpoint", help="Checkpoint file (default: <output>.ckpt.json)")
+    parser.add_argument("--wait-results", action="store_true", help="Poll created tasks until result URLs are ready")
+    parser.add_argument("--result-timeout", type=float, default=DEFAULT_RESULT_TIMEOUT)
+    parser.add_argument("--no-retry-failed", action="store_true", help="Do not re-run requests that errored before")
+    args = parser.parse_args(argv)
+
+    for spec in args.rate_limit:
+        rate_limiter.configure_rate_limit(*rate_limiter.parse_rate_limit(spec))
+
+    runner = BatchRunner(
+        graph_name=args.graph,
+        output_path=args.output or f"{os.path.splitext(args.input)[0]}.results.jsonl",
+        concurrency=args.concurrency,
+        checkpoint_path=args.checkpoint,
+        wait_results=args.wait_results,
+        result_timeout=args.result_timeout,
+        retry_failed=not args.no_retry_failed,
+    )
+    summary = runner.run(args.input)
+    print(json.dumps(summary, ensure_ascii=False))
+    return 0 if summary["error"] == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,151 @@
+"""
+会话 checkpoint 保存 / 加载延迟基准 (随历史长度变化)
+
+对比两种编码：
+- full：整个 checkpoint (含全部 messages) 每步 serde.dumps_typed + zlib，写一行 (普通 saver 的做法)
+- incremental：sqlite_checkpointer.SqliteCheckpointSaver，messages 只写新增 / 变化的部分
+
+每个规模测量：首次保存、追加一轮 (4 条消息) 后的增量保存、按 thread_id 加载最新 checkpoint，
+以及数据库文件大小。用法：
+    python bench_checkpoint.py --sizes 10,100,1000,10000 -o bench/checkpoint.json
+"""
+import argparse
+import json
+import os
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+import uuid
+import zlib
+
+from bench_history import DEFAULT_REPEATS, DEFAULT_SIZES, build_session, growth_slope
+
+# 每次增量保存追加的消息数 (一个完整工具回合)
+TURN_MESSAGES = 4
+
+
+def _checkpoint(messages: list, step: int) -> dict:
+    return {
+        "v": 1,
+        "id": f"{step:012d}-{uuid.uuid4().hex}",
+        "ts": "2026-01-01T00:00:00+00:00",
+        "channel_values": {
+            "messages": list(messages),
+            "last_task_id": str(uuid.uuid4()),
+            "last_tool_name": "image_edit_by_ppio_banana_pro_create_task",
+            "last_task_config": {"resolution": "2K", "aspect_ratio": "16:9"},
+            "global_config": {"resolution": "2K"},
+        },
+        "channel_versions": {"messages": step, "last_task_id": step},
+        "versions_seen": {},
+    }
+
+
+def _median_ms(samples: list[float]) -> float:
+    return round(statistics.median(samples) * 1000, 3)
+
+
+class _FullSaver:
+    """基线：每步把整个 checkpoint 编码成一行"""
+
+    def __init__(self, path: str):
+        from langgraph.checkpoint.serde.jsonplus import JsonPlusSerializer
+
+        self.serde = JsonPlusSerializer()
+        self._conn = sqlite3.connect(path)
+        self._conn.execute("CREATE TABLE checkpoints (thread_id TEXT, checkpoint_id TEXT, type TEXT, checkpoint BLOB, "
+                           "PRIMARY KEY (thread_id, checkpoint_id))")
+
+    def put(self, thread_id: str, checkpoint: dict) -> None:
+        type_, data = self.serde.dumps_typed(checkpoint)
+        with self._conn:
+            self._conn.execute("INSERT INTO checkpoints VALUES (?, ?, ?, ?)",
+                               (thread_id, checkpoint["id"], type_, zlib.compress(data, 6)))
+
+    def get(self, thread_id: str) -> dict:
+        type_, blob = self._conn.execute(
+            "SELECT type, checkpoint FROM checkpoints WHERE thread_id = ? ORDER BY checkpoint_id DESC LIMIT 1",
+            (thread_id,)).fetchone()
+        return self.serde.loads_typed((type_, zlib.decompress(blob)))
+
+    def close(self) -> None:
+        self._conn.close()
+
+
+class _IncrementalSaver:
+    def __init__(self, path: str):
+        from sqlite_checkpointer import SqliteCheckpointSaver
+
+        self._saver = SqliteCheckpointSaver(path)
+
+    def put(self, thread_id: str, checkpoint: dict) -> None:
+        self._saver.put({"configurable": {"thread_id": thread_id}}, checkpoint, {"step": 0}, {})
+
+    def get(self, thread_id: str) -> dict:
+        # 清空缓存，模拟进程重启后的恢复
+        self._saver._saved_messages.clear()
+        return self._saver.get_tuple({"configurable": {"thread_id": thread_id}}).checkpoint
+
+    def close(self) -> None:
+        self._saver.close()
+
+
+def bench_encoding(saver_cls, n: int, repeats: int, workdir: str) -> dict:
+    first, incremental, load, sizes = [], [], [], []
+    for r in range(repeats):
+        path = os.path.join(workdir, f"{saver_cls.__name__}_{n}_{r}.db")
+        saver = saver_cls(path)
+        thread_id = f"bench:{n}"
+        messages = build_session(n)
+
+        t0 = time.perf_counter()
+        saver.put(thread_id, _checkpoint(messages, 0))
+        first.append(time.perf_counter() - t0)
+
+        messages = messages + build_session(TURN_MESSAGES)
+        t0 = time.perf_counter()
+        saver.put(thread_id, _checkpoint(messages, 1))
+        incremental.append(time.perf_counter() - t0)
+
+        t0 = time.perf_counter()
+        restored = saver.get(thread_id)
+        load.append(time.perf_counter() - t0)
+        assert len(restored["channel_values"]["messages"]) == len(messages)
+
+        saver.close()
+        sizes.append(os.path.getsize(path))
+    return {"messages": n, "first_put_ms": _median_ms(first), "incremental_put_ms": _median_ms(incremental),
+            "load_ms": _median_ms(load), "db_bytes": int(statistics.median(sizes))}
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Checkpoint save/load latency versus session history length.")
+    parser.add_argument("--sizes", default=DEFAULT_SIZES)
+    parser.add_argument("--repeats", type=int, default=DEFAULT_REPEATS)
+    parser.add_argument("-o", "--output", help="Write results as JSON")
+    args = parser.parse_args(argv)
+
+    sizes = sorted(int(x) for x in args.sizes.split(",") if x.strip())
+    report = {"sizes": sizes, "repeats": args.repeats, "turn_messages": TURN_MESSAGES, "encodings": {}}
+    with tempfile.TemporaryDirectory() as workdir:
+        for name, saver_cls in (("full", _FullSaver), ("incremental", _IncrementalSaver)):
+            points = [bench_encoding(saver_cls, n, args.repeats, workdir) for n in sizes]
+            slope = growth_slope([{"messages": p["messages"], "seconds": p["incremental_put_ms"]} for p in points])
+            report["encodings"][name] = {"points": points,
+                                         "incremental_put_slope": round(slope, 3) if slope is not None else None}
+            for p in points:
+                print(f"[{name:<11}] n={p['messages']:<6} first_put={p['first_put_ms']:.2f}ms  "
+                      f"incremental_put={p['incremental_put_ms']:.2f}ms  load={p['load_ms']:.2f}ms  "
+                      f"db={p['db_bytes']}B", flush=True)
+
+    if args.output:
+        os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,191 @@
+"""
+会话历史长度扩展性基准：recorder_node / model_call 预处理 / prepare_state_from_payload
+
+长编辑会话中 messages 持续增长：recorder_node 每次工具回合两次倒序遍历 messages，
+model_call 的 _snapshot 每次把整个 messages 格式化进日志。这里构造 10 ~ 10,000 条消息的
+合成会话，测量各节点的非 LLM 开销 (含日志)，并在对数坐标上拟合增长斜率，
+斜率明显大于 1 (超线性) 时报警，便于在部署前发现回归。
+
+model_call 中的 LLM 调用被替换为立即返回的占位对象，只计量 Prompt 组装、自动加载判定与日志。
+
+用法：
+    python bench_history.py --graph my_name_chat_agent --sizes 10,100,1000,10000 --fail-on-superlinear
+"""
+import argparse
+import json
+import math
+import os
+import statistics
+import sys
+import time
+import uuid
+
+DEFAULT_SIZES = "10,100,1000,10000"
+DEFAULT_REPEATS = 5
+# 对数斜率超过该阈值视为超线性增长 (1.0 = 线性)
+DEFAULT_SLOPE_THRESHOLD = 1.2
+
+
+def build_session(n_messages: int) -> list:
+    """构造 n 条消息的合成会话：human -> ai(tool_call) -> tool -> ai(answer) 循环"""
+    from langchain_core.messages import AIMessage, HumanMessage, ToolMessage
+
+    messages = []
+    turn = 0
+    while len(messages) < n_messages:
+        call_id = f"call_{uuid.uuid4().hex[:24]}"
+        task_id = str(uuid.uuid4())
+        messages.append(HumanMessage(content=f"第{turn}轮：把人物的头发改成蓝色，背景换成黄昏的街道。", id=str(uuid.uuid4())))
+        messages.append(AIMessage(
+            content="",
+            tool_calls=[{
+                "id": call_id,
+                "name": "image_edit_by_ppio_banana_pro_create_task",
+                "args": {"prompt": "把人物的头发改成蓝色。保持其余元素不变。",
+                         "image_urls": [f"https://example.com/{turn}.png"], "seed": turn},
+            }],
+            id=str(uuid.uuid4()),
+        ))
+        messages.append(ToolMessage(
+            content=json.dumps({"task_id": task_id, "status": "Image Edit Task created successfully!",
+                                "model": "ppio-banana-pro"}),
+            tool_call_id=call_id,
+            id=str(uuid.uuid4()),
+        ))
+        messages.append(AIMessage(
+            content=json.dumps({"answer": "生成任务已开始，结果会自动出现在创作中心。",
+                                "suggestions": ["微调面部", "改成夜景", "生成视频"]}, ensure_ascii=False),
+            id=str(uuid.uuid4()),
+        ))
+        turn += 1
+    return messages[:n_messages]
+
+
+class _NullLLM:
+    """立即返回的占位 LLM，只用于剥离网络开销"""
+
+    def __init__(self, returns_raw: bool):
+        from langchain_core.messages import AIMessage
+
+        self._message = AIMessage(content='{"answer": "ok", "suggestions": []}', tool_calls=[])
+        self._returns_raw = returns_raw
+
+    def invoke(self, messages, *args, **kwargs):
+        return {"raw": self._message, "parsed": None} if self._returns_raw else self._message
+
+
+def _time_call(fn, repeats: int) -> float:
+    samples = []
+    for _ in range(repeats):
+        t0 = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - t0)
+    return statistics.median(samples)
+
+
+def bench_module(module, sizes: list[int], repeats: int) -> dict:
+    from langchain_core.messages import HumanMessage
+
+    import graph_factory
+
+    # 节点是 graph_factory.TemplateGraph 的绑定方法，替换实例上的 LLM 即可
+    agent = module.agent
+    null_llm = _NullLLM(returns_raw=agent.config.response_mode == graph_factory.RESPONSE_STRUCTURED)
+    # llm / backup_llm 也一并替换：否则首次访问会创建 ChatOpenAI，没有 OPENAI_API_KEY 时直接失败
+    agent.llm = null_llm
+    agent.backup_llm = null_llm
+    agent.structured_llm = null_llm
+    agent.structured_llm_no_tools = null_llm
+    agent._wrap = lambda *args, **kwargs: null_llm  # effort_policy 选出非默认档位时使用
+
+    results: dict[str, list[dict]] = {"recorder_node": [], "model_call": [], "prepare_state_from_payload": []}
+    for n in sizes:
+        messages = build_session(n)
+        # recorder：最后一条是 ToolMessage 时才会走完整的提取逻辑
+        recorder_messages = messages[:-1] if messages and messages[-1].type == "ai" else messages
+        recorder_state = {"messages": recorder_messages}
+        results["recorder_node"].append({
+            "messages": n,
+            "seconds": _time_call(lambda: module.recorder_node(recorder_state), repeats),
+        })
+
+        # model_call：提供 references 以跳过自动加载的网络查询
+        def _model_call():
+            state = {
+                "messages": messages + [HumanMessage(content="继续把天空调暗一点", id=str(uuid.uuid4()))],
+                "references": [{"url": "https://example.com/ref.png", "desc": "参考图"}],
+                "last_task_id": "bench", "last_tool_name": "image_edit_by_ppio_banana_pro_create_task",
+                "global_config": {"resolution": "2K", "aspect_ratio": "16:9"},
+                "model_call_count": 0,
+            }
+            module.model_call(state)
+
+        results["model_call"].append({"messages": n, "seconds": _time_call(_model_call, repeats)})
+
+        def _prepare():
+            state = {"messages": list(messages), "last_task_id": "bench"}
+            module.prepare_state_from_payload(
+                {"user_query": "把天空调暗一点", "references": [{"url": "https://example.com/a.png"}]}, state)
+
+        results["prepare_state_from_payload"].append({"messages": n, "seconds": _time_call(_prepare, repeats)})
+    return results
+
+
+def growth_slope(points: list[dict]) -> float | None:
+    """log(seconds) 对 log(messages) 的最小二乘斜率"""
+    xs = [math.log(p["messages"]) for p in points if p["seconds"] > 0]
+    ys = [math.log(p["seconds"]) for p in points if p["seconds"] > 0]
+    if len(xs) < 2:
+        return None
+    mean_x, mean_y = statistics.fmean(xs), statistics.fmean(ys)
+    denom = sum((x - mean_x) ** 2 for x in xs)
+    if not denom:
+        return None
+    return sum((x - mean_x) * (y - mean_y) for x, y in zip(xs, ys)) / denom
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="History-length scaling benchmarks for graph node prep work.")
+    parser.add_argument("--graph", action="append",
+                        help="Graph name from langgraph.json (default: all)")
+    parser.add_argument("--sizes", default=DEFAULT_SIZES)
+    parser.add_argument("--repeats", type=int, default=DEFAULT_REPEATS)
+    parser.add_argument("--slope-threshold", type=float, default=DEFAULT_SLOPE_THRESHOLD)
+    parser.add_argument("--fail-on-superlinear", action="store_true", help="Exit 1 when any node grows super-linearly")
+    parser.add_argument("-o", "--output", help="Write results as JSON")
+    args = parser.parse_args(argv)
+
+    from batch_runner import graph_names, load_graph_module
+
+    sizes = sorted(int(x) for x in args.sizes.split(",") if x.strip())
+    report = {"sizes": sizes, "repeats": args.repeats, "slope_threshold": args.slope_threshold, "graphs": {}}
+    flagged = []
+    for graph_name in args.graph or graph_names():
+        module = load_graph_module(graph_name)
+        results = bench_module(module, sizes, args.repeats)
+        graph_report = {}
+        for node, points in results.items():
+            slope = growth_slope(points)
+            superlinear = slope is not None and slope > args.slope_threshold
+            graph_report[node] = {"points": points, "slope": round(slope, 3) if slope is not None else None,
+                                  "superlinear": superlinear}
+            if superlinear:
+                flagged.append(f"{graph_name}.{node}")
+            timings = "  ".join(f"n={p['messages']}:{p['seconds'] * 1000:.2f}ms" for p in points)
+            mark = "  <-- SUPER-LINEAR" if superlinear else ""
+            print(f"[{graph_name}] {node:<28} slope={graph_report[node]['slope']}  {timings}{mark}", flush=True)
+        report["graphs"][graph_name] = graph_report
+
+    report["flagged"] = flagged
+    if args.output:
+        os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    if flagged:
+        print(f"Super-linear growth detected: {', '.join(flagged)}")
+        return 1 if args.fail_on_superlinear else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,114 @@
+"""
+启动耗时基准：python -X importtime 导入各图模块，报告总耗时与最慢的依赖
+
+LangGraph Server 启动 (以及自动扩容的冷启动) 时会导入 langgraph.json 中的全部图模块。
+这里为每个目标在新的解释器中执行 `python -X importtime -c "import <module>"`，解析 stderr：
+- 总导入耗时 (目标模块的 cumulative)
+- 按 self 时间排序的最慢模块，以及顶层包的 cumulative 耗时
+多次运行取中位数；--budget-ms 超出时退出码为 1，可放进 CI 跟踪启动回归。
+
+用法：
+    python bench_import.py                      # langgraph.json 中的全部图模块
+    python bench_import.py -m KIE_tools -m graph_factory --top 15 -o bench/import.json
+"""
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+
+from batch_runner import LANGGRAPH_CONFIG
+
+DEFAULT_REPEATS = 3
+DEFAULT_TOP = 10
+
+# "import time:       123 |        456 |   package.module"
+_LINE_PATTERN = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)\s*$")
+
+
+def graph_modules() -> list[str]:
+    """langgraph.json 中各图对应的模块名 (例如 ./MyNameTemplate.py:app -> MyNameTemplate)"""
+    with open(LANGGRAPH_CONFIG, encoding="utf-8") as f:
+        graphs = json.load(f)["graphs"]
+    return [os.path.splitext(os.path.basename(spec.partition(":")[0]))[0] for spec in graphs.values()]
+
+
+def parse_importtime(stderr: str) -> list[dict]:
+    """解析 -X importtime 输出，返回 [{module, self_us, cumulative_us, depth}]"""
+    rows = []
+    for line in stderr.splitlines():
+        match = _LINE_PATTERN.match(line)
+        if match:
+            self_us, cumulative_us, indent, module = match.groups()
+            rows.append({"module": module, "self_us": int(self_us), "cumulative_us": int(cumulative_us),
+                         "depth": (len(indent) - 1) // 2})
+    return rows
+
+
+def measure(module: str) -> list[dict]:
+    """在新的解释器中导入 module 一次 (不复用 .pyc 以外的任何缓存)"""
+    env = dict(os.environ, PYTHONDONTWRITEBYTECODE="1")
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=os.path.dirname(os.path.abspath(__file__)), env=env, capture_output=True, text=True,
+    )
+    if proc.returncode != 0:
+        tail = "\n".join(line for line in proc.stderr.splitlines() if not line.startswith("import time:"))[-2000:]
+        raise RuntimeError(f"import {module} failed:\n{tail}")
+    return parse_importtime(proc.stderr)
+
+
+def bench_module(module: str, repeats: int, top: int) -> dict:
+    runs = [measure(module) for _ in range(repeats)]
+    totals = [next((r["cumulative_us"] for r in rows if r["module"] == module and r["depth"] == 0), 0)
+              for rows in runs]
+    # 最慢依赖按中位数那一次运行统计
+    median_run = runs[totals.index(sorted(totals)[len(totals) // 2])]
+    by_self = sorted(median_run, key=lambda r: r["self_us"], reverse=True)[:top]
+    top_level = sorted((r for r in median_run if r["depth"] == 0), key=lambda r: r["cumulative_us"], reverse=True)[:top]
+    return {
+        "module": module,
+        "total_ms": round(statistics.median(totals) / 1000, 1),
+        "runs_ms": [round(t / 1000, 1) for t in totals],
+        "modules_imported": len(median_run),
+        "slowest_self": [{"module": r["module"], "self_ms": round(r["self_us"] / 1000, 1)} for r in by_self],
+        "slowest_packages": [{"module": r["module"], "cumulative_ms": round(r["cumulative_us"] / 1000, 1)}
+                             for r in top_level],
+    }
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Import-time benchmark for graph modules (python -X importtime).")
+    parser.add_argument("-m", "--module", action="append", help="Module to import (default: graphs in langgraph.json)")
+    parser.add_argument("--repeats", type=int, default=DEFAULT_REPEATS)
+    parser.add_argument("--top", type=int, default=DEFAULT_TOP)
+    parser.add_argument("--budget-ms", type=float, help="Exit 1 when any module's median import time exceeds this")
+    parser.add_argument("-o", "--output", help="Write results as JSON")
+    args = parser.parse_args(argv)
+
+    report = {"python": sys.version.split()[0], "repeats": args.repeats, "modules": []}
+    over_budget = []
+    for module in args.module or graph_modules():
+        result = bench_module(module, args.repeats, args.top)
+        report["modules"].append(result)
+        print(f"{module:<32} total={result['total_ms']:.1f}ms  modules={result['modules_imported']}", flush=True)
+        for row in result["slowest_packages"]:
+            print(f"    {row['module']:<40} {row['cumulative_ms']:>8.1f}ms")
+        if args.budget_ms is not None and result["total_ms"] > args.budget_ms:
+            over_budget.append(module)
+
+    report["over_budget"] = over_budget
+    if args.output:
+        os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    if over_budget:
+        print(f"Import time over budget ({args.budget_ms}ms): {', '.join(over_budget)}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,253 @@
+"""
+LLM 与 Provider 调用的录制 / 回放 (cassette)
+
+eval_agent.py 直接对线上 LLM 和线上工具执行 app.invoke，既花钱、耗时又有噪声。
+这里在两个边界做录制/回放：
+- ChatOpenAI：通过自定义 httpx transport 拦截 /chat/completions 请求
+- Provider：KIE_tools 中的 KIE / PPIO / OSS 转存 / Supabase 调用统一经过 through()
+
+record 模式把 (请求, 响应, 耗时) 追加到 JSONL 文件，key 为归一化请求的哈希；
+replay 模式按 key 取回响应 (同 key 多次调用按录制顺序依次返回)，可选按录制耗时 sleep。
+回放时没有任何网络请求，工具选择准确率与图开销可以确定性地、并行地评测。
+
+环境变量：
+    CASSETTE_MODE=off|record|replay     (默认 off)
+    CASSETTE_PATH=cassettes/default.jsonl
+    CASSETTE_REPLAY_LATENCY=0           回放时按录制耗时 sleep 的倍数 (0 表示不 sleep)
+"""
+import base64
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable
+
+from logger_util import get_logger
+
+logger = get_logger("mynamechat.cassette")
+
+MODE_OFF = "off"
+MODE_RECORD = "record"
+MODE_REPLAY = "replay"
+
+DEFAULT_CASSETTE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cassettes", "default.jsonl")
+
+# 归一化：本地生成的 UUID (PPIO task_id 等) 每次运行都不同，替换为占位符
+_UUID_PATTERN = re.compile(r"[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}", re.I)
+# 请求体中与语义无关、每次都会变化的字段
+_VOLATILE_KEYS = {"user", "stream_options", "callBackUrl"}
+
+
+class CassetteMissError(LookupError):
+    """回放模式下找不到对应的录制记录"""
+
+
+def _normalize(value: Any) -> Any:
+    if isinstance(value, dict):
+        return {k: _normalize(v) for k, v in sorted(value.items()) if k not in _VOLATILE_KEYS}
+    if isinstance(value, (list, tuple)):
+        return [_normalize(v) for v in value]
+    if isinstance(value, str):
+        return _UUID_PATTERN.sub("<uuid>", value)
+    return value
+
+
+def request_key(kind: str, request: Any) -> str:
+    """归一化请求的 SHA-256 哈希 (kind 区分 llm / kie.createTask / supabase.select 等)"""
+    canonical = json.dumps(_normalize(request), ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(f"{kind}\n{canonical}".encode("utf-8")).hexdigest()
+
+
+class Cassette:
+    def __init__(self, path: str, mode: str = MODE_REPLAY, replay_latency: float = 0.0):
+        if mode not in (MODE_RECORD, MODE_REPLAY):
+            raise ValueError(f"Unknown cassette mode: {mode!r}")
+        self.path = path
+        self.mode = mode
+        self.replay_latency = replay_latency
+        self._entries: dict[str, list[dict]] = {}
+        self._cursor: dict[str, int] = {}
+        self._lock = threading.Lock()
+        self.stats = {"recorded": 0, "replayed": 0, "missed": 0}
+        if mode == MODE_REPLAY:
+            self._load()
+        else:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+
+    def _load(self) -> None:
+        if not os.path.exists(self.path):
+            raise FileNotFoundError(f"Cassette not found: {self.path}")
+        with open(self.path, encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    entry = json.loads(line)
+                    self._entries.setdefault(entry["key"], []).append(entry)
+        logger.info("Cassette loaded: %s (%d keys)", self.path, len(self._entries))
+
+    def _append(self, entry: dict) -> None:
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            self.stats["recorded"] += 1
+
+    def _next(self, kind: str, key: str) -> dict:
+        with self._lock:
+            entries = self._entries.get(key)
+            if not entries:
+                self.stats["missed"] += 1
+                raise CassetteMissError(f"No recorded {kind} response for key {key[:12]} in {self.path}")
+            idx = self._cursor.get(key, 0)
+            # 同一请求多次出现时按录制顺序返回，用完后重复最后一条 (例如轮询)
+            self._cursor[key] = idx + 1
+            self.stats["replayed"] += 1
+            return entries[min(idx, len(entries) - 1)]
+
+    def _sleep(self, entry: dict) -> None:
+        if self.replay_latency > 0 and entry.get("latency"):
+            time.sleep(entry["latency"] * self.replay_latency)
+
+    def through(self, kind: str, request: Any, call: Callable[[], Any]) -> Any:
+        """Provider 边界：record 时执行 call() 并录制 JSON 响应，replay 时直接返回录制结果"""
+        key = request_key(kind, request)
+        if self.mode == MODE_REPLAY:
+            entry = self._next(kind, key)
+            self._sleep(entry)
+            return entry["response"]
+
+        t0 = time.perf_counter()
+        response = call()
+        self._append({"key": key, "kind": kind, "request": _normalize(request),
+                      "response": response, "latency": round(time.perf_counter() - t0, 4)})
+        return response
+
+
+# --- 全局激活的 cassette ---
+_active: Cassette | None = None
+_env_loaded = False
+
+
+def _from_env() -> Cassette | None:
+    mode = (os.getenv("CASSETTE_MODE") or MODE_OFF).lower()
+    if mode == MODE_OFF:
+        return None
+    return Cassette(
+        os.getenv("CASSETTE_PATH") or DEFAULT_CASSETTE_PATH,
+        mode=mode,
+        replay_latency=float(os.getenv("CASSETTE_REPLAY_LATENCY") or 0),
+    )
+
+
+def active() -> Cassette | None:
+    global _active, _env_loaded
+    if not _env_loaded:
+        _env_loaded = True
+        if _active is None:
+            _active = _from_env()
+    return _active
+
+
+@contextmanager
+def use_cassette(path: str, mode: str = MODE_REPLAY, replay_latency: float = 0.0):
+    """在代码中临时激活 cassette (Provider 边界即时生效；LLM 边界需在导入图模块前激活)"""
+    global _active, _env_loaded
+    previous, previous_loaded = _active, _env_loaded
+    _active, _env_loaded = Cassette(path, mode, replay_latency), True
+    try:
+        yield _active
+    finally:
+        _active, _env_loaded = previous, previous_loaded
+
+
+def through(kind: str, request: Any, call: Callable[[], Any]) -> Any:
+    """Provider 调用入口：未激活 cassette 时直接执行 call()"""
+    cassette = active()
+    if cassette is None:
+        return call()
+    return cassette.through(kind, request, call)
+
+
+def replaying() -> bool:
+    cassette = active()
+    return cassette is not None and cassette.mode == MODE_REPLAY
+
+
+# --- LLM 边界：httpx transport ---
+def _llm_request_payload(request) -> dict:
+    try:
+        body = json.loads(request.content.decode("utf-8")) if request.content else None
+    except (UnicodeDecodeError, json.JSONDecodeError):
+        body = base64.b64encode(request.content).decode("ascii")
+    return {"method": request.method, "path": request.url.path, "body": body}
+
+
+def _encode_response(response, content: bytes) -> dict:
+    return {
+        "status_code": response.status_code,
+        "headers": {k: v for k, v in response.headers.items()
+                    if k.lower() in ("content-type", "x-request-id", "openai-processing-ms")},
+        "content_b64": base64.b64encode(content).decode("ascii"),
+    }
+
+
+def _decode_response(httpx, recorded: dict, request):
+    return httpx.Response(
+        status_code=recorded["status_code"],
+        headers=recorded["headers"],
+        content=base64.b64decode(recorded["content_b64"]),
+        request=request,
+    )
+
+
+def llm_client_kwargs() -> dict:
+    """
+    供 ChatOpenAI(...) 使用的 http_client / http_async_client 参数。
+    未激活 cassette 时返回空字典，ChatOpenAI 使用默认客户端。
+    """
+    cassette = active()
+    if cassette is None:
+        return {}
+
+    import httpx
+    import openai
+
+    class CassetteTransport(httpx.BaseTransport):
+        def __init__(self):
+            self._inner = httpx.HTTPTransport()
+
+        def handle_request(self, request):
+            payload = _llm_request_payload(request)
+
+            def _call():
+                response = self._inner.handle_request(request)
+                content = response.read()
+                return _encode_response(response, content)
+
+            return _decode_response(httpx, cassette.through("llm", payload, _call), request)
+
+    class AsyncCassetteTransport(httpx.AsyncBaseTransport):
+        def __init__(self):
+            self._inner = httpx.AsyncHTTPTransport()
+
+        async def handle_async_request(self, request):
+            payload = _llm_request_payload(request)
+            key = request_key("llm", payload)
+            if cassette.mode == MODE_REPLAY:
+                entry = cassette._next("llm", key)
+                cassette._sleep(entry)
+                return _decode_response(httpx, entry["response"], request)
+
+            t0 = time.perf_counter()
+            response = await self._inner.handle_async_request(request)
+            content = await response.aread()
+            recorded = _encode_response(response, content)
+            cassette._append({"key": key, "kind": "llm", "request": _normalize(payload),
+                              "response": recorded, "latency": round(time.perf_counter() - t0, 4)})
+            return _decode_response(httpx, recorded, request)
+
+    return {
+        "http_client": openai.DefaultHttpxClient(transport=CassetteTransport()),
+        "http_async_client": openai.DefaultAsyncHttpxClient(transport=AsyncCassetteTransport()),
+    }
@@ -0,0 +1,136 @@
+"""
+按轮次自适应选择 reasoning_effort
+
+原来 structured_llm 固定 "medium"、suggestion_llm 固定 "low"："去水印" 与多参考图的复杂编辑花同样的推理预算。
+这里根据廉价信号给每次 model_call 打分并映射到 low / medium / high：
+- 参考图数量 (本轮 references，含自动加载)      1 张 +1，2 张及以上 +2
+- 用户消息长度                                   > 200 字 +1，> 500 字 +2
+- 重试 / 重新生成                               +1
+- 显式覆盖全局配置 (分辨率、比例、风格等)          +1
+- 上一轮工具调用失败                              +2
+- 去水印等简单任务                                -2
+- 工具执行后的总结调用 (model_call_count 为偶数)   -2
+基础分 1；<= 0 为 low，1-2 为 medium，>= 3 为 high。
+文本信号只看用户原始输入：去掉自动加载注入的前缀与 URL (否则 host:port、URL 里的时间戳会被当成比例)。
+每个 effort 档位的延迟与 reasoning tokens 记录在 metrics (mynamechat_llm_effort_*) 和日志中，便于调整阈值。
+
+环境变量：
+    REASONING_POLICY=fixed    fixed | adaptive (默认 fixed：始终使用模板配置的 reasoning_effort；adaptive 需显式开启)
+"""
+import os
+import re
+from typing import NamedTuple, Sequence
+
+from langchain_core.messages import BaseMessage, HumanMessage, ToolMessage
+
+import metrics
+from logger_util import get_logger
+from text_signals import RETRY_KEYWORDS, user_text
+
+logger = get_logger("mynamechat.effort_policy")
+
+REASONING_POLICY = (os.getenv("REASONING_POLICY") or "fixed").lower()
+
+EFFORT_LOW = "low"
+EFFORT_MEDIUM = "medium"
+EFFORT_HIGH = "high"
+
+BASE_SCORE = 1
+_SIMPLE_TASK_KEYWORDS = ("去水印", "水印", "watermark")
+_CONFIG_OVERRIDE_PATTERN = re.compile(r"\d+\s*[:：比]\s*\d+|(?<![0-9a-z])[124]k(?![a-z])|分辨率|比例|横屏|竖屏|画幅|风格"
+                                      r"|resolution|aspect", re.I)
+_ERROR_PREFIXES = ("Error", "API Error")
+
+
+class EffortDecision(NamedTuple):
+    effort: str
+    score: int
+    signals: tuple
+
+
+# 建议生成只需从固定形状中挑选，保持 low (仍按档位记录指标)
+SUGGESTIONS = EffortDecision(EFFORT_LOW, 0, ("suggestions",))
+
+
+def _last_human_index(messages: Sequence[BaseMessage]) -> int | None:
+    for i in range(len(messages) - 1, -1, -1):
+        if isinstance(messages[i], HumanMessage):
+            return i
+    return None
+
+
+def _previous_turn_failed(messages: Sequence[BaseMessage], current_turn_start: int) -> bool:
+    """上一轮 (当前 HumanMessage 之前到再上一条 HumanMessage 之间) 是否有工具返回错误"""
+    for msg in reversed(messages[:current_turn_start]):
+        if isinstance(msg, HumanMessage):
+            return False
+        if isinstance(msg, ToolMessage) and isinstance(msg.content, str) \
+                and msg.content.lstrip().startswith(_ERROR_PREFIXES):
+            return True
+    return False
+
+
+def choose_effort(state: dict, default: str = EFFORT_MEDIUM, model_call_count: int = 1) -> EffortDecision:
+    """根据本轮状态选择 reasoning_effort；REASONING_POLICY=fixed 时返回 default"""
+    if REASONING_POLICY != "adaptive":
+        return EffortDecision(default, 0, ("fixed",))
+
+    messages = state.get("messages") or []
+    signals = []
+    score = BASE_SCORE
+
+    n_refs = len(state.get("references") or [])
+    if n_refs:
+        score += 2 if n_refs >= 2 else 1
+        signals.append(f"refs={n_refs}")
+
+    human_idx = _last_human_index(messages)
+    text = ""
+    if human_idx is not None:
+        content = messages[human_idx].content
+        text = content if isinstance(content, str) else str(content)
+        # 自动加载会在原始输入前注入含图片 URL 的前缀，只按用户自己输入的文字打分
+        text = user_text(text)
+    if len(text) > 500:
+        score += 2
+        signals.append("long_query")
+    elif len(text) > 200:
+        score += 1
+        signals.append("medium_query")
+
+    lowered = text.lower()
+    if any(k in lowered for k in RETRY_KEYWORDS):
+        score += 1
+        signals.append("retry")
+    if _CONFIG_OVERRIDE_PATTERN.search(text):
+        score += 1
+        signals.append("config_override")
+    if human_idx is not None and _previous_turn_failed(messages, human_idx):
+        score += 2
+        signals.append("previous_failed")
+    if any(k in lowered for k in _SIMPLE_TASK_KEYWORDS):
+        score -= 2
+        signals.append("simple_task")
+    if model_call_count % 2 == 0:
+        score -= 2
+        signals.append("post_tool")
+
+    if score <= 0:
+        effort = EFFORT_LOW
+    elif score >= 3:
+        effort = EFFORT_HIGH
+    else:
+        effort = EFFORT_MEDIUM
+    return EffortDecision(effort, score, tuple(signals))
+
+
+def record(graph: str, node: str, decision: EffortDecision, seconds: float, message) -> None:
+    """按 effort 档位记录延迟与 reasoning tokens，并输出一行日志供调参"""
+    usage = getattr(message, "usage_metadata", None) or {}
+    reasoning = (usage.get("output_token_details") or {}).get("reasoning") or 0
+    metrics.LLM_EFFORT_SECONDS.observe(seconds, graph=graph, node=node, effort=decision.effort)
+    if reasoning:
+        metrics.LLM_EFFORT_REASONING_TOKENS.inc(reasoning, graph=graph, node=node, effort=decision.effort)
+    logger.info("Reasoning effort %s (score=%d signals=%s) %s.%s: %.0fms, reasoning_tokens=%d, output_tokens=%s",
+                decision.effort, decision.score, ",".join(decision.signals) or "-", graph, node,
+                seconds * 1000, reasoning, usage.get("output_tokens"))
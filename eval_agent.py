@@ -5,6 +5,10 @@ from langgraph.prebuilt import ToolNode
 from MyNameTemplate import app  # 导入你的 LangGraph 应用
 import json
 
+# 提示：设置 CASSETTE_MODE=record 运行一次录制 LLM 与工具调用，之后用 CASSETTE_MODE=replay
+# 离线回放 (无网络、无费用、耗时稳定)，详见 cassette.py。必须在导入 MyNameTemplate 之前设置。
+# 本地并发评测 (准确率 + 延迟 p50/p95 + tokens) 见 eval_runner.py，数据集默认使用下面的 examples。
+
 # 1. 定义数据集 (实际使用中通常在 LangSmith 网页端管理，这里为了演示写在代码里)
 examples = [
     {
@@ -0,0 +1,187 @@
+"""
+本地并行评测：在一个数据集上并发运行图，统计工具选择准确率与延迟
+
+eval_agent.py 只是单条样例的示意 (client.evaluate 被注释掉)，且只看最后一条消息的 tool_calls
+(工具执行后最后一条是总结回复，永远取不到)。这里：
+- 数据集默认使用 eval_agent.examples，也可用 --dataset 指定 JSON / JSONL 文件
+  每条格式：{"inputs": {"text": "...", "references": [...]}, "expected_tool": "..."}
+- 每条样例记录：延迟、LLM 调用次数、prompt/completion tokens、本轮所有调用过的工具、
+  以及 eval_agent.tool_selection_evaluator 的打分
+- 按 (图, 模型配置) 汇总：准确率、延迟 p50/p95、平均 LLM 调用与 tokens
+- 不依赖任何外部服务；配合 CASSETTE_MODE=replay 可离线、确定性地复跑
+
+用法：
+    python eval_runner.py --graph my_name_chat_agent --graph custom_chat_agent -c 4 --repeats 3
+    CASSETTE_MODE=replay CASSETTE_PATH=cassettes/eval.jsonl python eval_runner.py -o bench_results/eval.json
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from types import SimpleNamespace
+
+from batch_runner import graph_names, load_graph_module
+from load_test import percentiles
+
+DEFAULT_CONCURRENCY = 4
+
+
+def load_examples(path: str | None = None) -> list[dict]:
+    """读取数据集；未指定时使用 eval_agent.examples"""
+    if not path:
+        from eval_agent import examples
+        return list(examples)
+    with open(path, encoding="utf-8") as f:
+        if path.endswith(".jsonl"):
+            return [json.loads(line) for line in f if line.strip()]
+        return json.load(f)
+
+
+def _usage_handler():
+    """LangChain 回调：统计 LLM 调用次数、tokens 与模型名"""
+    from langchain_core.callbacks import BaseCallbackHandler
+
+    class UsageHandler(BaseCallbackHandler):
+        def __init__(self):
+            self.llm_calls = 0
+            self.prompt_tokens = 0
+            self.completion_tokens = 0
+            self.models: set[str] = set()
+            self._lock = threading.Lock()
+
+        def on_chat_model_start(self, serialized, messages, *, metadata=None, invocation_params=None, **kwargs):
+            model = (metadata or {}).get("ls_model_name") or (invocation_params or {}).get("model")
+            with self._lock:
+                self.llm_calls += 1
+                if model:
+                    self.models.add(model)
+
+        def on_llm_end(self, response, **kwargs):
+            prompt = completion = 0
+            for generations in response.generations:
+                for generation in generations:
+                    usage = getattr(getattr(generation, "message", None), "usage_metadata", None) or {}
+                    prompt += usage.get("input_tokens", 0)
+                    completion += usage.get("output_tokens", 0)
+            if not (prompt or completion):
+                token_usage = (response.llm_output or {}).get("token_usage") or {}
+                prompt = token_usage.get("prompt_tokens", 0)
+                completion = token_usage.get("completion_tokens", 0)
+            with self._lock:
+                self.prompt_tokens += prompt
+                self.completion_tokens += completion
+
+    return UsageHandler()
+
+
+def called_tools(messages) -> list[str]:
+    """本轮所有 AI 消息中调用过的工具 (按调用顺序)"""
+    return [call["name"] for m in messages if m.type == "ai" for call in (getattr(m, "tool_calls", None) or [])]
+
+
+def score_example(example: dict, tools: list[str]) -> int:
+    """复用 eval_agent.tool_selection_evaluator；expected_tool 为空表示本轮不应调用工具"""
+    expected = example.get("expected_tool")
+    if not expected:
+        return int(not tools)
+    from eval_agent import tool_selection_evaluator
+
+    result = tool_selection_evaluator(
+        SimpleNamespace(outputs={"called_tools": tools}),
+        SimpleNamespace(outputs={"expected_tool": expected}),
+    )
+    return result["score"]
+
+
+def run_example(module, graph_name: str, index: int, example: dict, label: str | None) -> dict:
+    inputs = example.get("inputs") or {}
+    payload = {"user_query": inputs.get("text", ""), "references": inputs.get("references") or []}
+    handler = _usage_handler()
+    record = {"graph": graph_name, "example": index, "text": payload["user_query"],
+              "expected_tool": example.get("expected_tool")}
+    t0 = time.perf_counter()
+    try:
+        state = module.prepare_state_from_payload(payload, {"messages": []})
+        result = module.invoke(state, config={"callbacks": [handler]})
+        tools = called_tools(result["messages"])
+        record.update({"status": "ok", "called_tools": tools, "score": score_example(example, tools)})
+    except Exception as e:
+        record.update({"status": "error", "error": f"{type(e).__name__}: {e}", "called_tools": [], "score": 0})
+    record.update({
+        "latency": round(time.perf_counter() - t0, 4),
+        "llm_calls": handler.llm_calls,
+        "prompt_tokens": handler.prompt_tokens,
+        "completion_tokens": handler.completion_tokens,
+        "model_config": label or ",".join(sorted(handler.models)) or "unknown",
+    })
+    return record
+
+
+def summarize(records: list[dict]) -> list[dict]:
+    groups: dict[tuple[str, str], list[dict]] = {}
+    for r in records:
+        groups.setdefault((r["graph"], r["model_config"]), []).append(r)
+
+    rows = []
+    for (graph_name, model_config), group in sorted(groups.items()):
+        latency = percentiles([r["latency"] for r in group], points=(50, 95))
+        n = len(group)
+        rows.append({
+            "graph": graph_name,
+            "model_config": model_config,
+            "examples": n,
+            "errors": sum(r["status"] == "error" for r in group),
+            "accuracy": round(sum(r["score"] for r in group) / n, 4),
+            "latency_p50": latency["p50"],
+            "latency_p95": latency["p95"],
+            "llm_calls_mean": round(sum(r["llm_calls"] for r in group) / n, 2),
+            "prompt_tokens_mean": round(sum(r["prompt_tokens"] for r in group) / n, 1),
+            "completion_tokens_mean": round(sum(r["completion_tokens"] for r in group) / n, 1),
+        })
+    return rows
+
+
+def format_table(rows: list[dict]) -> str:
+    columns = ["graph", "model_config", "examples", "errors", "accuracy", "latency_p50", "latency_p95",
+               "llm_calls_mean", "prompt_tokens_mean", "completion_tokens_mean"]
+    cells = [columns] + [[str(row[c]) for c in columns] for row in rows]
+    widths = [max(len(line[i]) for line in cells) for i in range(len(columns))]
+    lines = ["  ".join(value.ljust(width) for value, width in zip(line, widths)) for line in cells]
+    lines.insert(1, "  ".join("-" * width for width in widths))
+    return "\n".join(lines)
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Run the tool-selection eval set concurrently against the graphs.")
+    parser.add_argument("--graph", action="append", choices=graph_names(), help="Graph(s) to evaluate (default: all)")
+    parser.add_argument("--dataset", help="JSON/JSONL examples (default: eval_agent.examples)")
+    parser.add_argument("-c", "--concurrency", type=int, default=DEFAULT_CONCURRENCY)
+    parser.add_argument("--repeats", type=int, default=1, help="Run every example N times for stable percentiles")
+    parser.add_argument("--label", help="Model config label for the summary (default: model names seen in callbacks)")
+    parser.add_argument("-o", "--output", help="Write records and summary as JSON")
+    args = parser.parse_args(argv)
+
+    examples = load_examples(args.dataset)
+    records = []
+    for graph_name in args.graph or graph_names():
+        module = load_graph_module(graph_name)
+        jobs = [(i, example) for _ in range(max(1, args.repeats)) for i, example in enumerate(examples)]
+        with ThreadPoolExecutor(max_workers=max(1, args.concurrency), thread_name_prefix="eval") as pool:
+            records.extend(pool.map(lambda job: run_example(module, graph_name, job[0], job[1], args.label), jobs))
+
+    rows = summarize(records)
+    print(format_table(rows))
+    if args.output:
+        os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"started_at": datetime.now().isoformat(timespec="seconds"), "summary": rows,
+                       "records": records}, f, ensure_ascii=False, indent=2)
+    return 0 if not any(r["status"] == "error" for r in records) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
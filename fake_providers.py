@@ -0,0 +1,617 @@
+"""
+本地 Provider 替身服务：KIE / PPIO / OSS 转存 / Supabase (ppio_task_status 表)
+
+在不调用任何付费 API 的情况下运行 KIE_tools.py 的真实代码路径，用于测量自身开销、复现慢请求。
+所有接口挂在同一个端口上：
+- POST {base}/api/v1/jobs/createTask            KIE 创建任务
+- GET  {base}/api/v1/jobs/recordInfo?taskId=    KIE 任务状态 (waiting -> queuing -> generating -> success/fail)
+- POST {base}/v3/gemini-3-pro-image-edit        PPIO Banana Pro (同步长请求)
+- POST {base}/transfer                          OSS 转存
+- GET/POST/PATCH {base}/rest/v1/ppio_task_status Supabase PostgREST 子集 (select / insert / update, id=eq.xxx)
+- POST {base}/v1/chat/completions               OpenAI 兼容的脚本化假模型 (支持工具调用、json_schema 与流式)
+- GET  {base}/files/<name>                      返回占位图片字节
+- GET  {base}/__stats                           各接口请求计数
+
+每个接口可单独配置延迟分布、错误率，KIE 与 PPIO 有并发容量 (超出容量的任务排队)。
+
+用法：
+    python fake_providers.py --port 8765 --kie-generation lognormal:2.0,0.4 --error-rate createTask=0.05
+    # 然后在同一 shell 中导出 --print-env 给出的环境变量，再运行 MyNameTemplate.py / batch_runner.py
+
+注意：KIE_tools 在导入时读取 Base URL，必须先设置环境变量再导入图模块。
+"""
+import argparse
+import heapq
+import json
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from logger_util import get_logger
+
+logger = get_logger("mynamechat.fake_providers")
+
+# Supabase 客户端会校验 key 的 JWT 形状，这里给一个格式合法的假 key
+FAKE_SUPABASE_KEY = "fake.eyJyb2xlIjoiYW5vbiJ9.fake"
+
+_PNG_BYTES = (
+    b"\x89PNG\r\n\x1a\n\x00\x00\x00\rIHDR\x00\x00\x00\x01\x00\x00\x00\x01\x08\x06\x00\x00\x00\x1f\x15\xc4\x89"
+    b"\x00\x00\x00\rIDATx\x9cc\xf8\xff\xff?\x00\x05\xfe\x02\xfe\xa7\x35\x81\x84\x00\x00\x00\x00IEND\xaeB`\x82"
+)
+
+
+class LatencyDistribution:
+    """
+    延迟分布 (秒)，由字符串描述：
+    fixed:0.2 | uniform:0.1,0.5 | normal:1.0,0.2 | lognormal:mu,sigma (对数空间参数) | exp:mean
+    """
+
+    def __init__(self, spec: str = "fixed:0", rng: random.Random | None = None):
+        self.spec = spec
+        self.rng = rng or random.Random()
+        kind, _, params = spec.partition(":")
+        self.kind = kind.strip().lower()
+        self.params = [float(p) for p in params.split(",") if p.strip()] if params else []
+        if self.kind not in ("fixed", "uniform", "normal", "lognormal", "exp"):
+            raise ValueError(f"Unknown latency distribution: {spec!r}")
+
+    def sample(self) -> float:
+        p = self.params
+        if self.kind == "fixed":
+            value = p[0] if p else 0.0
+        elif self.kind == "uniform":
+            value = self.rng.uniform(p[0], p[1])
+        elif self.kind == "normal":
+            value = self.rng.gauss(p[0], p[1])
+        elif self.kind == "lognormal":
+            value = self.rng.lognormvariate(p[0], p[1])
+        else:
+            value = self.rng.expovariate(1.0 / p[0]) if p and p[0] > 0 else 0.0
+        return max(0.0, value)
+
+    def __repr__(self) -> str:
+        return f"LatencyDistribution({self.spec!r})"
+
+
+@dataclass
+class FakeProviderConfig:
+    """各接口的延迟 / 错误率 / 容量配置"""
+    # 请求本身的响应延迟
+    latency: dict[str, str] = field(default_factory=lambda: {
+        "createTask": "uniform:0.05,0.15",
+        "recordInfo": "uniform:0.02,0.06",
+        "ppio_edit": "lognormal:2.3,0.3",   # 中位数约 10s
+        "transfer": "uniform:0.2,0.6",
+        "supabase": "uniform:0.01,0.04",
+        "llm": "lognormal:-0.7,0.3",        # 中位数约 0.5s
+    })
+    # 错误率 (0~1)
+    error_rate: dict[str, float] = field(default_factory=lambda: {
+        "createTask": 0.0,
+        "recordInfo": 0.0,
+        "ppio_edit": 0.0,
+        "transfer": 0.0,
+        "supabase": 0.0,
+        "llm": 0.0,
+    })
+    # KIE 任务从开始生成到完成的耗时分布，以及失败率
+    kie_generation: str = "lognormal:2.7,0.3"   # 中位数约 15s
+    kie_fail_rate: float = 0.0
+    # 并发容量：超过容量的任务排队等待
+    kie_capacity: int = 16
+    ppio_capacity: int = 8
+    seed: int | None = None
+
+
+@dataclass
+class _KieTask:
+    task_id: str
+    model: str
+    param: dict
+    created_at: float
+    start_at: float
+    finish_at: float
+    will_fail: bool
+    num_images: int
+
+
+class FakeProviderState:
+    """内存中的任务表与排队模型 (线程安全)"""
+
+    def __init__(self, config: FakeProviderConfig):
+        self.config = config
+        self.rng = random.Random(config.seed)
+        self.latency = {k: LatencyDistribution(v, self.rng) for k, v in config.latency.items()}
+        self.kie_generation = LatencyDistribution(config.kie_generation, self.rng)
+        self.lock = threading.Lock()
+        self.kie_tasks: dict[str, _KieTask] = {}
+        # KIE 队列模型：每个槽位下一次空闲的时间 (最小堆)
+        self._kie_slots = [0.0] * max(1, config.kie_capacity)
+        heapq.heapify(self._kie_slots)
+        self.ppio_slots = threading.BoundedSemaphore(max(1, config.ppio_capacity))
+        self.ppio_rows: dict[str, dict] = {}
+        self.request_counts: dict[str, int] = {}
+        self.error_counts: dict[str, int] = {}
+
+    def count(self, endpoint: str, error: bool = False) -> None:
+        with self.lock:
+            self.request_counts[endpoint] = self.request_counts.get(endpoint, 0) + 1
+            if error:
+                self.error_counts[endpoint] = self.error_counts.get(endpoint, 0) + 1
+
+    def should_fail(self, endpoint: str) -> bool:
+        with self.lock:
+            return self.rng.random() < self.config.error_rate.get(endpoint, 0.0)
+
+    def delay(self, endpoint: str) -> None:
+        dist = self.latency.get(endpoint)
+        if dist is not None:
+            with self.lock:
+                seconds = dist.sample()
+            time.sleep(seconds)
+
+    def create_kie_task(self, payload: dict) -> _KieTask:
+        now = time.monotonic()
+        with self.lock:
+            # 占用最早空闲的槽位；槽位被占满时任务在队列中等待
+            slot_free_at = heapq.heappop(self._kie_slots)
+            start_at = max(now, slot_free_at)
+            finish_at = start_at + self.kie_generation.sample()
+            heapq.heappush(self._kie_slots, finish_at)
+            task = _KieTask(
+                task_id=f"fake_{uuid.uuid4().hex[:16]}",
+                model=payload.get("model", ""),
+                param=payload,
+                created_at=now,
+                start_at=start_at,
+                finish_at=finish_at,
+                will_fail=self.rng.random() < self.config.kie_fail_rate,
+                num_images=int((payload.get("input") or {}).get("max_images") or 1),
+            )
+            self.kie_tasks[task.task_id] = task
+        return task
+
+
+def _kie_state(task: _KieTask, now: float) -> str:
+    if now >= task.finish_at:
+        return "fail" if task.will_fail else "success"
+    if now >= task.start_at:
+        return "generating"
+    if now - task.created_at < 0.5:
+        return "waiting"
+    return "queuing"
+
+
+_EQ_FILTER = re.compile(r"^eq\.(.*)$")
+_URL_IN_TEXT = re.compile(r"https?://[^\s）)，,。]+")
+
+# 假模型的工具选择脚本：按用户输入关键词挑选工具 (按顺序匹配，取第一个可用的工具)
+_FAKE_TOOL_SCRIPT = [
+    (("水印", "watermark"), ["remove_watermark_from_image_by_kie_seedream_v4_create_task"]),
+    (("视频", "video"), ["first_frame_to_video_by_kie_sora2_create_task", "text_to_video_by_kie_sora2_create_task"]),
+    (("", ), ["image_edit_routed_create_task", "image_edit_by_ppio_banana_pro_create_task",
+              "image_edit_by_kie_seedream_v4_create_task",
+              "text_to_image_by_kie_seedream_v4_create_task"]),
+]
+
+
+def _message_text(message: dict) -> str:
+    content = message.get("content") or ""
+    if isinstance(content, list):
+        return "".join(part.get("text", "") for part in content if isinstance(part, dict))
+    return str(content)
+
+
+def fake_chat_completion(request: dict, rng: random.Random) -> dict:
+    """
+    根据 OpenAI Chat Completions 请求生成脚本化的回复：
+    - 最后一条是 tool 消息 -> 给出最终回答
+    - 绑定了工具且最后一条是用户消息 -> 按关键词调用一个工具
+    - 其他情况 -> 纯文本 / json_schema 回答
+    """
+    messages = request.get("messages") or []
+    tools = {t["function"]["name"]: t["function"] for t in request.get("tools") or [] if t.get("type") == "function"}
+    last = messages[-1] if messages else {}
+    user_text = next((_message_text(m) for m in reversed(messages) if m.get("role") == "user"), "")
+    prompt_chars = sum(len(_message_text(m)) for m in messages)
+
+    tool_call = None
+    if tools and last.get("role") == "user":
+        lowered = user_text.lower()
+        for keywords, candidates in _FAKE_TOOL_SCRIPT:
+            if any(k in lowered for k in keywords):
+                name = next((c for c in candidates if c in tools), None)
+                if name:
+                    tool_call = name
+                    break
+
+    message: dict = {"role": "assistant", "content": None}
+    if tool_call:
+        params = tools[tool_call].get("parameters") or {}
+        urls = _URL_IN_TEXT.findall("\n".join(_message_text(m) for m in messages)) or ["https://example.com/ref.png"]
+        args = {}
+        for arg in params.get("required") or list((params.get("properties") or {}).keys()):
+            if arg == "prompt":
+                args[arg] = _URL_IN_TEXT.sub("", user_text).strip()[:200] + " 保持其余元素不变。"
+            elif arg == "image_urls":
+                args[arg] = [urls[-1]]
+            elif arg == "seed":
+                args[arg] = rng.randint(1, 2**31 - 1)
+        message["tool_calls"] = [{
+            "id": f"call_{uuid.uuid4().hex[:24]}",
+            "type": "function",
+            "function": {"name": tool_call, "arguments": json.dumps(args, ensure_ascii=False)},
+        }]
+        finish_reason = "tool_calls"
+    else:
+        answer = "好的，生成任务已开始，结果会自动出现在“创作中心”。" if last.get("role") == "tool" \
+            else "收到！请告诉我你想如何调整画面。"
+        suggestions = ["微调人物面部细节", "把光线改成黄昏暖色调", "确认画面，用这张图生成视频"]
+        schema_name = ((request.get("response_format") or {}).get("json_schema") or {}).get("name")
+        if schema_name == "SuggestionResponse":
+            message["content"] = json.dumps({"suggestions": suggestions}, ensure_ascii=False)
+        elif schema_name:
+            message["content"] = json.dumps({"answer": answer, "suggestions": suggestions}, ensure_ascii=False)
+        else:
+            message["content"] = answer
+        finish_reason = "stop"
+
+    completion_tokens = max(1, len(json.dumps(message, ensure_ascii=False)) // 4)
+    prompt_tokens = max(1, prompt_chars // 4)
+    return {
+        "id": f"chatcmpl-{uuid.uuid4().hex[:24]}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": request.get("model", "fake-model"),
+        "choices": [{"index": 0, "message": message, "finish_reason": finish_reason}],
+        "usage": {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+        },
+    }
+
+
+def _completion_to_chunks(completion: dict, piece_size: int = 8) -> list[dict]:
+    """把完整回复拆成流式 chunk (content 按 piece_size 切片，tool_calls 一次给出)"""
+    base = {k: completion[k] for k in ("id", "created", "model")}
+    base["object"] = "chat.completion.chunk"
+    choice = completion["choices"][0]
+    message = choice["message"]
+    chunks = [dict(base, choices=[{"index": 0, "delta": {"role": "assistant", "content": ""}, "finish_reason": None}])]
+    content = message.get("content") or ""
+    for i in range(0, len(content), piece_size):
+        chunks.append(dict(base, choices=[{"index": 0, "delta": {"content": content[i:i + piece_size]}, "finish_reason": None}]))
+    for idx, call in enumerate(message.get("tool_calls") or []):
+        chunks.append(dict(base, choices=[{"index": 0, "delta": {"tool_calls": [dict(call, index=idx)]}, "finish_reason": None}]))
+    chunks.append(dict(base, choices=[{"index": 0, "delta": {}, "finish_reason": choice["finish_reason"]}]))
+    chunks.append(dict(base, choices=[], usage=completion["usage"]))
+    return chunks
+
+
+class FakeProviderHandler(BaseHTTPRequestHandler):
+    server_version = "FakeProviders/1.0"
+    protocol_version = "HTTP/1.1"
+
+    @property
+    def state(self) -> FakeProviderState:
+        return self.server.state
+
+    # --- 通用 ---
+    def log_message(self, format, *args):  # noqa: A002 - 覆盖基类签名
+        logger.debug("%s - %s", self.address_string(), format % args)
+
+    def _read_json(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        if not length:
+            return None
+        return json.loads(self.rfile.read(length).decode("utf-8"))
+
+    def _send_json(self, status: int, body) -> None:
+        data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _base_url(self) -> str:
+        return f"http://{self.headers.get('Host') or '%s:%d' % self.server.server_address[:2]}"
+
+    def _fake_file_url(self, prefix: str) -> str:
+        return f"{self._base_url()}/files/{prefix}_{uuid.uuid4().hex[:12]}.png"
+
+    # --- 路由 ---
+    def do_GET(self):
+        parts = urlsplit(self.path)
+        query = parse_qs(parts.query)
+        if parts.path.endswith("/jobs/recordInfo"):
+            return self._kie_record_info(query)
+        if parts.path.startswith("/rest/v1/ppio_task_status"):
+            return self._supabase_select(query)
+        if parts.path.startswith("/files/"):
+            self.send_response(200)
+            self.send_header("Content-Type", "image/png")
+            self.send_header("Content-Length", str(len(_PNG_BYTES)))
+            self.end_headers()
+            self.wfile.write(_PNG_BYTES)
+            return
+        if parts.path == "/__stats":
+            with self.state.lock:
+                body = {
+                    "requests": dict(self.state.request_counts),
+                    "errors": dict(self.state.error_counts),
+                    "kie_tasks": len(self.state.kie_tasks),
+                    "ppio_rows": len(self.state.ppio_rows),
+                }
+            return self._send_json(200, body)
+        self._send_json(404, {"error": f"no route for GET {parts.path}"})
+
+    def do_POST(self):
+        parts = urlsplit(self.path)
+        if parts.path.endswith("/jobs/createTask"):
+            return self._kie_create_task()
+        if parts.path == "/v3/gemini-3-pro-image-edit":
+            return self._ppio_edit()
+        if parts.path == "/transfer":
+            return self._transfer()
+        if parts.path.startswith("/rest/v1/ppio_task_status"):
+            return self._supabase_insert()
+        if parts.path.endswith("/chat/completions"):
+            return self._chat_completions()
+        self._send_json(404, {"error": f"no route for POST {parts.path}"})
+
+    def do_PATCH(self):
+        parts = urlsplit(self.path)
+        if parts.path.startswith("/rest/v1/ppio_task_status"):
+            return self._supabase_update(parse_qs(parts.query))
+        self._send_json(404, {"error": f"no route for PATCH {parts.path}"})
+
+    # --- KIE ---
+    def _kie_create_task(self):
+        payload = self._read_json() or {}
+        self.state.delay("createTask")
+        if self.state.should_fail("createTask"):
+            self.state.count("createTask", error=True)
+            return self._send_json(200, {"code": 500, "msg": "Fake upstream error", "data": None})
+        task = self.state.create_kie_task(payload)
+        self.state.count("createTask")
+        self._send_json(200, {"code": 200, "msg": "success", "data": {"taskId": task.task_id}})
+
+    def _kie_record_info(self, query):
+        self.state.delay("recordInfo")
+        if self.state.should_fail("recordInfo"):
+            self.state.count("recordInfo", error=True)
+            return self._send_json(500, {"code": 500, "msg": "Fake upstream error"})
+        self.state.count("recordInfo")
+        task_id = (query.get("taskId") or [""])[0]
+        task = self.state.kie_tasks.get(task_id)
+        if task is None:
+            return self._send_json(200, {"code": 404, "msg": "task not found", "data": None})
+
+        state = _kie_state(task, time.monotonic())
+        data = {
+            "taskId": task.task_id,
+            "model": task.model,
+            "state": state,
+            "param": json.dumps(task.param, ensure_ascii=False),
+            "resultJson": "",
+            "failCode": "",
+            "failMsg": "",
+        }
+        if state == "success":
+            urls = [self._fake_file_url("kie") for _ in range(task.num_images)]
+            data["resultJson"] = json.dumps({"resultUrls": urls})
+        elif state == "fail":
+            data["failCode"] = "500"
+            data["failMsg"] = "Fake generation failure"
+        self._send_json(200, {"code": 200, "msg": "success", "data": data})
+
+    # --- PPIO / OSS ---
+    def _ppio_edit(self):
+        self._read_json()
+        # 容量满时在信号量上排队，模拟上游排队
+        with self.state.ppio_slots:
+            self.state.delay("ppio_edit")
+        if self.state.should_fail("ppio_edit"):
+            self.state.count("ppio_edit", error=True)
+            return self._send_json(500, {"error": "Fake upstream error"})
+        self.state.count("ppio_edit")
+        self._send_json(200, {"image_urls": [self._fake_file_url("ppio")]})
+
+    def _transfer(self):
+        payload = self._read_json() or {}
+        self.state.delay("transfer")
+        if self.state.should_fail("transfer"):
+            self.state.count("transfer", error=True)
+            return self._send_json(200, {"error": "Fake transfer error"})
+        self.state.count("transfer")
+        source = str(payload.get("url", ""))
+        name = source.rsplit("/", 1)[-1] or f"{uuid.uuid4().hex[:12]}.png"
+        self._send_json(200, {"url": f"{self._base_url()}/files/oss_{name}"})
+
+    # --- LLM (OpenAI Chat Completions) ---
+    def _chat_completions(self):
+        request = self._read_json() or {}
+        self.state.delay("llm")
+        if self.state.should_fail("llm"):
+            self.state.count("llm", error=True)
+            return self._send_json(500, {"error": {"message": "Fake LLM error", "type": "server_error"}})
+        self.state.count("llm")
+        with self.state.lock:
+            completion = fake_chat_completion(request, self.state.rng)
+        if not request.get("stream"):
+            return self._send_json(200, completion)
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+        for chunk in _completion_to_chunks(completion):
+            self.wfile.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+
+    # --- Supabase (PostgREST 子集) ---
+    def _supabase_guard(self) -> bool:
+        self.state.delay("supabase")
+        if self.state.should_fail("supabase"):
+            self.state.count("supabase", error=True)
+            self._send_json(503, {"message": "Fake database error"})
+            return False
+        self.state.count("supabase")
+        return True
+
+    @staticmethod
+    def _eq_id(query) -> str | None:
+        match = _EQ_FILTER.match((query.get("id") or [""])[0])
+        return match.group(1) if match else None
+
+    def _supabase_select(self, query):
+        if not self._supabase_guard():
+            return
+        row_id = self._eq_id(query)
+        columns = [c for c in (query.get("select") or ["*"])[0].split(",") if c]
+        with self.state.lock:
+            rows = [r for r in self.state.ppio_rows.values() if row_id is None or r["id"] == row_id]
+            if columns != ["*"]:
+                rows = [{c: r.get(c) for c in columns} for r in rows]
+        self._send_json(200, rows)
+
+    def _supabase_insert(self):
+        body = self._read_json()
+        if not self._supabase_guard():
+            return
+        rows = body if isinstance(body, list) else [body or {}]
+        with self.state.lock:
+            for row in rows:
+                self.state.ppio_rows[str(row.get("id"))] = dict(row)
+        self._send_json(201, rows)
+
+    def _supabase_update(self, query):
+        body = self._read_json() or {}
+        if not self._supabase_guard():
+            return
+        row_id = self._eq_id(query)
+        updated = []
+        with self.state.lock:
+            row = self.state.ppio_rows.get(row_id)
+            if row is not None:
+                row.update(body)
+                updated.append(dict(row))
+        self._send_json(200, updated)
+
+
+class FakeProviderServer:
+    """在后台线程中运行的替身服务"""
+
+    def __init__(self, config: FakeProviderConfig | None = None, host: str = "127.0.0.1", port: int = 0):
+        self.config = config or FakeProviderConfig()
+        self.httpd = ThreadingHTTPServer((host, port), FakeProviderHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.state = FakeProviderState(self.config)
+        self._thread: threading.Thread | None = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def state(self) -> FakeProviderState:
+        return self.httpd.state
+
+    def env(self) -> dict[str, str]:
+        """让 KIE_tools 指向替身服务所需的环境变量"""
+        return {
+            "KIE_API_BASE_URL": f"{self.base_url}/api/v1",
+            "PPIO_API_BASE_URL": self.base_url,
+            "OSS_TRANSFER_BASE_URL": self.base_url,
+            "VITE_SUPABASE_URL": self.base_url,
+            "VITE_SUPABASE_ANON_KEY": FAKE_SUPABASE_KEY,
+            "KIE_API_KEY": "fake-kie-key",
+            "GEMINI_API_KEY": "fake-ppio-key",
+            # 假模型：OpenAI 与 Doubao 两种配置方式都指向 /v1/chat/completions
+            "OPENAI_BASE_URL": f"{self.base_url}/v1",
+            "OPENAI_API_BASE": f"{self.base_url}/v1",
+            "OPENAI_API_KEY": "fake-openai-key",
+            "DOUBAO_BASE_URL": f"{self.base_url}/v1",
+            "DOUBAO_API_KEY": "fake-doubao-key",
+        }
+
+    def start(self) -> "FakeProviderServer":
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name="fake-providers", daemon=True)
+        self._thread.start()
+        logger.info("Fake providers listening on %s", self.base_url)
+        return self
+
+    def stop(self) -> None:
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self) -> "FakeProviderServer":
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+
+def _parse_kv(items: list[str], cast=str) -> dict:
+    result = {}
+    for item in items:
+        key, _, value = item.partition("=")
+        if not key or not value:
+            raise ValueError(f"Expected key=value, got {item!r}")
+        result[key.strip()] = cast(value.strip())
+    return result
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Local stand-in servers for KIE, PPIO, OSS transfer and Supabase.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", action="append", default=[], metavar="ENDPOINT=DIST",
+                        help="e.g. ppio_edit=lognormal:2.3,0.3 (endpoints: createTask, recordInfo, ppio_edit, transfer, supabase, llm)")
+    parser.add_argument("--error-rate", action="append", default=[], metavar="ENDPOINT=RATE")
+    parser.add_argument("--kie-generation", default=FakeProviderConfig.kie_generation)
+    parser.add_argument("--kie-fail-rate", type=float, default=0.0)
+    parser.add_argument("--kie-capacity", type=int, default=FakeProviderConfig.kie_capacity)
+    parser.add_argument("--ppio-capacity", type=int, default=FakeProviderConfig.ppio_capacity)
+    parser.add_argument("--seed", type=int)
+    parser.add_argument("--print-env", action="store_true", help="Print export lines for the tool env vars")
+    args = parser.parse_args(argv)
+
+    config = FakeProviderConfig(
+        kie_generation=args.kie_generation,
+        kie_fail_rate=args.kie_fail_rate,
+        kie_capacity=args.kie_capacity,
+        ppio_capacity=args.ppio_capacity,
+        seed=args.seed,
+    )
+    config.latency.update(_parse_kv(args.latency))
+    config.error_rate.update(_parse_kv(args.error_rate, float))
+
+    server = FakeProviderServer(config, host=args.host, port=args.port)
+    if args.print_env:
+        for key, value in server.env().items():
+            print(f"export {key}={value}")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.httpd.server_close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
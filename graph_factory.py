@@ -0,0 +1,817 @@
+"""
+共享图工厂：三个模板 (MyNameTemplate / CustomTemplate / MyNameTemplate_suggestion) 的唯一实现
+
+原来每个模板各自复制一份 AgentState、prepare_state_from_payload、recorder_node、model_call 与图的连线，
+并在导入时各自创建 ChatOpenAI 客户端。现在模板只声明一个 TemplateConfig (系统提示词、工具集、模型、
+输出模式、是否生成建议等)，由 build_graph 生成节点与编译后的 app：
+- 同一 (model, base_url) 的 ChatOpenAI 客户端以及同一参数的 structured / bind_tools 包装在图之间共享 (llm_registry)
+- 系统提示词 (含工具描述) 每个模板只格式化一次，model_call 只追加本轮的动态上下文
+- 热路径上的修改 (自动加载、日志、tracing / metrics / profiling) 只需改这里一处
+- 启动开销：ChatOpenAI 客户端及其包装在第一次调用模型时才创建 (langchain_openai 也在那时导入)，
+  LangGraph Server 加载三个图时只构建图结构；启动耗时用 bench_import.py 跟踪
+"""
+import asyncio
+import functools
+import json
+import logging
+import threading
+import time
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Annotated, Sequence
+
+from dotenv import load_dotenv
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage, SystemMessage
+from langgraph.graph import END, StateGraph
+from langgraph.graph.message import add_messages
+from langgraph.prebuilt import ToolNode
+from pydantic import BaseModel, Field
+from typing_extensions import TypedDict
+
+import admission
+import effort_policy
+import hedging
+import llm_registry
+import metrics
+import profiling
+import rate_limiter
+import session_memory
+import sqlite_checkpointer
+import tracing
+from KIE_tools import _get_task_group_status_impl, _pick_variant_index, _result_urls
+from logger_util import get_logger, should_dump_state
+from suggestion_engine import suggestion_engine
+from tool_prompts import SUGGESTION_SYSTEM_PROMPT
+
+if TYPE_CHECKING:
+    from langchain_openai import ChatOpenAI
+
+load_dotenv()
+metrics.start_from_env()  # 设置 METRICS_PORT 时启动 /metrics 端点
+
+# model_call 的输出模式
+RESPONSE_STRUCTURED = "structured"  # with_structured_output(AgentResponse, tools=...)：answer + suggestions 的 JSON
+RESPONSE_TEXT = "text"              # bind_tools：纯文本流式输出 + 工具调用
+
+
+class AgentState(TypedDict):
+    messages: Annotated[Sequence[BaseMessage], add_messages]
+    last_task_id: str | None  # 记录最近一个任务的ID，用于编辑图像时，如果用户没有指定URL，且没有提到retry，则使用此值进行查询
+    last_task_ids: list[str] | None  # 多变体任务组的全部成员ID (单任务时为 [last_task_id])，用于自动加载时选择变体
+    last_tool_name: str | None # 记录最近一个任务使用的工具名称，用于区分get_kie_task_status和get_ppio_task_status
+    last_task_config: dict | None  # 记录最近一个任务的配置，用于编辑图像时，如果用户没有指定URL，且说RETRY则使用此值进行重新生成
+    global_config: dict | None  # 记录全局配置，用于储存模板的配置，用于agent的背景知识填入API调用参数
+    references: list[dict] | None  # 记录参考素材，有URL时负责记录，无URL时负责指代参考素材
+    model_call_count: int  # 记录单轮交互中 model_call 的执行次数
+    trace_id: str | None  # 本轮对话的 trace ID (启用 TRACE_EXPORT 时由 admission 生成)，用于关联 span
+    admission: dict | None  # 本轮准入结果 {"status": "admitted", "lease"} | {"status": "rejected", "reason", "message"}
+    suggestions: list[str] | None  # 记录生成的建议 (仅 suggestions=True 的模板使用)
+
+
+class AgentResponse(BaseModel):
+    answer: str = Field(description="The answer to the user's question")
+    suggestions: list[str] = Field(description="The suggestions for the user to choose from")
+
+
+class SuggestionResponse(BaseModel):
+    suggestions: list[str] = Field(description="3 follow-up suggestions for the user")
+
+
+@dataclass(frozen=True)
+class TemplateConfig:
+    """一个模板 (即 langgraph.json 中的一个图) 的全部差异"""
+    graph_name: str            # langgraph.json 中的图名，用于 tracing / profiling / metrics 标签
+    system_prompt: str         # 含 {tools_description} 占位符的系统提示词
+    tools: tuple               # 绑定给模型的工具 (max function name length is 64)
+    model: str
+    api_key_env: str | None = None   # 为空时使用 ChatOpenAI 默认的 OPENAI_API_KEY / OPENAI_BASE_URL
+    base_url_env: str | None = None
+    response_mode: str = RESPONSE_STRUCTURED
+    reasoning_effort: str = "medium"  # Can be "low", "medium", or "high"
+    suggestions: bool = False  # 回答后是否经过 suggestion_generator 节点生成建议
+    final_answer_mode: bool = False  # 工具执行回来后 (count > 1) 不再提供工具，强制只生成回复，防止死循环
+    skip_auto_load_on_url: bool = False  # 用户 Prompt 中已包含 URL 时不自动加载上一轮结果
+    logger_name: str = "mynamechat.agent"
+    cli_title: str = "🎬  AI 视频/图像生成助手"
+    greeting: str = ""
+
+
+# --- 跨图共享的 ToolNode (LLM 客户端与包装由 llm_registry 共享) ---
+_TOOL_NODES: dict[tuple, ToolNode] = {}
+_TOOL_NODES_LOCK = threading.Lock()
+
+
+def tool_node(tools: Sequence) -> ToolNode:
+    key = llm_registry.tool_names(tools)
+    with _TOOL_NODES_LOCK:
+        node = _TOOL_NODES.get(key)
+        if node is None:
+            node = _TOOL_NODES[key] = ToolNode(tools=list(tools))
+        return node
+
+
+class TemplateGraph:
+    """按 TemplateConfig 生成节点函数与编译后的 app；模板模块把这些属性重新导出"""
+
+    def __init__(self, config: TemplateConfig):
+        self.config = config
+        self.graph_name = config.graph_name
+        self.tools = list(config.tools)
+        self.logger = get_logger(config.logger_name)
+        # 只登记端点；LLM_WARMUP 开启时在后台预热连接
+        llm_registry.register(config.model, config.api_key_env, config.base_url_env)
+        if hedging.enabled() and hedging.LLM_HEDGE_BACKUP_MODEL:
+            llm_registry.register(hedging.LLM_HEDGE_BACKUP_MODEL, hedging.LLM_HEDGE_BACKUP_API_KEY_ENV,
+                                  hedging.LLM_HEDGE_BACKUP_BASE_URL_ENV)
+
+        # 系统提示词中的工具描述在图的生命周期内不变，只格式化一次
+        self.system_prompt_base = config.system_prompt.format(tools_description=str(self.tools))
+
+        self.graph = self._build_graph()
+        # 设置 SESSION_CHECKPOINT_DB 时使用 SQLite 持久化会话状态，否则与原来一样不带 checkpointer
+        self.app = self.graph.compile(checkpointer=sqlite_checkpointer.from_env())
+
+    # --- 模型客户端：首次访问时创建 (cached_property 允许 bench_history 等直接赋值替换) ---
+    @functools.cached_property
+    def llm(self) -> "ChatOpenAI":
+        return llm_registry.get_client(self.config.model, self.config.api_key_env, self.config.base_url_env)
+
+    def _wrap(self, llm: "ChatOpenAI", use_tools: bool, effort: str | None = None):
+        """按模板的输出模式与 reasoning_effort 包装客户端 (主模型与对冲备用模型共用)"""
+        effort = effort or self.config.reasoning_effort
+        if self.config.response_mode == RESPONSE_TEXT:
+            # 纯文本模式：不带工具时没有任何工具绑定
+            return llm_registry.with_tools(llm, self.tools, effort) if use_tools else llm_registry.with_effort(llm, effort)
+        return llm_registry.structured(llm, AgentResponse, self.tools if use_tools else (), effort)
+
+    def _runnable(self, use_tools: bool, effort: str):
+        # 模板默认 effort 走缓存属性 (bench_history 等可直接替换)，其余档位由 llm_registry 共享
+        # 模型名一律取 self.config.model：读客户端的 model_name 会触发创建 ChatOpenAI (需要 API key)
+        if effort == self.config.reasoning_effort:
+            return self.structured_llm if use_tools else self.structured_llm_no_tools
+        return self._wrap(self.llm, use_tools, effort)
+
+    @functools.cached_property
+    def structured_llm(self):
+        return self._wrap(self.llm, use_tools=True)
+
+    @functools.cached_property
+    def structured_llm_no_tools(self):
+        return self._wrap(self.llm, use_tools=False)
+
+    @functools.cached_property
+    def backup_llm(self) -> "ChatOpenAI":
+        """
+        对冲请求的备用模型：未配置 LLM_HEDGE_BACKUP_MODEL 时对同一模型 / 端点再发一次。
+        带 LLM_HEDGE_BACKUP_TIMEOUT_S 的 HTTP 超时，落败的备用请求不会长期占用备用名额
+        """
+        if hedging.LLM_HEDGE_BACKUP_MODEL:
+            return llm_registry.get_client(hedging.LLM_HEDGE_BACKUP_MODEL, hedging.LLM_HEDGE_BACKUP_API_KEY_ENV,
+                                           hedging.LLM_HEDGE_BACKUP_BASE_URL_ENV, hedging.LLM_HEDGE_BACKUP_TIMEOUT_S)
+        return llm_registry.get_client(self.config.model, self.config.api_key_env, self.config.base_url_env,
+                                       hedging.LLM_HEDGE_BACKUP_TIMEOUT_S)
+
+    @functools.cached_property
+    def suggestion_llm(self):
+        # Suggestions don't need high reasoning
+        return llm_registry.structured(self.llm, SuggestionResponse, (), effort_policy.SUGGESTIONS.effort)
+
+    def _valid_response(self, response) -> bool:
+        # structured 模式下解析失败的结果不算有效，等待另一方
+        return self.config.response_mode != RESPONSE_STRUCTURED or response.get("parsing_error") is None
+
+    def _invoke_llm(self, messages: list, use_tools: bool, effort: str):
+        """调用主模型；开启 LLM_HEDGE 时超过延迟分位数后对冲到备用模型。返回 (response, 实际应答的模型名)"""
+        primary = self._runnable(use_tools, effort)
+        if not hedging.enabled():
+            return primary.invoke(messages), self.config.model
+
+        backup_llm = self.backup_llm
+        backup = self._wrap(backup_llm, use_tools, effort)
+
+        def _backup():
+            rate_limiter.acquire("llm")
+            return backup.invoke(messages)
+
+        response, source = hedging.call(f"{self.graph_name}/{self.config.model}", self.graph_name,
+                                        lambda: primary.invoke(messages), _backup, is_valid=self._valid_response)
+        return response, (backup_llm.model_name if source == hedging.BACKUP else self.config.model)
+
+    def log_system_message(self, message: str, *args, echo: bool = False, level: int = logging.INFO) -> None:
+        """Helper to log a system-level message and optionally echo to console.
+        参数按 logging 的 %-style 延迟格式化：级别未启用时不会构造字符串。"""
+        self.logger.log(level, message, *args)
+        if echo:
+            print(message % args if args else message)
+
+    # --- 节点 ---
+    def prepare_state_from_payload(self, query_json: dict, state: AgentState) -> AgentState:
+        """
+        部署/本地通用的输入预处理：
+        - 解析 user_query 与 references
+        - 写入 messages
+        - 打日志（log_system_message 会同时输出到控制台与文件）
+        不修改传入的 state：返回新的 dict 与新的 messages 列表
+        """
+        log_system_message = self.log_system_message
+        query = query_json.get("user_query", "")
+        refs = query_json.get("references", [])
+
+        state = {**state, "references": refs}
+
+        if query:
+            state["messages"] = [*state.get("messages", []), HumanMessage(content=query)]
+            log_system_message("[INPUT] JSON 解析成功 - query: %s%s", query[:50], "..." if len(query) > 50 else "")
+        else:
+            log_system_message("[INPUT] Query 为空，跳过添加 HumanMessage (可能是 State 传递)", echo=False)
+
+        log_system_message("[INPUT] references 数量: %d", len(refs))
+        if refs:
+            for i, ref in enumerate(refs):
+                log_system_message("[INPUT]   [%d] url: %s", i + 1, ref.get("url", "N/A")[:80])
+        else:
+            log_system_message("[INPUT]   (空列表)", echo=False)
+        log_system_message("[INPUT] last_task_id: %s", state.get("last_task_id", "None"))
+        log_system_message("[INPUT] last_tool_name: %s", state.get("last_tool_name", "None"))
+
+        return state
+
+    def _rejection(self, reason: str) -> dict:
+        """
+        被拒绝的轮次：繁忙提示放在 admission.message 中返回，不写入 messages
+        (否则会持久化到会话历史，下一轮模型会看到这条并非由它生成的回复)
+        """
+        self.log_system_message("[ADMISSION] 请求被拒绝: %s", reason, level=logging.WARNING)
+        if reason in (admission.REJECT_USER_LIMIT, admission.REJECT_TURN_BUSY):
+            text = "你的上一条请求仍在处理中，请等它完成后再发送。"
+        else:
+            text = "当前请求较多，请稍后再试。"
+        return {"status": "rejected", "reason": reason, "message": text}
+
+    def admission_node(self, input_dict: dict, config: dict) -> AgentState:
+        """
+        入口节点：申请本轮的准入租约；超载时直接结束本轮 (不调用 LLM / Provider)。
+        同一会话的轮次串行不在这里做：节点运行时 LangGraph 已加载 checkpoint，见 invoke / astream_events
+        """
+        if not admission.controller.enabled:
+            return {"admission": None}
+        lease, reason = admission.controller.acquire(self.graph_name, admission.user_of(input_dict, config))
+        if lease is None:
+            return {"admission": self._rejection(reason)}
+        return {"admission": {"status": "admitted", "lease": lease}}
+
+    @staticmethod
+    def route_admission(state: AgentState):
+        status = (state.get("admission") or {}).get("status")
+        return "rejected" if status == "rejected" else "admitted"
+
+    def admission_release_node(self, state: AgentState) -> AgentState:
+        """出口节点：释放本轮租约"""
+        self._release_ticket(state.get("admission"))
+        return {"admission": None}
+
+    @staticmethod
+    def _release_ticket(ticket: dict | None) -> None:
+        ticket = ticket or {}
+        admission.controller.release(ticket.get("lease"))
+
+    # --- 运行入口：同一会话的轮次串行 ---
+    def _turn_key(self, config: dict | None) -> str | None:
+        thread_id = admission.thread_of(config)
+        return f"{self.graph_name}:{thread_id}" if thread_id else None
+
+    def _busy_state(self, input_dict: dict) -> dict:
+        """会话锁等待超时：本轮没有进入图 (checkpoint 不变)，返回输入状态与拒绝结果"""
+        return {**input_dict, "admission": self._rejection(admission.REJECT_TURN_BUSY)}
+
+    def invoke(self, input_dict: dict, config: dict | None = None, **kwargs) -> dict:
+        """
+        app.invoke 的会话串行包装：在 LangGraph 加载 checkpoint 之前获取会话锁，
+        同一 thread 的下一轮才能读到上一轮写入的 messages / last_task_id
+        """
+        turn_key = self._turn_key(config)
+        turn = admission.turns.acquire(turn_key, self.graph_name) if turn_key else None
+        if turn_key and turn is None:
+            return self._busy_state(input_dict)
+        try:
+            return self.app.invoke(input_dict, config=config, **kwargs)
+        finally:
+            admission.turns.release(turn_key, turn)
+
+    async def _acquire_turn_async(self, turn_key: str) -> str | None:
+        # 等待放到线程中，不阻塞事件循环；等待期间被取消时，线程稍后拿到的锁立即释放
+        waiter = asyncio.ensure_future(asyncio.to_thread(admission.turns.acquire, turn_key, self.graph_name))
+
+        def _release_late(future) -> None:
+            if not future.cancelled() and future.exception() is None:
+                admission.turns.release(turn_key, future.result())
+
+        try:
+            return await asyncio.shield(waiter)
+        except asyncio.CancelledError:
+            waiter.add_done_callback(_release_late)
+            raise
+
+    async def astream_events(self, input_dict: dict, config: dict | None = None, **kwargs):
+        """
+        app.astream_events 的会话串行包装 (同 invoke)；运行被取消或调用方提前退出时在 finally 中释放会话锁。
+        等待超时时只产生一个 LangGraph on_chain_end 事件，output 为 _busy_state
+        """
+        turn_key = self._turn_key(config)
+        turn = await self._acquire_turn_async(turn_key) if turn_key else None
+        if turn_key and turn is None:
+            yield {"event": "on_chain_end", "name": "LangGraph", "data": {"output": self._busy_state(input_dict)}}
+            return
+        try:
+            async for event in self.app.astream_events(input_dict, config=config, **kwargs):
+                yield event
+        finally:
+            admission.turns.release(turn_key, turn)
+
+    def initial_prep_node(self, input_dict: dict) -> AgentState:
+        """
+        图的第一个节点：将外部原始输入 (input_dict) 转换为 AgentState。
+        LangGraph Server 部署时，HTTP 请求体解析后的字典会作为 input_dict 传入。
+        """
+        # 1. 只需要处理本次请求相关的字段 (messages, references)
+        # 不要重置 last_task_id 等持久化字段，否则会丢失历史状态
+        partial_state = {
+            "references": [],
+            "model_call_count": 0, # 每次新用户输入，重置计数器
+        }
+        if self.config.suggestions:
+            partial_state["suggestions"] = []  # 重置建议
+
+        # 2. 调用预处理逻辑，解析输入并填入 partial_state
+        partial_state = self.prepare_state_from_payload(input_dict, partial_state)
+
+        # 3. 长会话压缩：旧工具结果替换为小记录 (同 id 替换)，超长历史按轮次截断 (RemoveMessage)
+        compaction = session_memory.compaction_updates(input_dict.get("messages") or [])
+        if compaction:
+            partial_state["messages"] = compaction + partial_state.get("messages", [])
+        return partial_state
+
+    def recorder_node(self, state: AgentState) -> AgentState:
+        """记录器节点：从工具执行结果中提取状态和更新 References"""
+        log_system_message = self.log_system_message
+        messages = state["messages"]
+        new_state = {}
+
+        log_system_message("--- [DEBUG] Entering recorder_node ---", level=logging.DEBUG)
+
+        # 倒序遍历寻找最近的 AIMessage (获取参数)
+        last_ai_message = None
+        for msg in reversed(messages):
+            # 检查是否是 AI 消息且有 tool_calls
+            if msg.type == "ai" and hasattr(msg, "tool_calls") and msg.tool_calls:
+                last_ai_message = msg
+                break
+
+        if not last_ai_message:
+            log_system_message("--- [DEBUG] Recorder: No AI message with tool_calls found.", level=logging.DEBUG)
+            return {}
+
+        # 建立 ID 到参数的映射
+        call_id_to_args = {call["id"]: call["args"] for call in last_ai_message.tool_calls}
+        call_id_to_name = {call["id"]: call["name"] for call in last_ai_message.tool_calls}
+
+        log_system_message("--- [DEBUG] Found Tool Calls: %s", list(call_id_to_name.values()), level=logging.DEBUG)
+
+        # 倒序查找最近的 ToolMessage
+        for msg in reversed(messages):
+            if msg.type == "tool":
+                tool_call_id = msg.tool_call_id
+
+                # 只处理属于当前 AI 消息的 ToolMessage
+                if tool_call_id in call_id_to_args:
+                    tool_name = call_id_to_name[tool_call_id]
+                    log_system_message("--- [DEBUG] Processing ToolMessage for: %s", tool_name, level=logging.DEBUG)
+
+                    # 1. 如果是生成类任务 -> 记录 ID, Config, ToolName
+                    if "create_task" in tool_name:
+                        task_payload = msg.content
+                        log_system_message("--- [DEBUG] Raw Payload: %s", task_payload, level=logging.DEBUG)
+
+                        task_id = None
+                        parsed = None
+                        if isinstance(task_payload, dict):
+                            parsed = task_payload
+                            task_id = task_payload.get("task_id") or task_payload.get("id")
+                        elif isinstance(task_payload, str):
+                            candidate = task_payload.strip()
+                            if candidate.startswith("{") and candidate.endswith("}"):
+                                try:
+                                    parsed = json.loads(candidate)
+                                    task_id = parsed.get("task_id") or parsed.get("id")
+                                except json.JSONDecodeError:
+                                    task_id = candidate
+                            else:
+                                task_id = candidate
+                        elif task_payload:
+                            task_id = str(task_payload)
+
+                        if not task_id:
+                            log_system_message("--- [DEBUG] ❌ FAILED to extract task_id", level=logging.DEBUG)
+                            self.logger.warning("Recorder: tool %s returned no task_id payload=%s", tool_name, task_payload)
+                            continue
+
+                        log_system_message("--- [DEBUG] ✅ CAPTURED task_id: %s, tool_name: %s, config: %s",
+                                           task_id, tool_name, call_id_to_args[tool_call_id], level=logging.DEBUG)
+                        self.logger.info("Recorder captured task %s via tool %s", task_id, tool_name)
+
+                        # 多变体任务组：task_id 为组 ID，成员 ID 列表一并记录，供自动加载选择变体
+                        task_ids = parsed.get("task_ids") if isinstance(parsed, dict) else None
+                        new_state["last_task_id"] = task_id
+                        new_state["last_task_ids"] = list(task_ids) if task_ids else [task_id]
+                        # 路由工具 (image_edit_routed_create_task) 记录实际执行的后端工具，状态查询 / 自动加载据此分发
+                        backend_tool = parsed.get("backend_tool") if isinstance(parsed, dict) else None
+                        new_state["last_tool_name"] = backend_tool or tool_name
+                        new_state["last_task_config"] = call_id_to_args[tool_call_id]
+
+                        break
+
+        return new_state
+
+    def model_call(self, state: AgentState) -> AgentState:
+        """
+        模型调用节点：负责构建 Prompt 并调用 LLM，同时处理自动加载逻辑。
+        不修改传入的 state (copy-on-write)：自动加载的 references 只在本次调用内使用，
+        注入后的用户消息以同 id 的 HumanMessage 作为增量返回，由 add_messages 替换原消息。
+        """
+        log_system_message = self.log_system_message
+
+        def _snapshot(tag: str):
+            # 完整 messages 转储随会话长度线性增长：只在 DEBUG 级别或按 LOG_STATE_SAMPLE_RATE 抽样输出
+            if not should_dump_state(self.logger):
+                return
+            log_system_message(
+                "[STATE:%s] msgs=%s, \n================================================\n"
+                "refs=%s,last_task_id=%s, last_tool_name=%s",
+                tag, state.get("messages"), state.get("references"), state.get("last_task_id"), state.get("last_tool_name"),
+            )
+        _snapshot("enter")
+
+        # --- 计数器自增 ---
+        current_count = state.get("model_call_count", 0) + 1
+        log_system_message("[Step] Model Call Count: %d", current_count)
+
+        # --- 自动加载上一轮生成结果 (Auto-Load Logic) ---
+        # 保留自动查询：即使前端也会传回 URL，我们仍提供"无感知兜底"体验，
+        # 尤其在用户连续编辑、没有选择 ref 时，可以自动查询上一轮任务结果，减轻人工操作
+
+        current_refs = state.get("references", [])
+        references = current_refs
+        messages = list(state["messages"])
+        replaced_human: HumanMessage | None = None
+        last_tid = state.get("last_task_id")
+        last_tool = state.get("last_tool_name")
+
+        # 如果当前没有引用，且有上一轮任务，且上一轮是图像编辑任务，尝试自动加载
+        # 防御：确保 last_tool 不为 None 且确实是工具调用
+        # 优化：只在首轮思考 (current_count为基数代表agent已经执行过tool) 时加载，避免在工具执行后的总结阶段重复加载
+
+        # [FIX] 增加判定：如果用户 Prompt 中已经包含 url 链接，则认为用户提供了素材，不进行自动 Hack
+        user_provided_url_in_text = False
+        if self.config.skip_auto_load_on_url:
+            last_human_msg = messages[-1] if messages and isinstance(messages[-1], HumanMessage) else None
+            if last_human_msg and ("http://" in last_human_msg.content or "https://" in last_human_msg.content):
+                user_provided_url_in_text = True
+
+        if current_count%2 == 1 and not current_refs and not user_provided_url_in_text and last_tid and last_tool:
+            if "image_edit" in last_tool.lower():
+                # 多变体任务组会记录全部成员 ID，单任务时退化为 [last_tid]
+                last_tids = state.get("last_task_ids") or [last_tid]
+                provider = "PPIO" if ("ppio" in last_tool.lower() or "banana" in last_tool.lower()) else "KIE"
+                variant_urls: list[tuple[int, str]] = []
+                # max_images > 1 时一个任务返回多张图：按 变体 -> 图片 顺序展开为 "候选图" 统一编号
+                multi_image = False
+                log_system_message("[系统] 尝试自动加载上一轮任务结果 (ID: %s, 变体数: %d)...", last_tid, len(last_tids))
+
+                # 根据 Last Tool Name 决定调用哪个查询函数 (复用 KIE_tools 内部逻辑)，任务组内并发查询
+                auto_load_started = time.perf_counter()
+                try:
+                    with tracing.span("auto_load", task_id=last_tid, **{"auto_load.variants": len(last_tids)}):
+                        results = _get_task_group_status_impl(last_tool, last_tids)
+                    per_variant = [_result_urls(res) for res in results]
+                    multi_image = any(len(urls) > 1 for urls in per_variant)
+                    if multi_image:
+                        variant_urls = list(enumerate((url for urls in per_variant for url in urls), 1))
+                    else:
+                        variant_urls = [(idx + 1, urls[0]) for idx, urls in enumerate(per_variant) if urls]
+                    log_system_message("%s 查询成功: %s", provider, variant_urls)
+                except Exception as e:
+                    log_system_message("[系统] %s 查询失败: %s", provider, e)
+                metrics.AUTO_LOAD_SECONDS.observe(time.perf_counter() - auto_load_started, graph=self.graph_name,
+                                                  outcome="loaded" if variant_urls else "pending")
+
+                original_content = messages[-1].content if messages and isinstance(messages[-1], HumanMessage) else ""
+                # 用户可以通过 "用变体2" / "第三张" / "候选图5" 选择任务组中的某个变体或某张候选图
+                noun, label = ("候选图", "Candidate") if multi_image else ("变体", "Variant")
+                picked = _pick_variant_index(original_content, len(variant_urls) if multi_image else len(last_tids))
+                if picked is not None:
+                    variant_urls = [(idx, url) for idx, url in variant_urls if idx == picked]
+
+                if variant_urls:
+                    log_system_message("[系统] ✅ 成功加载上一轮结果: %s", variant_urls)
+                    # 只在本次调用内生效；不返回，所以不会持久化到下一轮
+                    if len(last_tids) == 1 and not multi_image:
+                        fetched_url = variant_urls[0][1]
+                        references = [{"url": fetched_url, "desc": "Last Generation Result (Auto-loaded)"}]
+                        injection = f"（系统自动注入：请使用上一次的编辑结果 {fetched_url} 作为参考图。）\n"
+                    elif len(variant_urls) == 1:
+                        idx, fetched_url = variant_urls[0]
+                        references = [{"url": fetched_url, "desc": f"Last Generation Result - {label} {idx} (Auto-loaded)"}]
+                        injection = f"（系统自动注入：请使用上一次生成的{noun}{idx} {fetched_url} 作为参考图。）\n"
+                    else:
+                        references = [
+                            {"url": url, "desc": f"Last Generation Result - {label} {idx} (Auto-loaded)"}
+                            for idx, url in variant_urls
+                        ]
+                        listing = "；".join(f"{noun}{idx}: {url}" for idx, url in variant_urls)
+                        injection = (f"（系统自动注入：上一次共生成了 {len(variant_urls)} 个{noun} —— {listing}。"
+                                     f"请使用用户指定编号的{noun}作为参考图，未指定时使用{noun}{variant_urls[0][0]}。）\n")
+
+                    # --- 简单粗暴：Hack 用户 Prompt，强制 Agent 注意到这张图 ---
+                    if original_content:
+                        # 避免重复添加
+                        if "系统自动注入" not in original_content:
+                            new_content = injection + original_content
+                            # 新建同 id 的消息而不是改写原对象：原消息可能被其他轮次 / checkpoint 共享
+                            replaced_human = messages[-1].model_copy(update={"content": new_content})
+                            messages[-1] = replaced_human
+                            log_system_message("[Hack] 修改用户 Prompt: %s...", new_content[:100])
+                else:
+                    log_system_message("[系统] ⏳ 上一轮任务仍在处理中或无法获取结果。")
+            else:
+                log_system_message("跳过自动加载: refs=%s last_tid=%s last_tool=%s", current_refs, last_tid, last_tool)
+
+        # 1. 注入动态上下文
+        context_str = ""
+
+        # 注入素材库 (使用本轮的 references，可能来自用户输入或自动加载)
+        if references:
+            context_str += "\n### [REFERENCES]\n"
+            for idx, asset in enumerate(references):
+                context_str += f"{idx+1}. {asset.get('desc', 'Image')}: {asset.get('url')}\n"
+
+        # 注入全局风格配置
+        if state.get("global_config"):
+            context_str += f"\n### [GLOBAL CONFIG]\n{json.dumps(state['global_config'], ensure_ascii=False)}\n"
+            context_str += "INSTRUCTION: Always reference these parameters (resolution, aspect_ratio, art_style, etc.) when calling tools unless the user explicitly overrides them in query.\n"
+
+        # 2. 组合 Prompt (工具描述部分已在构建图时格式化)
+        system_prompt = SystemMessage(content=self.system_prompt_base + context_str)
+
+        # 3. 调用模型
+        rate_limiter.acquire("llm")
+        # [FIX] 强制单步执行逻辑：如果是第二轮（工具执行回来后），不再提供工具，强制只生成回复
+        use_tools = not (self.config.final_answer_mode and current_count > 1)
+        # 按本轮信号 (参考图数、消息长度、重试、配置覆盖、上一轮失败等) 选择 reasoning_effort
+        effort = effort_policy.choose_effort({**state, "messages": messages, "references": references},
+                                             self.config.reasoning_effort, current_count)
+        llm_started = time.perf_counter()
+        with tracing.span("llm.invoke", kind=tracing.KIND_CLIENT,
+                          **{"llm.model": self.config.model, "llm.tools_bound": use_tools,
+                             "llm.reasoning_effort": effort.effort}) as llm_span:
+            if not use_tools:
+                log_system_message("[系统] 检测到多轮对话，强制切换为无工具模式 (Final Answer Mode)")
+            response, model_name = self._invoke_llm([system_prompt] + messages, use_tools, effort.effort)
+
+        # structured 模式返回 {"raw", "parsed"}；bind_tools 或 invoke 直接返回 AIMessage
+        raw_response = response["raw"] if self.config.response_mode == RESPONSE_STRUCTURED else response
+        tracing.record_llm_usage(llm_span, raw_response)
+        llm_seconds = time.perf_counter() - llm_started
+        metrics.record_llm_call(self.graph_name, "our_agent", model_name, llm_seconds, raw_response)
+        effort_policy.record(self.graph_name, "our_agent", effort, llm_seconds, raw_response)
+
+        # 只返回 messages，不返回 references (自动加载的 references 不持久化到下一轮)
+        # 注入后的用户消息与原消息同 id，add_messages 原位替换，之后的调用 / 下一轮都能看到注入内容
+        _snapshot("exit")
+        return {
+            "messages": ([replaced_human] if replaced_human is not None else []) + [raw_response],
+            "model_call_count": current_count,
+            }
+
+    def suggestion_node(self, state: AgentState) -> AgentState:
+        """建议生成节点：基于当前对话历史生成后续建议 (缓存 -> 模板 -> LLM，见 suggestion_engine)"""
+        log_system_message = self.log_system_message
+        log_system_message("--- [DEBUG] Generating Suggestions ---", level=logging.DEBUG)
+
+        # 构建专门的 Prompt 用于生成建议
+        # 获取最近的对话作为上下文
+        messages = state["messages"][-5:] # 取最近5条即可
+
+        prompt = SystemMessage(content=SUGGESTION_SYSTEM_PROMPT)
+
+        def _llm_fallback() -> list[str]:
+            rate_limiter.acquire("llm")
+            llm_started = time.perf_counter()
+            with tracing.span("llm.suggestions", kind=tracing.KIND_CLIENT, **{"llm.model": self.config.model}) as llm_span:
+                response = self.suggestion_llm.invoke([prompt] + messages)
+            tracing.record_llm_usage(llm_span, response["raw"])
+            llm_seconds = time.perf_counter() - llm_started
+            metrics.record_llm_call(self.graph_name, "suggestion_generator", self.config.model, llm_seconds,
+                                    response["raw"])
+            effort_policy.record(self.graph_name, "suggestion_generator", effort_policy.SUGGESTIONS, llm_seconds,
+                                 response["raw"])
+            return response["parsed"].suggestions
+
+        # 依次尝试 缓存 -> 模板库 -> LLM
+        suggestions, source = suggestion_engine.generate(state, _llm_fallback)
+        log_system_message("--- [DEBUG] Suggestions Generated (%s): %s", source, suggestions, level=logging.DEBUG)
+        if self.logger.isEnabledFor(logging.DEBUG):
+            log_system_message("--- [DEBUG] Suggestion Engine Stats: %s", suggestion_engine.stats(), level=logging.DEBUG)
+        return {"suggestions": suggestions}
+
+    @staticmethod
+    def should_continue(state: AgentState):
+        """判断是否继续调用工具"""
+        messages = state["messages"]
+        last_message = messages[-1]
+        if hasattr(last_message, 'tool_calls') and not last_message.tool_calls:
+            return "end"
+        else:
+            return "continue"
+
+    # --- 图 ---
+    def _release_on_error(self, node):
+        """
+        节点抛出异常时释放本轮的租约：异常中断的轮次不会经过 admission_release，
+        否则租约要等到 TTL 才会回收
+        """
+        def _node(state, config):
+            try:
+                return node(state, config)
+            except BaseException:
+                self._release_ticket(state.get("admission") if isinstance(state, dict) else None)
+                raise
+
+        _node.__name__ = getattr(node, "__name__", "node")
+        return _node
+
+    def _instrument(self, name: str, node, new_trace: bool = False):
+        """节点包装：profiling (慢节点火焰图) 在内层，tracing span 在外层；均未开启时开销可忽略"""
+        wrapped = profiling.profiled_node(name, node, self.graph_name)
+        if not new_trace:
+            # 入口节点执行前 state.admission 还不是本轮的 ticket
+            wrapped = self._release_on_error(wrapped)
+        return tracing.traced_node(name, wrapped, self.graph_name, new_trace=new_trace)
+
+    def _build_graph(self) -> StateGraph:
+        graph = StateGraph(AgentState)
+        graph.add_node("admission", self._instrument("admission", self.admission_node, new_trace=True))
+        graph.add_node("our_agent", self._instrument("our_agent", self.model_call))
+        graph.add_node("initial_prep", self._instrument("initial_prep", self.initial_prep_node))
+        graph.add_node("tools", self._instrument("tools", tool_node(self.tools)))
+        graph.add_node("recorder", self._instrument("recorder", self.recorder_node))
+        if self.config.suggestions:
+            graph.add_node("suggestion_generator", self._instrument("suggestion_generator", self.suggestion_node))
+        graph.add_node("admission_release", self._instrument("admission_release", self.admission_release_node))
+
+        # 准入控制在 initial_prep 之前：被拒绝的请求直接结束，不进入 LLM / 工具
+        graph.set_entry_point("admission")
+        graph.add_conditional_edges("admission", self.route_admission, {"admitted": "initial_prep", "rejected": END})
+        graph.add_edge("initial_prep", "our_agent")
+
+        graph.add_conditional_edges(
+            "our_agent",
+            self.should_continue,
+            {
+                "continue": "tools",
+                # 生成建议的模板先经过 suggestion_generator 再结束
+                "end": "suggestion_generator" if self.config.suggestions else "admission_release",
+            },
+        )
+
+        graph.add_edge("tools", "recorder")
+        graph.add_edge("recorder", "our_agent")
+        if self.config.suggestions:
+            graph.add_edge("suggestion_generator", "admission_release")
+        graph.add_edge("admission_release", END)
+        return graph
+
+    # --- 命令行交互 ---
+    async def chat_async(self):
+        """持续对话模式 - Token级流式输出"""
+        from stream_parser import AnswerStreamParser, chunk_text
+
+        log_system_message = self.log_system_message
+        app = self.app
+
+        # 欢迎界面
+        print("\n" + "=" * 60)
+        print(self.config.cli_title)
+        print("=" * 60)
+
+        # AI 的开场白
+        greeting = self.config.greeting
+
+        # 初始化 AgentState
+        state: AgentState = {"messages": [AIMessage(content=greeting)]}
+        # 启用持久化时按 thread_id 恢复上次会话 (last_task_id / last_task_config / global_config 等)
+        run_config = sqlite_checkpointer.session_config(self.graph_name)
+        if run_config:
+            saved = app.get_state(run_config).values
+            if saved:
+                state = saved
+                print(f"\n(已恢复会话 {run_config['configurable']['thread_id']}，历史消息 {len(saved.get('messages', []))} 条)")
+        print(f"\nAI: {greeting}\n")
+
+        structured = self.config.response_mode == RESPONSE_STRUCTURED
+        while True:
+            user_input = input("你: ")
+
+            # 退出检测
+            if user_input.lower() in ["exit", "quit", "退出"]:
+                print("👋 再见！")
+                break
+            if not user_input.strip():
+                continue
+
+            log_system_message("[INPUT] 用户输入: %s%s", user_input[:100], "..." if len(user_input) > 100 else "")
+            # 尝试解析 JSON 输入（通用预处理）
+            try:
+                input_data = json.loads(user_input)
+                state = self.prepare_state_from_payload(input_data, state)
+
+            except json.JSONDecodeError:
+                # 普通文本输入 -> 清空上一轮的参考素材；新建 state，不改写上一轮输出的对象
+                state = {**state, "references": [], "messages": [*state["messages"], HumanMessage(content=user_input)]}
+                log_system_message("[INPUT] 纯文本输入 (非 JSON)", echo=False)
+                log_system_message("[INPUT] references: [] (已清空)", echo=False)
+                log_system_message("[INPUT] last_task_id: %s", state.get("last_task_id", "None"))
+                log_system_message("[INPUT] last_tool_name: %s", state.get("last_tool_name", "None"))
+
+            # 使用 Token 级流式输出
+            print()
+
+            # 跟踪状态
+            in_agent_response = False
+            shown_ai_prefix = False
+            # structured 模式：每次模型调用 (run_id) 对应一个增量 JSON 解析器，只输出 answer 字段的文本增量
+            answer_parsers: dict[str, AnswerStreamParser] = {}
+
+            # 使用 astream_events 实现 Token 级流式（只执行一次）
+            async for event in self.astream_events(state, config=run_config, version="v2"):
+                kind = event["event"]
+
+                # 捕获 LLM 的流式 token
+                if kind == "on_chat_model_stream":
+                    if structured:
+                        parser = answer_parsers.setdefault(event["run_id"], AnswerStreamParser())
+                        if parser.done:
+                            continue
+                        content = parser.feed(chunk_text(event["data"]["chunk"].content))
+                    else:
+                        content = event["data"]["chunk"].content if "chunk" in event["data"] else ""
+                    if content:
+                        if not shown_ai_prefix:
+                            print("AI: ", end="", flush=True)
+                            shown_ai_prefix = True
+                        print(content, end="", flush=True)
+                        in_agent_response = True
+                    # answer 之后的 suggestions 在对象闭合时一次性输出
+                    if structured and parser.done and parser.result and parser.result.get("suggestions"):
+                        print("\n\n💡 建议:")
+                        for idx, sug in enumerate(parser.result["suggestions"]):
+                            print(f"{idx+1}. {sug}")
+
+                # 捕获工具调用信息
+                elif kind == "on_tool_start":
+                    tool_name = event["name"]
+                    if in_agent_response:
+                        print()  # 换行
+                        in_agent_response = False
+                    print(f"\n[🔧 调用工具: {tool_name}]", flush=True)
+                    shown_ai_prefix = False  # 重置，下次模型输出时再显示
+
+                elif kind == "on_tool_end":
+                    log_system_message("[✓ 工具执行完成] %s\n", event["name"], echo=True)
+                    in_agent_response = False
+
+                # 捕获最终状态更新
+                elif kind == "on_chain_end" and event.get("name") == "LangGraph":
+                    # 获取最终输出状态
+                    state = event["data"]["output"]
+                    rejected = state.get("admission") or {}
+                    if rejected.get("status") == "rejected":
+                        print(f"AI: {rejected.get('message')}")
+                    # suggestion_generator 生成的建议
+                    if state.get("suggestions"):
+                        print("\n\n💡 建议:")
+                        for idx, sug in enumerate(state["suggestions"]):
+                            print(f"{idx+1}. {sug}")
+
+            print("\n")  # 空行分隔
+
+    def chat(self):
+        """同步包装器 - 调用异步 chat 函数"""
+        import asyncio
+
+        try:
+            asyncio.run(self.chat_async())
+        except KeyboardInterrupt:
+            print("\n\n程序已中断。再见！")
+
+
+def build_graph(config: TemplateConfig) -> TemplateGraph:
+    return TemplateGraph(config)
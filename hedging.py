@@ -0,0 +1,194 @@
+"""
+LLM 对冲请求 (hedged requests)：主调用超过历史延迟分位数仍未返回时，向备用模型 / 端点再发一次
+
+model_call 对 doubao / gpt-5-nano 只发一次阻塞的 invoke，没有超时也没有备用，单个慢请求会拖住整轮。
+开启 LLM_HEDGE 后：
+- 每个 key (graph/model) 维护最近 LLM_HEDGE_WINDOW 次主调用的成功耗时 (落败的慢主调用完成后同样记录)，对冲延迟取其 LLM_HEDGE_PERCENTILE 分位
+  (样本不足 LLM_HEDGE_MIN_SAMPLES 时使用 LLM_HEDGE_DEFAULT_DELAY_MS，且不低于 LLM_HEDGE_MIN_DELAY_MS)
+- 主调用在本次调用自己的线程中执行 (不经过共享线程池)：进程内 LLM 并发不受线程数限制，
+  也没有排队时间计入对冲延迟；调用线程只负责等待，先到的有效结果可以立即返回
+- 超过对冲延迟：在有界线程池 (LLM_HEDGE_MAX_BACKUPS) 中提交备用调用，先返回且通过 is_valid 校验的结果胜出；
+  一方失败时等待另一方。备用名额已满 (大量请求同时变慢，通常是上游整体拥塞) 时不再对冲，只等主调用
+- 落败方：同步 HTTP 无法中断，结果被丢弃；备用调用带 LLM_HEDGE_BACKUP_TIMEOUT_S 的 HTTP 超时，
+  落败的备用请求最多占用名额这么久。完成时间用于计算节省的延迟 (落败方完成时间 - 胜出方完成时间)
+指标：mynamechat_llm_hedges_total{graph, outcome} (outcome 含 saturated)、mynamechat_llm_hedge_saved_seconds{graph}
+
+环境变量：
+    LLM_HEDGE=1
+    LLM_HEDGE_PERCENTILE=95
+    LLM_HEDGE_MIN_SAMPLES=20
+    LLM_HEDGE_WINDOW=200
+    LLM_HEDGE_DEFAULT_DELAY_MS=10000
+    LLM_HEDGE_MIN_DELAY_MS=1000
+    LLM_HEDGE_MAX_BACKUPS=8           同时在途的备用请求上限，满了不再对冲
+    LLM_HEDGE_BACKUP_TIMEOUT_S=60     备用请求的 HTTP 超时 (秒)
+    LLM_HEDGE_BACKUP_MODEL=           备用模型，默认与主模型相同 (同端点对冲)
+    LLM_HEDGE_BACKUP_API_KEY_ENV=     备用模型的 API Key 环境变量名 (例如 DOUBAO_API_KEY)
+    LLM_HEDGE_BACKUP_BASE_URL_ENV=    备用模型的 Base URL 环境变量名
+"""
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, Callable
+
+import metrics
+import tracing
+from logger_util import get_logger
+
+logger = get_logger("mynamechat.hedging")
+
+LLM_HEDGE = (os.getenv("LLM_HEDGE") or "").lower() in ("1", "true", "yes", "on")
+LLM_HEDGE_PERCENTILE = float(os.getenv("LLM_HEDGE_PERCENTILE") or 95)
+LLM_HEDGE_MIN_SAMPLES = int(os.getenv("LLM_HEDGE_MIN_SAMPLES") or 20)
+LLM_HEDGE_WINDOW = int(os.getenv("LLM_HEDGE_WINDOW") or 200)
+LLM_HEDGE_DEFAULT_DELAY_MS = float(os.getenv("LLM_HEDGE_DEFAULT_DELAY_MS") or 10000)
+LLM_HEDGE_MIN_DELAY_MS = float(os.getenv("LLM_HEDGE_MIN_DELAY_MS") or 1000)
+LLM_HEDGE_MAX_BACKUPS = max(1, int(os.getenv("LLM_HEDGE_MAX_BACKUPS") or 8))
+LLM_HEDGE_BACKUP_TIMEOUT_S = float(os.getenv("LLM_HEDGE_BACKUP_TIMEOUT_S") or 60)
+LLM_HEDGE_BACKUP_MODEL = os.getenv("LLM_HEDGE_BACKUP_MODEL") or None
+LLM_HEDGE_BACKUP_API_KEY_ENV = os.getenv("LLM_HEDGE_BACKUP_API_KEY_ENV") or None
+LLM_HEDGE_BACKUP_BASE_URL_ENV = os.getenv("LLM_HEDGE_BACKUP_BASE_URL_ENV") or None
+
+PRIMARY = "primary"
+BACKUP = "backup"
+
+# 只执行备用调用：名额 (信号量) 与线程数相同，提交时总有空闲线程，不会排队
+_BACKUP_POOL = ThreadPoolExecutor(max_workers=LLM_HEDGE_MAX_BACKUPS, thread_name_prefix="llm-hedge")
+_BACKUP_SLOTS = threading.BoundedSemaphore(LLM_HEDGE_MAX_BACKUPS)
+
+
+def enabled() -> bool:
+    return LLM_HEDGE
+
+
+class LatencyTracker:
+    """按 key 保存最近 window 次主调用成功耗时 (秒)，给出分位数"""
+
+    def __init__(self, window: int = LLM_HEDGE_WINDOW):
+        self.window = window
+        self._samples: dict[str, deque] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, key: str, seconds: float) -> None:
+        with self._lock:
+            samples = self._samples.get(key)
+            if samples is None:
+                samples = self._samples[key] = deque(maxlen=self.window)
+            samples.append(seconds)
+
+    def percentile(self, key: str, p: float, min_samples: int = 1) -> float | None:
+        with self._lock:
+            samples = list(self._samples.get(key) or ())
+        if len(samples) < max(1, min_samples):
+            return None
+        ordered = sorted(samples)
+        k = min(len(ordered) - 1, max(0, int(round(p / 100.0 * len(ordered) + 0.5)) - 1))
+        return ordered[k]
+
+
+_TRACKER = LatencyTracker()
+
+
+def hedge_delay(key: str) -> float:
+    """当前 key 的对冲延迟 (秒)"""
+    observed = _TRACKER.percentile(key, LLM_HEDGE_PERCENTILE, LLM_HEDGE_MIN_SAMPLES)
+    delay_ms = observed * 1000 if observed is not None else LLM_HEDGE_DEFAULT_DELAY_MS
+    return max(delay_ms, LLM_HEDGE_MIN_DELAY_MS) / 1000.0
+
+
+def _record_saved(graph: str, loser: Future, winner_done_at: float) -> None:
+    """落败方完成后记录节省的延迟；落败方失败或被取消时不计"""
+    def _done(f: Future) -> None:
+        if f.cancelled() or f.exception() is not None:
+            return
+        metrics.LLM_HEDGE_SAVED.observe(max(0.0, time.perf_counter() - winner_done_at), graph=graph)
+    loser.add_done_callback(_done)
+
+
+def _start_primary(fn: Callable[[], Any]) -> Future:
+    """在独立线程中执行主调用，返回其 Future (不占用备用线程池)"""
+    future: Future = Future()
+    future.set_running_or_notify_cancel()
+
+    def _run() -> None:
+        try:
+            future.set_result(fn())
+        except BaseException as e:
+            future.set_exception(e)
+
+    threading.Thread(target=tracing.propagate(_run), name="llm-primary", daemon=True).start()
+    return future
+
+
+def _submit_backup(fn: Callable[[], Any]) -> Future | None:
+    """占用一个备用名额提交备用调用；名额已满时返回 None"""
+    if not _BACKUP_SLOTS.acquire(blocking=False):
+        return None
+    try:
+        future = _BACKUP_POOL.submit(tracing.propagate(fn))
+    except BaseException:
+        _BACKUP_SLOTS.release()
+        raise
+    future.add_done_callback(lambda _: _BACKUP_SLOTS.release())
+    return future
+
+
+def call(key: str, graph: str, primary: Callable[[], Any], backup: Callable[[], Any],
+         is_valid: Callable[[Any], bool] = lambda r: r is not None) -> tuple[Any, str]:
+    """
+    执行主调用，超过对冲延迟后并发执行备用调用；返回 (结果, PRIMARY | BACKUP)。
+    两者都失败 / 无效时抛出主调用的异常 (主调用成功但无效时返回主调用结果，交由调用方按原逻辑处理)。
+    """
+    started = time.perf_counter()
+    delay = hedge_delay(key)
+    primary_future = _start_primary(primary)
+
+    def _observe_primary(future) -> None:
+        # 无论谁胜出都记录主调用耗时：只记录先于备用返回的样本会让分位数偏低，对冲越来越激进
+        if not future.cancelled() and future.exception() is None:
+            _TRACKER.observe(key, time.perf_counter() - started)
+
+    primary_future.add_done_callback(_observe_primary)
+    done, _ = wait([primary_future], timeout=delay)
+    if done:
+        metrics.LLM_HEDGES.inc(graph=graph, outcome="not_needed")
+        return primary_future.result(), PRIMARY
+
+    backup_future = _submit_backup(backup)
+    if backup_future is None:
+        logger.warning("LLM %s exceeded hedge delay %.0fms but %d backups are in flight, not hedging",
+                       key, delay * 1000, LLM_HEDGE_MAX_BACKUPS)
+        metrics.LLM_HEDGES.inc(graph=graph, outcome="saturated")
+        return primary_future.result(), PRIMARY
+
+    logger.info("LLM %s exceeded hedge delay %.0fms, sending backup request", key, delay * 1000)
+    tracing.set_attributes(**{"llm.hedged": True, "llm.hedge_delay_ms": round(delay * 1000)})
+    sources = {primary_future: PRIMARY, backup_future: BACKUP}
+    pending = set(sources)
+    first_invalid: tuple[Any, str] | None = None
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            source = sources[future]
+            if future.exception() is not None:
+                logger.warning("LLM %s %s request failed: %s", key, source, future.exception())
+                continue
+            result = future.result()
+            if not is_valid(result):
+                first_invalid = first_invalid or (result, source)
+                continue
+            winner_done_at = time.perf_counter()
+            for loser in pending:
+                if not loser.cancel():
+                    _record_saved(graph, loser, winner_done_at)
+            metrics.LLM_HEDGES.inc(graph=graph, outcome=f"{source}_won")
+            tracing.set_attributes(**{"llm.hedge_winner": source})
+            logger.info("LLM %s hedge won by %s after %.0fms", key, source, (winner_done_at - started) * 1000)
+            return result, source
+
+    metrics.LLM_HEDGES.inc(graph=graph, outcome="both_failed")
+    if first_invalid is not None:
+        return first_invalid
+    return primary_future.result(), PRIMARY  # 重新抛出主调用的异常
@@ -0,0 +1,182 @@
+"""
+进程内 LLM 客户端注册表：按 (model, base_url) 复用 ChatOpenAI，按 base_url 共享 HTTP 连接池，可选启动预热
+
+每个 ChatOpenAI 默认自带一个 httpx 客户端，llm / structured_llm / structured_llm_no_tools / suggestion_llm
+以及三个图各自持有连接池，连接被切得很碎；部署后第一个请求还要付出一次冷 TLS 握手。这里：
+- get_client(model, api_key_env, base_url_env)：同一 (model, api_key, base_url) 只创建一个 ChatOpenAI
+- 同一 base_url 的所有模型共用一对 httpx.Client / AsyncClient (同步 invoke 与 astream_events 各一个连接池)
+- structured / with_tools：同一参数的 with_structured_output / bind_tools 包装只创建一次
+- register + warm_up：图构建时登记用到的端点 (不创建客户端)；设置 LLM_WARMUP=1 时在后台线程对每个
+  端点发一次 GET {base_url}/models，提前建立 TLS 连接放进同步连接池 (model_call 的 invoke 使用)，不阻塞启动
+cassette 录制 / 回放模式下使用 cassette 的 HTTP 客户端，且不做预热。
+
+环境变量：
+    LLM_WARMUP=1                  服务启动时预热连接
+    LLM_POOL_MAX_CONNECTIONS=100  每个 base_url 的最大连接数
+    LLM_POOL_MAX_KEEPALIVE=20     每个 base_url 保持的空闲连接数
+"""
+import os
+import threading
+import time
+from typing import TYPE_CHECKING, Sequence
+
+import cassette
+from logger_util import get_logger
+
+if TYPE_CHECKING:
+    from langchain_openai import ChatOpenAI
+
+logger = get_logger("mynamechat.llm_registry")
+
+DEFAULT_BASE_URL = "https://api.openai.com/v1"
+LLM_WARMUP = (os.getenv("LLM_WARMUP") or "").lower() in ("1", "true", "yes", "on")
+LLM_POOL_MAX_CONNECTIONS = int(os.getenv("LLM_POOL_MAX_CONNECTIONS") or 100)
+LLM_POOL_MAX_KEEPALIVE = int(os.getenv("LLM_POOL_MAX_KEEPALIVE") or 20)
+WARMUP_TIMEOUT = 5.0
+
+_CLIENTS: dict[tuple, "ChatOpenAI"] = {}
+_HTTP_POOLS: dict[str, dict] = {}
+_RUNNABLES: dict[tuple, object] = {}
+_ENDPOINTS: set[tuple] = set()
+_WARMED: set[str] = set()
+_LOCK = threading.RLock()
+
+
+def _resolve(api_key_env: str | None, base_url_env: str | None) -> tuple[str | None, str | None]:
+    api_key = os.getenv(api_key_env) if api_key_env else None
+    base_url = os.getenv(base_url_env) if base_url_env else None
+    return api_key, base_url
+
+
+def _pool_key(base_url: str | None) -> str:
+    return (base_url or os.getenv("OPENAI_BASE_URL") or DEFAULT_BASE_URL).rstrip("/")
+
+
+def http_clients(base_url: str | None) -> dict:
+    """base_url 对应的共享 http_client / http_async_client (ChatOpenAI 关键字参数)"""
+    key = _pool_key(base_url)
+    with _LOCK:
+        pool = _HTTP_POOLS.get(key)
+        if pool is None:
+            pool = cassette.llm_client_kwargs()  # 录制/回放模式下替换 HTTP 客户端
+            if not pool:
+                import httpx
+                import openai
+
+                limits = httpx.Limits(max_connections=LLM_POOL_MAX_CONNECTIONS,
+                                      max_keepalive_connections=LLM_POOL_MAX_KEEPALIVE)
+                pool = {
+                    "http_client": openai.DefaultHttpxClient(limits=limits),
+                    "http_async_client": openai.DefaultAsyncHttpxClient(limits=limits),
+                }
+            _HTTP_POOLS[key] = pool
+        return pool
+
+
+def get_client(model: str, api_key_env: str | None = None, base_url_env: str | None = None,
+               timeout: float | None = None) -> "ChatOpenAI":
+    """
+    按 (model, api_key, base_url, timeout) 共享 ChatOpenAI；env 名为空时使用 OPENAI_API_KEY / OPENAI_BASE_URL。
+    timeout 为单次请求的 HTTP 超时 (秒)，不同 timeout 的客户端仍共用同一连接池
+    """
+    from langchain_openai import ChatOpenAI
+
+    api_key, base_url = _resolve(api_key_env, base_url_env)
+    key = (model, api_key, base_url, timeout)
+    with _LOCK:
+        client = _CLIENTS.get(key)
+        if client is None:
+            kwargs = {"api_key": api_key, "base_url": base_url} if api_key_env or base_url_env else {}
+            if timeout:
+                kwargs["timeout"] = timeout
+            client = _CLIENTS[key] = ChatOpenAI(model=model,
+                                                temperature=0.0,
+                                                **kwargs,
+                                                **http_clients(base_url))
+            logger.info("LLM client created: model=%s base_url=%s", model, _pool_key(base_url))
+        return client
+
+
+def _shared(key: tuple, build):
+    with _LOCK:
+        runnable = _RUNNABLES.get(key)
+        if runnable is None:
+            runnable = _RUNNABLES[key] = build()
+        return runnable
+
+
+def tool_names(tools: Sequence) -> tuple:
+    return tuple(getattr(t, "name", str(t)) for t in tools)
+
+
+def structured(llm: "ChatOpenAI", schema, tools: Sequence = (), reasoning_effort: str = "medium"):
+    """共享的 with_structured_output(include_raw=True) 包装；tools 为空时为纯回复模式"""
+    key = ("structured", id(llm), schema, tool_names(tools), reasoning_effort)
+
+    def _build():
+        kwargs = {"tools": list(tools)} if tools else {}
+        return llm.with_structured_output(
+            schema=schema,
+            method="json_schema",
+            strict=True,
+            include_raw=True,
+            reasoning_effort=reasoning_effort,
+            **kwargs,
+        )
+    return _shared(key, _build)
+
+
+def with_tools(llm: "ChatOpenAI", tools: Sequence, reasoning_effort: str | None = None):
+    """共享的 bind_tools 包装：纯文本流式输出 + 工具调用能力"""
+    kwargs = {"reasoning_effort": reasoning_effort} if reasoning_effort else {}
+    return _shared(("bind_tools", id(llm), tool_names(tools), reasoning_effort),
+                   lambda: llm.bind_tools(list(tools), **kwargs))
+
+
+def with_effort(llm: "ChatOpenAI", reasoning_effort: str | None):
+    """不带工具的纯文本调用；指定 reasoning_effort 时返回共享的 bind 包装"""
+    if not reasoning_effort:
+        return llm
+    return _shared(("effort", id(llm), reasoning_effort), lambda: llm.bind(reasoning_effort=reasoning_effort))
+
+
+# --- 预热 ---
+def register(model: str, api_key_env: str | None = None, base_url_env: str | None = None) -> None:
+    """登记一个会用到的模型端点 (不创建客户端)；LLM_WARMUP 开启时在后台预热"""
+    key = (model, api_key_env, base_url_env)
+    with _LOCK:
+        _ENDPOINTS.add(key)
+    if LLM_WARMUP:
+        threading.Thread(target=warm_up, args=([key],), name="llm-warmup", daemon=True).start()
+
+
+def _warm_one(model: str, api_key_env: str | None, base_url_env: str | None) -> None:
+    client = get_client(model, api_key_env, base_url_env)
+    api_key, base_url = _resolve(api_key_env, base_url_env)
+    pool_key = _pool_key(base_url)
+    api_key = api_key or os.getenv("OPENAI_API_KEY")
+    headers = {"Authorization": f"Bearer {api_key}"} if api_key else {}
+    http_client = http_clients(base_url)["http_client"]
+    t0 = time.perf_counter()
+    try:
+        # 任何响应 (包括 401 / 404) 都说明 TCP + TLS 已建立，连接回到共享连接池
+        response = http_client.get(f"{pool_key}/models", headers=headers, timeout=WARMUP_TIMEOUT)
+        logger.info("LLM warm-up %s (%s): HTTP %d in %.0fms", pool_key, client.model_name,
+                    response.status_code, (time.perf_counter() - t0) * 1000)
+    except Exception as e:
+        logger.warning("LLM warm-up %s failed after %.0fms: %s", pool_key, (time.perf_counter() - t0) * 1000, e)
+
+
+def warm_up(endpoints: list[tuple] | None = None) -> None:
+    """创建已登记端点的客户端并各发一次轻量请求；同一 base_url 只预热一次"""
+    if cassette.active() is not None:
+        return
+    with _LOCK:
+        targets = list(endpoints) if endpoints is not None else list(_ENDPOINTS)
+    for model, api_key_env, base_url_env in targets:
+        pool_key = _pool_key(_resolve(api_key_env, base_url_env)[1])
+        with _LOCK:
+            if pool_key in _WARMED:
+                continue
+            _WARMED.add(pool_key)
+        _warm_one(model, api_key_env, base_url_env)
@@ -0,0 +1,291 @@
+"""
+并发会话压测：一个 langgraph.json 部署能承载多少同时在线用户
+
+- 启动 fake_providers (假模型 + KIE/PPIO/OSS/Supabase 替身)，再导入图模块，走真实代码路径
+- 每个会话按多轮脚本执行 (编辑 -> 重试 -> 视频)，状态在轮次之间传递 (同 chat_async)
+- 按并发梯度爬升 (--levels 1,2,4,8,16)，每个梯度记录：
+  吞吐 (turns/s)、单轮延迟与各节点延迟的 p50/p95/p99、错误数、线程数、RSS
+- 结果写入 JSON，便于版本间对比
+
+用法：
+    python load_test.py --levels 1,4,16,32 --sessions-per-level 2 -o bench_results/load.json
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from fake_providers import FakeProviderConfig, FakeProviderServer
+
+# 多轮脚本：编辑 -> 重试 -> 视频 (第一轮带参考图，后两轮依赖自动加载)
+DEFAULT_SCRIPT = [
+    {"user_query": "把这张图的天空改成黄昏", "references": [{"url": "https://example.com/ref.png", "desc": "参考图"}]},
+    {"user_query": "重试一下，换个随机种子"},
+    {"user_query": "用这张图生成一个视频"},
+]
+
+DEFAULT_LEVELS = "1,2,4,8"
+DEFAULT_GRAPHS = ["my_name_chat_agent", "custom_chat_agent", "my_name_suggestion_chat_agent"]
+NODE_NAMES = {"initial_prep", "our_agent", "tools", "recorder", "suggestion_generator"}
+
+
+def percentiles(values: list[float], points=(50, 95, 99)) -> dict:
+    if not values:
+        return {f"p{p}": None for p in points} | {"count": 0, "mean": None, "max": None}
+    ordered = sorted(values)
+    result = {}
+    for p in points:
+        k = min(len(ordered) - 1, max(0, int(round(p / 100.0 * len(ordered) + 0.5)) - 1))
+        result[f"p{p}"] = round(ordered[k], 4)
+    result["count"] = len(ordered)
+    result["mean"] = round(sum(ordered) / len(ordered), 4)
+    result["max"] = round(ordered[-1], 4)
+    return result
+
+
+def current_rss_bytes() -> int | None:
+    """当前进程 RSS (Linux 读 /proc，其余平台退化为 ru_maxrss 峰值)"""
+    try:
+        with open("/proc/self/status", encoding="ascii") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    try:
+        import resource
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return rss if sys.platform == "darwin" else rss * 1024
+    except (ImportError, OSError):
+        return None
+
+
+class ResourceSampler:
+    """后台线程定期采样线程数与 RSS"""
+
+    def __init__(self, interval: float = 0.5):
+        self.interval = interval
+        self.samples: list[tuple[float, int, int | None]] = []
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="resource-sampler", daemon=True)
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            self.samples.append((time.monotonic(), threading.active_count(), current_rss_bytes()))
+            self._stop.wait(self.interval)
+
+    def __enter__(self) -> "ResourceSampler":
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._stop.set()
+        self._thread.join()
+        self.samples.append((time.monotonic(), threading.active_count(), current_rss_bytes()))
+
+    def summary(self) -> dict:
+        threads = [s[1] for s in self.samples]
+        rss = [s[2] for s in self.samples if s[2] is not None]
+        return {
+            "threads_max": max(threads) if threads else None,
+            "threads_end": threads[-1] if threads else None,
+            "rss_start_bytes": rss[0] if rss else None,
+            "rss_max_bytes": max(rss) if rss else None,
+            "rss_end_bytes": rss[-1] if rss else None,
+        }
+
+
+def _node_timing_handler():
+    """LangChain 回调：按 langgraph_node 记录每个节点的耗时"""
+    from langchain_core.callbacks import BaseCallbackHandler
+
+    class NodeTimingHandler(BaseCallbackHandler):
+        def __init__(self):
+            self.starts: dict = {}
+            self.durations: list[tuple[str, float]] = []
+            self._lock = threading.Lock()
+
+        def on_chain_start(self, serialized, inputs, *, run_id, metadata=None, name=None, **kwargs):
+            node = (metadata or {}).get("langgraph_node")
+            if node in NODE_NAMES and name == node:
+                with self._lock:
+                    self.starts[run_id] = (node, time.perf_counter())
+
+        def _finish(self, run_id):
+            with self._lock:
+                started = self.starts.pop(run_id, None)
+                if started:
+                    self.durations.append((started[0], time.perf_counter() - started[1]))
+
+        def on_chain_end(self, outputs, *, run_id, **kwargs):
+            self._finish(run_id)
+
+        def on_chain_error(self, error, *, run_id, **kwargs):
+            self._finish(run_id)
+
+    return NodeTimingHandler()
+
+
+def run_session(module, script: list[dict], handler) -> dict:
+    """执行一个多轮会话，返回每轮耗时与错误"""
+    from langchain_core.messages import AIMessage
+
+    state = {"messages": [AIMessage(content="你好！我是你的 AI 创作助手。")]}
+    turns, errors = [], []
+    session_id = str(uuid.uuid4())
+    for turn_idx, payload in enumerate(script):
+        t0 = time.perf_counter()
+        try:
+            state = module.prepare_state_from_payload(dict(payload), state)
+            state = module.invoke(state, config={"callbacks": [handler], "configurable": {"thread_id": session_id}})
+            turns.append(time.perf_counter() - t0)
+        except Exception as e:
+            errors.append(f"turn {turn_idx}: {type(e).__name__}: {e}")
+            break
+    return {"turns": turns, "errors": errors}
+
+
+def run_level(module, concurrency: int, sessions: int, script: list[dict]) -> dict:
+    handler = _node_timing_handler()
+    t0 = time.perf_counter()
+    with ResourceSampler() as sampler:
+        with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="session") as pool:
+            results = list(pool.map(lambda _: run_session(module, script, handler), range(sessions)))
+    elapsed = time.perf_counter() - t0
+
+    turn_latencies = [t for r in results for t in r["turns"]]
+    errors = [e for r in results for e in r["errors"]]
+    by_node: dict[str, list[float]] = {}
+    for node, duration in handler.durations:
+        by_node.setdefault(node, []).append(duration)
+
+    return {
+        "concurrency": concurrency,
+        "sessions": sessions,
+        "turns_completed": len(turn_latencies),
+        "errors": len(errors),
+        "error_samples": errors[:5],
+        "elapsed_seconds": round(elapsed, 3),
+        "throughput_turns_per_s": round(len(turn_latencies) / elapsed, 3) if elapsed else None,
+        "turn_latency": percentiles(turn_latencies),
+        "node_latency": {node: percentiles(values) for node, values in sorted(by_node.items())},
+        "resources": sampler.summary(),
+    }
+
+
+def find_knee(levels: list[dict], factor: float = 2.0) -> int | None:
+    """p95 超过最低并发梯度 p95 的 factor 倍时，视为延迟崩溃点"""
+    baseline = next((lv["turn_latency"]["p95"] for lv in levels if lv["turn_latency"]["p95"]), None)
+    if not baseline:
+        return None
+    for lv in levels:
+        p95 = lv["turn_latency"]["p95"]
+        if p95 and p95 > factor * baseline:
+            return lv["concurrency"]
+    return None
+
+
+def _git_revision() -> str | None:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)), stderr=subprocess.DEVNULL, text=True,
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def fast_provider_config(seed: int | None = None) -> FakeProviderConfig:
+    """压测默认配置：生成耗时压缩到秒级，使多轮脚本 (依赖自动加载) 在合理时间内完成"""
+    config = FakeProviderConfig(kie_generation="uniform:0.5,1.5", seed=seed)
+    config.latency.update({"ppio_edit": "uniform:0.3,1.0", "transfer": "uniform:0.05,0.15"})
+    return config
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Concurrent-session load test for the compiled graphs.")
+    parser.add_argument("--graph", action="append", choices=DEFAULT_GRAPHS,
+                        help="Graph(s) to test (default: all three)")
+    parser.add_argument("--levels", default=DEFAULT_LEVELS, help="Comma-separated concurrency ramp")
+    parser.add_argument("--sessions-per-level", type=int, default=2,
+                        help="Sessions per level = concurrency * this value")
+    parser.add_argument("--script", help="JSON file with a list of turn payloads (default: edit -> retry -> video)")
+    parser.add_argument("--llm-latency", help="Fake LLM latency distribution, e.g. lognormal:-0.7,0.3")
+    parser.add_argument("--knee-factor", type=float, default=2.0)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("-o", "--output", help="Result JSON path (default: bench_results/load_<timestamp>.json)")
+    args = parser.parse_args(argv)
+
+    levels = [int(x) for x in args.levels.split(",") if x.strip()]
+    script = DEFAULT_SCRIPT
+    if args.script:
+        with open(args.script, encoding="utf-8") as f:
+            script = json.load(f)
+
+    config = fast_provider_config(seed=args.seed)
+    if args.llm_latency:
+        config.latency["llm"] = args.llm_latency
+
+    server = FakeProviderServer(config).start()
+    # 图模块在导入时读取 Base URL / 构建客户端，必须在设置环境变量之后再导入
+    os.environ.update(server.env())
+    from batch_runner import load_graph_module
+
+    report = {
+        "started_at": datetime.now().isoformat(timespec="seconds"),
+        "git_revision": _git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "levels": levels,
+        "sessions_per_level": args.sessions_per_level,
+        "script": script,
+        "provider_config": {
+            "latency": config.latency,
+            "kie_generation": config.kie_generation,
+            "kie_capacity": config.kie_capacity,
+            "ppio_capacity": config.ppio_capacity,
+        },
+        "graphs": {},
+    }
+    try:
+        for graph_name in args.graph or DEFAULT_GRAPHS:
+            module = load_graph_module(graph_name)
+            results = []
+            for concurrency in levels:
+                result = run_level(module, concurrency, concurrency * args.sessions_per_level, script)
+                results.append(result)
+                print(
+                    f"[{graph_name}] c={concurrency:<4} turns={result['turns_completed']:<5} "
+                    f"err={result['errors']:<3} tput={result['throughput_turns_per_s']}/s "
+                    f"p50={result['turn_latency']['p50']}s p95={result['turn_latency']['p95']}s "
+                    f"threads={result['resources']['threads_max']} rss={result['resources']['rss_max_bytes']}",
+                    flush=True,
+                )
+            report["graphs"][graph_name] = {
+                "levels": results,
+                "p95_knee_concurrency": find_knee(results, args.knee_factor),
+            }
+    finally:
+        server.stop()
+        report["provider_stats"] = {
+            "requests": dict(server.state.request_counts),
+            "errors": dict(server.state.error_counts),
+        }
+
+    output = args.output or os.path.join("bench_results", f"load_{datetime.now():%Y%m%d_%H%M%S}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"Results written to {output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,5 +1,9 @@
+import atexit
 import logging
+import logging.handlers
 import os
+import queue
+import random
 import threading
 from datetime import datetime
 from typing import Dict
@@ -7,7 +11,17 @@ from typing import Dict
 LOG_DIR = os.path.join(os.path.dirname(__file__), "logs")
 os.makedirs(LOG_DIR, exist_ok=True)
 
+# 日志级别与轮转配置 (环境变量覆盖)
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_MAX_BYTES = int(os.getenv("LOG_MAX_BYTES") or 20 * 1024 * 1024)
+LOG_BACKUP_COUNT = int(os.getenv("LOG_BACKUP_COUNT") or 5)
+# 非 DEBUG 级别下，完整 state 转储 (model_call 的 _snapshot) 的抽样比例，0 表示不输出
+LOG_STATE_SAMPLE_RATE = float(os.getenv("LOG_STATE_SAMPLE_RATE") or 0)
+
 _LOGGER_CACHE: Dict[str, logging.Logger] = {}
+_LISTENER: logging.handlers.QueueListener | None = None
+_QUEUE: "queue.SimpleQueue[logging.LogRecord]" = queue.SimpleQueue()
+_LOCK = threading.Lock()
 
 
 def _build_log_path() -> str:
@@ -18,37 +32,64 @@ def _build_log_path() -> str:
     return os.path.join(LOG_DIR, file_name)
 
 
-def get_logger(name: str = "mynamechat") -> logging.Logger:
+def _start_listener() -> str:
     """
-    Return a configured logger that writes to both console and file.
-    Each logger name is cached to avoid duplicate handlers.
+    启动进程内唯一的 QueueListener：请求路径上只做 queue.put，
+    格式化、磁盘写入 (按大小轮转) 与控制台输出都在后台线程完成。
     """
-    if name in _LOGGER_CACHE:
-        return _LOGGER_CACHE[name]
-
+    global _LISTENER
     log_path = _build_log_path()
-    logger = logging.getLogger(name)
-    logger.setLevel(logging.INFO)
-
     formatter = logging.Formatter(
         "%(asctime)s [%(levelname)s] [%(threadName)s] %(name)s - %(message)s"
     )
 
-    file_handler = logging.FileHandler(log_path, encoding="utf-8")
+    file_handler = logging.handlers.RotatingFileHandler(
+        log_path, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT, encoding="utf-8"
+    )
     file_handler.setFormatter(formatter)
 
     stream_handler = logging.StreamHandler()
     stream_handler.setFormatter(formatter)
 
-    # 防止重复添加
-    if not logger.handlers:
-        logger.addHandler(file_handler)
-        logger.addHandler(stream_handler)
-        logger.propagate = False
-        logger.info("Logger initialized. Writing to %s", log_path)
+    _LISTENER = logging.handlers.QueueListener(_QUEUE, file_handler, stream_handler, respect_handler_level=True)
+    _LISTENER.start()
+    # 退出前把队列中剩余的日志刷到磁盘
+    atexit.register(_LISTENER.stop)
+    return log_path
+
+
+def get_logger(name: str = "mynamechat") -> logging.Logger:
+    """
+    Return a configured logger that writes to both console and file.
+    All loggers share one QueueListener; each logger name is cached to avoid duplicate handlers.
+    """
+    if name in _LOGGER_CACHE:
+        return _LOGGER_CACHE[name]
+
+    with _LOCK:
+        if name in _LOGGER_CACHE:
+            return _LOGGER_CACHE[name]
 
-    _LOGGER_CACHE[name] = logger
-    return logger
+        log_path = _start_listener() if _LISTENER is None else None
+        logger = logging.getLogger(name)
+        logger.setLevel(LOG_LEVEL)
+
+        # 防止重复添加
+        if not logger.handlers:
+            logger.addHandler(logging.handlers.QueueHandler(_QUEUE))
+            logger.propagate = False
+        if log_path:
+            logger.info("Logger initialized. Writing to %s (level %s)", log_path, LOG_LEVEL)
+
+        _LOGGER_CACHE[name] = logger
+        return logger
+
+
+def should_dump_state(logger: logging.Logger) -> bool:
+    """完整 state 转储只在 DEBUG 级别或按 LOG_STATE_SAMPLE_RATE 抽样时输出"""
+    if logger.isEnabledFor(logging.DEBUG):
+        return True
+    return LOG_STATE_SAMPLE_RATE > 0 and random.random() < LOG_STATE_SAMPLE_RATE
 
 
 def write_test_log(content: str, logger: logging.Logger | None = None) -> None:
@@ -57,4 +98,3 @@ def write_test_log(content: str, logger: logging.Logger | None = None) -> None:
     """
     logger = logger or get_logger("mynamechat.test")
     logger.info(content)
-
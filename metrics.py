@@ -0,0 +1,285 @@
+"""
+进程内指标注册表 + Prometheus 文本格式输出
+
+目前只能从用户投诉得知 KIE / PPIO 变慢。这里提供最小的 Counter / Gauge / Histogram 实现
+(无第三方依赖)，在以下位置采集：
+- Provider 调用 (KIE_tools._provider_call)：按 provider / endpoint 的延迟直方图与错误数
+- PPIO 后台任务：在途数量 gauge
+- 状态查询：轮询次数与无效轮询 (结果尚未就绪) 次数
+- 自动加载：等待耗时直方图
+- LLM 调用：按 graph / node / model 的延迟直方图与 tokens 计数；对冲请求的结果与节省的延迟
+- 工具：按工具名的调用次数与错误次数
+- 准入控制：在途轮次、排队深度、拒绝次数与排队等待时间
+
+设置 METRICS_PORT 后在后台线程启动 HTTP 端点：GET /metrics
+"""
+import bisect
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from logger_util import get_logger
+
+logger = get_logger("mynamechat.metrics")
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: tuple, values: tuple, extra: tuple = ()) -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)] + [f'{n}="{_escape(v)}"' for n, v in extra]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric:
+    type_name = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict) -> tuple:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[n]) for n in self.labelnames)
+
+    def render(self) -> list[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+
+
+class Counter(_Metric):
+    type_name = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._values: dict[tuple, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0.0)
+
+    def render(self) -> list[str]:
+        lines = super().render()
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}")
+        return lines
+
+
+class Gauge(Counter):
+    type_name = "gauge"
+
+    def dec(self, amount: float = 1.0, **labels) -> None:
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = float(value)
+
+    @contextmanager
+    def track_inprogress(self, **labels):
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+
+class Histogram(_Metric):
+    type_name = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # key -> [每个 bucket 的计数..., +Inf 计数, sum]
+        self._values: dict[tuple, list[float]] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        idx = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            data = self._values.get(key)
+            if data is None:
+                data = self._values[key] = [0.0] * (len(self.buckets) + 2)
+            data[idx] += 1
+            data[-1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - t0, **labels)
+
+    def count(self, **labels) -> int:
+        data = self._values.get(self._key(labels))
+        return int(sum(data[:-1])) if data else 0
+
+    def render(self) -> list[str]:
+        lines = super().render()
+        with self._lock:
+            for key, data in sorted(self._values.items()):
+                cumulative = 0.0
+                for bound, count in zip(self.buckets + (float("inf"),), data[:-1]):
+                    cumulative += count
+                    labels = _format_labels(self.labelnames, key, (("le", _format_value(bound)),))
+                    lines.append(f"{self.name}_bucket{labels} {_format_value(cumulative)}")
+                labels = _format_labels(self.labelnames, key)
+                lines.append(f"{self.name}_sum{labels} {_format_value(data[-1])}")
+                lines.append(f"{self.name}_count{labels} {_format_value(cumulative)}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Metric {metric.name} already registered")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return "\n".join(line for m in metrics for line in m.render()) + "\n"
+
+
+REGISTRY = Registry()
+
+
+def counter(name, documentation, labelnames=()) -> Counter:
+    return REGISTRY.register(Counter(name, documentation, labelnames))
+
+
+def gauge(name, documentation, labelnames=()) -> Gauge:
+    return REGISTRY.register(Gauge(name, documentation, labelnames))
+
+
+def histogram(name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS) -> Histogram:
+    return REGISTRY.register(Histogram(name, documentation, labelnames, buckets))
+
+
+# --- 业务指标 ---
+PROVIDER_LATENCY = histogram("mynamechat_provider_request_seconds", "Outbound provider call latency.",
+                             ("provider", "endpoint"))
+PROVIDER_ERRORS = counter("mynamechat_provider_errors_total", "Outbound provider calls that raised.",
+                          ("provider", "endpoint"))
+BACKGROUND_JOBS = gauge("mynamechat_background_jobs_in_flight", "Background provider jobs still running.",
+                        ("provider",))
+STATUS_POLLS = counter("mynamechat_task_status_polls_total", "Task status queries sent to a provider.",
+                       ("provider",))
+WASTED_POLLS = counter("mynamechat_task_status_wasted_polls_total",
+                       "Task status queries that returned no result yet.", ("provider",))
+AUTO_LOAD_SECONDS = histogram("mynamechat_auto_load_seconds", "Time model_call waited on auto-loading results.",
+                              ("graph", "outcome"))
+LLM_LATENCY = histogram("mynamechat_llm_request_seconds", "LLM call latency.", ("graph", "node", "model"))
+LLM_TOKENS = counter("mynamechat_llm_tokens_total", "LLM tokens by direction.", ("graph", "node", "model", "type"))
+LLM_HEDGES = counter("mynamechat_llm_hedges_total",
+                     "LLM calls by hedging outcome (not_needed / saturated / primary_won / backup_won / both_failed).",
+                     ("graph", "outcome"))
+LLM_HEDGE_SAVED = histogram("mynamechat_llm_hedge_saved_seconds",
+                            "Latency saved by a hedge: loser completion minus winner completion.", ("graph",))
+SUGGESTION_SOURCES = counter("mynamechat_suggestion_source_total",
+                             "Suggestion requests by source (cache_hit / template_hit / llm_call / llm_error).",
+                             ("source",))
+LLM_EFFORT_SECONDS = histogram("mynamechat_llm_effort_seconds", "LLM call latency by reasoning_effort bucket.",
+                               ("graph", "node", "effort"))
+LLM_EFFORT_REASONING_TOKENS = counter("mynamechat_llm_effort_reasoning_tokens_total",
+                                      "Reasoning tokens by reasoning_effort bucket.", ("graph", "node", "effort"))
+ADMISSION_IN_FLIGHT = gauge("mynamechat_admission_in_flight", "Admitted turns currently in flight.", ("graph",))
+ADMISSION_QUEUE_DEPTH = gauge("mynamechat_admission_queue_depth", "Turns waiting for admission.", ("graph",))
+ADMISSION_REJECTIONS = counter("mynamechat_admission_rejections_total", "Turns shed at graph entry.",
+                               ("graph", "reason"))
+ADMISSION_WAIT_SECONDS = histogram("mynamechat_admission_wait_seconds", "Time queued turns waited before admission.",
+                                   ("graph",))
+SESSION_TURN_WAIT_SECONDS = histogram("mynamechat_session_turn_wait_seconds",
+                                      "Time a turn waited for the previous turn on the same thread.", ("graph",))
+EDIT_ROUTES = counter("mynamechat_edit_route_decisions_total", "Edit backend routing decisions.",
+                      ("backend", "reason"))
+EDIT_BACKEND_SECONDS = histogram("mynamechat_edit_backend_completion_seconds",
+                                 "Edit task backend-side generation time per backend.", ("backend",),
+                                 buckets=(5.0, 10.0, 20.0, 30.0, 45.0, 60.0, 90.0, 120.0, 180.0, 300.0, 600.0))
+EDIT_BACKEND_COMPLETIONS = counter("mynamechat_edit_backend_completions_total", "Finished edit tasks per backend.",
+                                   ("backend", "outcome"))
+TOOL_CALLS = counter("mynamechat_tool_calls_total", "Tool invocations.", ("tool",))
+TOOL_ERRORS = counter("mynamechat_tool_errors_total", "Tool invocations that raised or returned an error.",
+                      ("tool",))
+
+
+def record_llm_call(graph: str, node: str, model: str, seconds: float, message) -> None:
+    """记录一次 LLM 调用的耗时与 usage_metadata 中的 tokens"""
+    LLM_LATENCY.observe(seconds, graph=graph, node=node, model=model)
+    usage = getattr(message, "usage_metadata", None) or {}
+    for token_type, key in (("input", "input_tokens"), ("output", "output_tokens")):
+        if usage.get(key):
+            LLM_TOKENS.inc(usage[key], graph=graph, node=node, model=model, type=token_type)
+    reasoning = (usage.get("output_token_details") or {}).get("reasoning")
+    if reasoning:
+        LLM_TOKENS.inc(reasoning, graph=graph, node=node, model=model, type="reasoning")
+
+
+# --- HTTP 端点 ---
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/metrics", "/"):
+            self.send_error(404)
+            return
+        body = REGISTRY.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+_server: ThreadingHTTPServer | None = None
+_server_lock = threading.Lock()
+
+
+def start_http_server(port: int, host: str = "0.0.0.0") -> ThreadingHTTPServer:
+    """启动 /metrics 端点 (重复调用返回已启动的实例)"""
+    global _server
+    with _server_lock:
+        if _server is None:
+            _server = ThreadingHTTPServer((host, port), _MetricsHandler)
+            _server.daemon_threads = True
+            threading.Thread(target=_server.serve_forever, name="metrics-http", daemon=True).start()
+            logger.info("Metrics endpoint listening on http://%s:%d/metrics", host, _server.server_address[1])
+    return _server
+
+
+def start_from_env() -> None:
+    """METRICS_PORT 已设置时启动端点；端口占用 (多个图模块 / 多进程) 时只记录警告"""
+    port = os.getenv("METRICS_PORT")
+    if not port:
+        return
+    try:
+        start_http_server(int(port), os.getenv("METRICS_HOST") or "0.0.0.0")
+    except OSError as e:
+        logger.warning("Metrics endpoint not started on port %s: %s", port, e)
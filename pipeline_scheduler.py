@@ -0,0 +1,389 @@
+"""
+分镜流水线 (Shot-list DAG) 调度器
+
+典型的续集分镜是 "Banana Pro 编辑首帧 -> 结果喂给 first_frame_to_video_by_kie_sora2_create_task"。
+这里接受一个由生成步骤组成的 DAG：
+- 上游任务一完成就解析出结果 URL，填入下游步骤的参数并立即提交
+- 互不依赖的分支并行提交
+- 提供整个 DAG 的进度快照，多分镜故事板的总耗时约等于关键路径耗时
+
+步骤格式 (JSON)：
+    {
+        "id": "shot1_frame",
+        "tool": "image_edit_by_ppio_banana_pro_create_task",
+        "args": {"prompt": "...", "image_urls": ["https://..."], "seed": 1},
+        "depends_on": {"image_urls": "shot0_frame"}   # 参数名 -> 上游步骤 ID
+    }
+"""
+import argparse
+import json
+import sys
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Union
+
+from KIE_tools import (
+    text_to_image_by_kie_seedream_v4_create_task,
+    image_edit_by_kie_seedream_v4_create_task,
+    image_edit_by_ppio_banana_pro_create_task,
+    image_edit_routed_create_task,
+    text_to_video_by_kie_sora2_create_task,
+    first_frame_to_video_by_kie_sora2_create_task,
+    remove_watermark_from_image_by_kie_seedream_v4_create_task,
+    _get_kie_task_status_impl,
+    _get_ppio_task_status_impl,
+    _result_urls,
+)
+from logger_util import get_logger
+
+logger = get_logger("mynamechat.pipeline")
+
+# 可在流水线中使用的生成工具
+PIPELINE_TOOLS = {
+    t.name: t for t in [
+        text_to_image_by_kie_seedream_v4_create_task,
+        image_edit_by_kie_seedream_v4_create_task,
+        image_edit_by_ppio_banana_pro_create_task,
+        image_edit_routed_create_task,
+        text_to_video_by_kie_sora2_create_task,
+        first_frame_to_video_by_kie_sora2_create_task,
+        remove_watermark_from_image_by_kie_seedream_v4_create_task,
+    ]
+}
+
+# 调度配置
+DEFAULT_POLL_INTERVAL = 3.0      # 秒
+DEFAULT_STEP_TIMEOUT = 15 * 60   # 单步骤最长等待 (秒)
+DEFAULT_MAX_PARALLEL = 8         # 同时在途的提交数
+
+# 步骤状态
+PENDING = "pending"
+SUBMITTED = "submitted"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+SKIPPED = "skipped"  # 上游失败导致无法执行
+
+# KIE recordInfo 的失败状态
+_KIE_FAIL_STATES = {"fail", "failed", "error"}
+
+
+class PipelineError(ValueError):
+    """DAG 定义非法 (未知工具、未知依赖、存在环等)"""
+
+
+@dataclass
+class PipelineStep:
+    step_id: str
+    tool_name: str
+    args: dict
+    depends_on: dict[str, str] = field(default_factory=dict)
+
+    status: str = PENDING
+    task_id: str | None = None
+    backend_tool: str | None = None  # 路由工具实际执行的后端工具，状态查询按它分发
+    result_url: str | None = None
+    error: str | None = None
+    submitted_at: float | None = None
+    finished_at: float | None = None
+
+    @property
+    def upstream(self) -> set[str]:
+        return set(self.depends_on.values())
+
+    def snapshot(self, started_at: float) -> dict:
+        return {
+            "id": self.step_id,
+            "tool": self.tool_name,
+            "status": self.status,
+            "task_id": self.task_id,
+            "backend_tool": self.backend_tool,
+            "result_url": self.result_url,
+            "error": self.error,
+            "depends_on": dict(self.depends_on),
+            "submitted_after_s": round(self.submitted_at - started_at, 3) if self.submitted_at else None,
+            "duration_s": round(self.finished_at - self.submitted_at, 3)
+            if self.finished_at and self.submitted_at else None,
+        }
+
+
+def _poll_task_once(tool_name: str, task_id: str) -> tuple[str, Union[str, None]]:
+    """
+    单次查询任务状态 (不阻塞等待)。
+    返回 (SUCCEEDED, url) / (FAILED, 错误信息) / (SUBMITTED, None)
+    """
+    name = tool_name.lower()
+    if "ppio" in name or "banana" in name:
+        res = _get_ppio_task_status_impl(task_id, max_retries=1, delay=0)
+    else:
+        res = _get_kie_task_status_impl(task_id)
+
+    urls = _result_urls(res)
+    if urls:
+        # 多张候选图时取第一张喂给下游步骤
+        return SUCCEEDED, urls[0]
+    if isinstance(res, dict) and str(res.get("status", "")).lower() in _KIE_FAIL_STATES:
+        return FAILED, res.get("message") or res.get("code") or "Task failed"
+    if isinstance(res, str) and ("not found" in res or "succeeded but" in res):
+        return FAILED, res
+    return SUBMITTED, None
+
+
+class ShotPipeline:
+    """一个分镜 DAG 的调度实例，run() 阻塞直到全部步骤结束，progress() 可在任意线程调用"""
+
+    def __init__(
+        self,
+        steps: list[PipelineStep],
+        poll_interval: float = DEFAULT_POLL_INTERVAL,
+        step_timeout: float = DEFAULT_STEP_TIMEOUT,
+        max_parallel: int = DEFAULT_MAX_PARALLEL,
+        pipeline_id: str | None = None,
+    ):
+        self.pipeline_id = pipeline_id or f"pipeline-{uuid.uuid4()}"
+        self.steps = {step.step_id: step for step in steps}
+        self.poll_interval = poll_interval
+        self.step_timeout = step_timeout
+        self.max_parallel = max_parallel
+        self.started_at: float | None = None
+        self.finished_at: float | None = None
+        self._lock = threading.Lock()
+        self._cancel = threading.Event()
+        self._order = self._validate(steps)
+
+    @classmethod
+    def from_spec(cls, spec: list[dict], **kwargs) -> "ShotPipeline":
+        steps = []
+        for raw in spec:
+            if "id" not in raw or "tool" not in raw:
+                raise PipelineError(f"Step requires 'id' and 'tool': {raw}")
+            steps.append(PipelineStep(
+                step_id=str(raw["id"]),
+                tool_name=raw["tool"],
+                args=dict(raw.get("args") or {}),
+                depends_on=dict(raw.get("depends_on") or {}),
+            ))
+        return cls(steps, **kwargs)
+
+    # --- 校验 ---
+    def _validate(self, steps: list[PipelineStep]) -> list[str]:
+        if len(self.steps) != len(steps):
+            raise PipelineError("Duplicate step id in pipeline.")
+        for step in steps:
+            if step.tool_name not in PIPELINE_TOOLS:
+                raise PipelineError(f"Unknown tool '{step.tool_name}' in step '{step.step_id}'.")
+            if int(step.args.get("num_variants") or 1) > 1:
+                raise PipelineError(f"Step '{step.step_id}': pipeline steps must be single-variant.")
+            for dep in step.upstream:
+                if dep not in self.steps:
+                    raise PipelineError(f"Step '{step.step_id}' depends on unknown step '{dep}'.")
+
+        # Kahn 拓扑排序检测环
+        indegree = {sid: len(step.upstream) for sid, step in self.steps.items()}
+        children: dict[str, list[str]] = {sid: [] for sid in self.steps}
+        for sid, step in self.steps.items():
+            for dep in step.upstream:
+                children[dep].append(sid)
+        queue = [sid for sid, deg in indegree.items() if deg == 0]
+        order = []
+        while queue:
+            sid = queue.pop()
+            order.append(sid)
+            for child in children[sid]:
+                indegree[child] -= 1
+                if indegree[child] == 0:
+                    queue.append(child)
+        if len(order) != len(self.steps):
+            raise PipelineError("Pipeline contains a dependency cycle.")
+        return order
+
+    # --- 调度 ---
+    def _resolve_args(self, step: PipelineStep) -> dict:
+        """把上游结果 URL 填入参数；image_urls 之类的列表参数自动包装为列表"""
+        args = dict(step.args)
+        for arg_name, dep_id in step.depends_on.items():
+            url = self.steps[dep_id].result_url
+            args[arg_name] = [url] if arg_name.endswith("urls") else url
+        if "seed" in PIPELINE_TOOLS[step.tool_name].args:
+            args.setdefault("seed", 0)
+        return args
+
+    def _submit(self, step: PipelineStep) -> None:
+        try:
+            result = PIPELINE_TOOLS[step.tool_name].invoke(self._resolve_args(step))
+        except Exception as e:
+            result = f"Error creating task: {e}"
+
+        with self._lock:
+            if isinstance(result, dict) and result.get("task_id"):
+                step.task_id = result["task_id"]
+                step.backend_tool = result.get("backend_tool") or step.tool_name
+                logger.info("Pipeline %s step %s submitted: %s", self.pipeline_id, step.step_id, step.task_id)
+            else:
+                step.status = FAILED
+                step.error = str(result)
+                step.finished_at = time.monotonic()
+                logger.error("Pipeline %s step %s failed to submit: %s", self.pipeline_id, step.step_id, result)
+
+    def _ready_steps(self) -> list[PipelineStep]:
+        ready = []
+        for sid in self._order:
+            step = self.steps[sid]
+            if step.status != PENDING:
+                continue
+            upstream_status = {self.steps[dep].status for dep in step.upstream}
+            if upstream_status & {FAILED, SKIPPED}:
+                step.status = SKIPPED
+                step.error = "Upstream step failed."
+                continue
+            if upstream_status <= {SUCCEEDED}:
+                ready.append(step)
+        return ready
+
+    def _poll(self, step: PipelineStep) -> None:
+        status, payload = _poll_task_once(step.backend_tool or step.tool_name, step.task_id)
+        with self._lock:
+            if status == SUCCEEDED:
+                step.status = SUCCEEDED
+                step.result_url = payload
+                step.finished_at = time.monotonic()
+                logger.info("Pipeline %s step %s succeeded: %s", self.pipeline_id, step.step_id, payload)
+            elif status == FAILED:
+                step.status = FAILED
+                step.error = payload
+                step.finished_at = time.monotonic()
+                logger.error("Pipeline %s step %s failed: %s", self.pipeline_id, step.step_id, payload)
+            elif time.monotonic() - step.submitted_at > self.step_timeout:
+                step.status = FAILED
+                step.error = f"Timed out after {self.step_timeout}s."
+                step.finished_at = time.monotonic()
+
+    def run(self) -> dict:
+        """阻塞执行整个 DAG，返回最终进度快照"""
+        self.started_at = time.monotonic()
+        logger.info("Pipeline %s started with %d steps", self.pipeline_id, len(self.steps))
+
+        with ThreadPoolExecutor(max_workers=self.max_parallel, thread_name_prefix="pipeline") as pool:
+            while not self._cancel.is_set():
+                # 1. 提交所有依赖已满足的步骤 (独立分支并行)
+                with self._lock:
+                    ready = self._ready_steps()
+                    for step in ready:
+                        step.status = SUBMITTED
+                        step.submitted_at = time.monotonic()
+                list(pool.map(self._submit, ready))
+
+                with self._lock:
+                    in_flight = [s for s in self.steps.values() if s.status == SUBMITTED and s.task_id]
+                    unfinished = [s for s in self.steps.values() if s.status in (PENDING, SUBMITTED)]
+                if not unfinished:
+                    break
+
+                # 2. 并发轮询在途任务；有步骤完成时立即进入下一轮提交下游
+                if in_flight:
+                    list(pool.map(self._poll, in_flight))
+                with self._lock:
+                    newly_ready = any(
+                        s.status == PENDING and s.upstream and
+                        all(self.steps[d].status == SUCCEEDED for d in s.upstream)
+                        for s in self.steps.values()
+                    )
+                if not newly_ready:
+                    self._cancel.wait(self.poll_interval)
+
+        self.finished_at = time.monotonic()
+        progress = self.progress()
+        logger.info("Pipeline %s finished: %s", self.pipeline_id, progress["counts"])
+        return progress
+
+    def cancel(self) -> None:
+        self._cancel.set()
+
+    def progress(self) -> dict:
+        """整个 DAG 的进度快照"""
+        with self._lock:
+            started = self.started_at or time.monotonic()
+            steps = [self.steps[sid].snapshot(started) for sid in self._order]
+        counts = {s: 0 for s in (PENDING, SUBMITTED, SUCCEEDED, FAILED, SKIPPED)}
+        for step in steps:
+            counts[step["status"]] += 1
+        done = counts[SUCCEEDED] + counts[FAILED] + counts[SKIPPED]
+        if self.finished_at:
+            status = "completed" if counts[SUCCEEDED] == len(steps) else "finished_with_errors"
+        else:
+            status = "running" if self.started_at else "created"
+        end = self.finished_at or time.monotonic()
+        return {
+            "pipeline_id": self.pipeline_id,
+            "status": status,
+            "total": len(steps),
+            "done": done,
+            "percent": round(100.0 * done / len(steps), 1) if steps else 100.0,
+            "counts": counts,
+            "elapsed_s": round(end - self.started_at, 3) if self.started_at else 0.0,
+            "steps": steps,
+        }
+
+
+# --- 后台运行与进度查询 ---
+# 长期运行的服务中按 LRU 限制条目数 (与 KIE_tools._TASK_GROUPS 相同)；被淘汰的流水线仍会跑完，只是无法再查询进度
+MAX_PIPELINES = 256
+_PIPELINES: "OrderedDict[str, ShotPipeline]" = OrderedDict()
+_PIPELINES_LOCK = threading.Lock()
+
+
+def submit_pipeline(spec: list[dict], **kwargs) -> str:
+    """在后台线程运行 DAG，立即返回 pipeline_id"""
+    pipeline = ShotPipeline.from_spec(spec, **kwargs)
+    with _PIPELINES_LOCK:
+        _PIPELINES[pipeline.pipeline_id] = pipeline
+        while len(_PIPELINES) > MAX_PIPELINES:
+            _PIPELINES.popitem(last=False)
+    threading.Thread(target=pipeline.run, name=pipeline.pipeline_id, daemon=True).start()
+    return pipeline.pipeline_id
+
+
+def get_pipeline_progress(pipeline_id: str) -> dict | None:
+    with _PIPELINES_LOCK:
+        pipeline = _PIPELINES.get(pipeline_id)
+        if pipeline is not None:
+            _PIPELINES.move_to_end(pipeline_id)
+    return pipeline.progress() if pipeline else None
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Run a shot-list DAG of generation steps.")
+    parser.add_argument("spec", help="JSON file containing a list of steps")
+    parser.add_argument("--poll-interval", type=float, default=DEFAULT_POLL_INTERVAL)
+    parser.add_argument("--step-timeout", type=float, default=DEFAULT_STEP_TIMEOUT)
+    parser.add_argument("--max-parallel", type=int, default=DEFAULT_MAX_PARALLEL)
+    args = parser.parse_args(argv)
+
+    with open(args.spec, encoding="utf-8") as f:
+        spec = json.load(f)
+    pipeline_id = submit_pipeline(
+        spec,
+        poll_interval=args.poll_interval,
+        step_timeout=args.step_timeout,
+        max_parallel=args.max_parallel,
+    )
+
+    last_done = -1
+    while True:
+        progress = get_pipeline_progress(pipeline_id)
+        if progress["done"] != last_done:
+            last_done = progress["done"]
+            print(f"[{progress['elapsed_s']:.1f}s] {progress['done']}/{progress['total']} {progress['counts']}", flush=True)
+        if progress["status"] in ("completed", "finished_with_errors"):
+            break
+        time.sleep(1.0)
+
+    print(json.dumps(progress, ensure_ascii=False, indent=2))
+    return 0 if progress["status"] == "completed" else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,145 @@
+"""
+按图节点的可选采样 Profiling：慢轮次输出 collapsed-stack (火焰图) 文件
+
+线上某一轮很慢时，无法区分是 Python 开销、JSON 处理还是阻塞 I/O。这里提供一个共享的采样器线程：
+- 节点开始时登记当前线程，采样器按固定间隔读取 sys._current_frames() 中该线程的调用栈并计数
+- 节点结束后若耗时超过阈值，写出 collapsed-stack 文件 (每行 "frame;frame;frame count")，
+  可直接交给 flamegraph.pl / speedscope / inferno 渲染；未超过阈值则丢弃样本
+- 没有节点在采样时采样器线程处于等待状态；未开启 profiling 的请求只多一次 dict 查找
+
+开启方式：
+    PROFILE_NODES=1                         对所有请求开启
+    config={"configurable": {"profile": True}}   单个请求开启 (LangGraph Server 同样通过 configurable 传入)
+其他环境变量：
+    PROFILE_THRESHOLD_MS=1000   超过该耗时才写文件 (configurable.profile_threshold_ms 可按请求覆盖)
+    PROFILE_INTERVAL_MS=5       采样间隔
+    PROFILE_DIR=profiles        输出目录
+
+注意：只采样执行节点的线程。ToolNode 内部的线程池、PPIO 后台线程不在采样范围内，
+它们在节点线程上表现为等待 future 的栈 (即阻塞等待时间)。
+"""
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+
+import tracing
+from logger_util import get_logger
+
+logger = get_logger("mynamechat.profiling")
+
+PROFILE_ENABLED = (os.getenv("PROFILE_NODES") or "").lower() in ("1", "true", "yes", "on")
+PROFILE_THRESHOLD_MS = float(os.getenv("PROFILE_THRESHOLD_MS") or 1000)
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS") or 5)
+PROFILE_DIR = os.getenv("PROFILE_DIR") or os.path.join(os.path.dirname(os.path.abspath(__file__)), "profiles")
+
+# 栈深度上限，避免递归很深时单个样本过大
+MAX_STACK_DEPTH = 128
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def collapse_stack(frame) -> str:
+    """把帧链转换为 collapsed 格式：根在前、叶在后，以分号分隔"""
+    labels = []
+    while frame is not None and len(labels) < MAX_STACK_DEPTH:
+        labels.append(_frame_label(frame))
+        frame = frame.f_back
+    return ";".join(reversed(labels))
+
+
+class StackSampler:
+    """共享采样器：同一时刻可以为多个线程 (并发会话中的多个节点) 采样"""
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._targets: dict[int, Counter] = {}
+        self._cond = threading.Condition()
+        self._thread: threading.Thread | None = None
+
+    def _ensure_thread(self) -> None:
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+            self._thread.start()
+
+    def start(self, thread_id: int) -> Counter:
+        samples: Counter = Counter()
+        with self._cond:
+            self._targets[thread_id] = samples
+            self._ensure_thread()
+            self._cond.notify()
+        return samples
+
+    def stop(self, thread_id: int) -> None:
+        with self._cond:
+            self._targets.pop(thread_id, None)
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                while not self._targets:
+                    self._cond.wait()
+                # 在锁内计数：stop() 返回后样本不再变化，可以安全写文件
+                frames = sys._current_frames()
+                for thread_id, samples in self._targets.items():
+                    frame = frames.get(thread_id)
+                    if frame is not None:
+                        samples[collapse_stack(frame)] += 1
+                del frames, frame
+            time.sleep(self.interval)
+
+
+_SAMPLER = StackSampler(PROFILE_INTERVAL_MS / 1000.0)
+
+
+def _requested(config: dict | None) -> tuple[bool, float]:
+    configurable = (config or {}).get("configurable") or {}
+    enabled = bool(configurable.get("profile", PROFILE_ENABLED))
+    threshold = float(configurable.get("profile_threshold_ms") or PROFILE_THRESHOLD_MS)
+    return enabled, threshold
+
+
+def write_collapsed(samples: Counter, path: str) -> None:
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        for stack, count in samples.most_common():
+            f.write(f"{stack} {count}\n")
+
+
+def profiled_node(name: str, node, graph_name: str | None = None):
+    """包装图节点：开启 profiling 的请求在节点执行期间采样，超过阈值时写出 collapsed-stack 文件"""
+    call = tracing.node_caller(node)
+
+    def _node(state, config):
+        enabled, threshold_ms = _requested(config)
+        if not enabled:
+            return call(state, config)
+
+        thread_id = threading.get_ident()
+        samples = _SAMPLER.start(thread_id)
+        t0 = time.perf_counter()
+        try:
+            return call(state, config)
+        finally:
+            _SAMPLER.stop(thread_id)
+            elapsed_ms = (time.perf_counter() - t0) * 1000
+            if elapsed_ms >= threshold_ms and samples:
+                trace_id = state.get("trace_id") if isinstance(state, dict) else None
+                file_name = (f"{graph_name or 'graph'}_{name}_{datetime.now():%Y%m%d_%H%M%S}_"
+                             f"{trace_id or thread_id}_{int(elapsed_ms)}ms.collapsed")
+                path = os.path.join(PROFILE_DIR, file_name)
+                try:
+                    write_collapsed(samples, path)
+                    logger.info("Slow node %s.%s took %.0fms (%d samples), profile written to %s",
+                                graph_name, name, elapsed_ms, sum(samples.values()), path)
+                except OSError as e:
+                    logger.warning("Failed to write profile %s: %s", path, e)
+
+    _node.__name__ = getattr(node, "__name__", name)
+    return _node
+
@@ -0,0 +1,78 @@
+"""
+按 Provider 的令牌桶限流
+
+KIE / PPIO / LLM 各自有上游速率限制。批量任务 (batch_runner) 在启动时通过
+configure_rate_limit 注册限额，工具与模型调用在发出请求前调用 acquire(provider)。
+未注册限额的 provider 直接放行，没有额外开销。
+"""
+import threading
+import time
+
+from logger_util import get_logger
+
+logger = get_logger("mynamechat.rate_limiter")
+
+
+class TokenBucket:
+    """线程安全的令牌桶：rate 为每秒补充的令牌数，burst 为桶容量"""
+
+    def __init__(self, rate: float, burst: float | None = None):
+        if rate <= 0:
+            raise ValueError("rate must be positive")
+        self.rate = float(rate)
+        self.capacity = float(burst if burst is not None else max(1.0, rate))
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float) -> None:
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self, tokens: float = 1.0, timeout: float | None = None) -> bool:
+        """阻塞直到拿到令牌；超过 timeout 返回 False"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return True
+                wait = (tokens - self._tokens) / self.rate
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                wait = min(wait, remaining)
+            time.sleep(wait)
+
+
+_BUCKETS: dict[str, TokenBucket] = {}
+
+
+def configure_rate_limit(provider: str, rate: float, burst: float | None = None) -> None:
+    """注册/覆盖某个 provider 的限额 (次/秒)"""
+    _BUCKETS[provider] = TokenBucket(rate, burst)
+    logger.info("Rate limit configured: %s = %.3f/s (burst %.1f)", provider, rate, _BUCKETS[provider].capacity)
+
+
+def clear_rate_limits() -> None:
+    _BUCKETS.clear()
+
+
+def acquire(provider: str, timeout: float | None = None) -> bool:
+    """在向 provider 发出请求前调用；未配置限额时立即返回 True"""
+    bucket = _BUCKETS.get(provider)
+    if bucket is None:
+        return True
+    return bucket.acquire(timeout=timeout)
+
+
+def parse_rate_limit(spec: str) -> tuple[str, float, float | None]:
+    """解析 "kie=2" 或 "kie=2:5" (provider=每秒次数[:突发容量])"""
+    provider, _, value = spec.partition("=")
+    if not provider or not value:
+        raise ValueError(f"Invalid rate limit spec: {spec!r} (expected provider=rate[:burst])")
+    rate, _, burst = value.partition(":")
+    return provider.strip(), float(rate), float(burst) if burst else None
@@ -0,0 +1,186 @@
+"""
+长会话内存控制：压缩旧工具结果 + 按轮次截断消息 + tracemalloc 报告
+
+AgentState.messages 只增不减，每条 ToolMessage 保留完整工具返回；chat_async 在轮次之间持有整个 state。
+这里在每轮开始 (initial_prep) 生成一组 messages 更新，借助 add_messages 的语义原地生效：
+- 早于最近 SESSION_KEEP_FULL_TURNS 轮的 ToolMessage 用同 id 的消息替换为 {task_id, model, status} 小记录
+- 消息数超过 SESSION_MAX_MESSAGES 时，从最早的完整轮次 (HumanMessage 边界) 开始发 RemoveMessage，
+  不会拆散 AI tool_calls 与其 ToolMessage
+recorder / 自动加载只依赖当前轮与 last_task_* 字段，不受影响。
+
+环境变量：
+    SESSION_MAX_MESSAGES=200      (0 表示不截断)
+    SESSION_KEEP_FULL_TURNS=2     最近 N 轮的工具结果保持原样
+
+用法 (合成长会话，对比压缩前后的 tracemalloc 占用)：
+    python session_memory.py --turns 2000
+"""
+import argparse
+import json
+import os
+import sys
+import tracemalloc
+from typing import Sequence
+
+from langchain_core.messages import BaseMessage, HumanMessage, RemoveMessage, ToolMessage
+from logger_util import get_logger
+
+logger = get_logger("mynamechat.session_memory")
+
+SESSION_MAX_MESSAGES = int(os.getenv("SESSION_MAX_MESSAGES") or 200)
+SESSION_KEEP_FULL_TURNS = int(os.getenv("SESSION_KEEP_FULL_TURNS") or 2)
+
+# 压缩记录保留的字段；状态文本截断长度
+_COMPACT_KEYS = ("task_id", "task_ids", "model", "status")
+_STATUS_MAX_CHARS = 160
+
+
+def _turn_starts(messages: Sequence[BaseMessage]) -> list[int]:
+    return [i for i, m in enumerate(messages) if isinstance(m, HumanMessage)]
+
+
+def compact_payload(content) -> str | None:
+    """把工具返回压缩为 {task_id, model, status}；已压缩或无需压缩时返回 None"""
+    if isinstance(content, str):
+        text = content.strip()
+        if text.startswith("{"):
+            try:
+                parsed = json.loads(text)
+            except json.JSONDecodeError:
+                parsed = None
+            if isinstance(parsed, dict):
+                if parsed.get("compacted"):
+                    return None
+                record = {k: parsed[k] for k in _COMPACT_KEYS if k in parsed}
+                record["compacted"] = True
+                compacted = json.dumps(record, ensure_ascii=False)
+                return compacted if len(compacted) < len(content) else None
+        if len(content) <= _STATUS_MAX_CHARS:
+            return None
+        return json.dumps({"status": content[:_STATUS_MAX_CHARS], "compacted": True}, ensure_ascii=False)
+    if isinstance(content, dict):
+        return compact_payload(json.dumps(content, ensure_ascii=False))
+    return None
+
+
+def compaction_updates(
+    messages: Sequence[BaseMessage],
+    max_messages: int = SESSION_MAX_MESSAGES,
+    keep_full_turns: int = SESSION_KEEP_FULL_TURNS,
+) -> list[BaseMessage]:
+    """
+    返回交给 add_messages 的更新列表 (RemoveMessage / 同 id 替换的 ToolMessage)。
+    在新一轮 HumanMessage 追加之前调用，messages 为上一轮结束时的历史。
+    """
+    if not messages:
+        return []
+    starts = _turn_starts(messages)
+
+    # 1. 截断：从最早的轮次边界开始整轮移除，直到剩余消息数不超过上限
+    cut = 0
+    if max_messages and len(messages) > max_messages:
+        cut = next((b for b in starts if len(messages) - b <= max_messages), starts[-1] if starts else 0)
+    updates: list[BaseMessage] = [RemoveMessage(id=m.id) for m in messages[:cut] if m.id]
+
+    # 2. 压缩：保留区间内、早于最近 keep_full_turns 轮的 ToolMessage
+    recent = [b for b in starts if b >= cut]
+    if keep_full_turns <= 0:
+        full_from = len(messages)
+    elif len(recent) >= keep_full_turns:
+        full_from = recent[-keep_full_turns]
+    else:
+        full_from = cut
+    compacted_count = 0
+    for m in messages[cut:full_from]:
+        if isinstance(m, ToolMessage) and m.id:
+            compacted = compact_payload(m.content)
+            if compacted is not None:
+                updates.append(ToolMessage(content=compacted, tool_call_id=m.tool_call_id, name=m.name, id=m.id))
+                compacted_count += 1
+
+    if updates:
+        logger.info("Session compaction: removed %d messages, compacted %d tool results (history %d)",
+                    len(updates) - compacted_count, compacted_count, len(messages))
+    return updates
+
+
+def apply_updates(messages: Sequence[BaseMessage], updates: Sequence[BaseMessage]) -> list[BaseMessage]:
+    """不经过图、直接在本地列表上应用 compaction_updates (CLI / 脚本使用)"""
+    removed = {u.id for u in updates if isinstance(u, RemoveMessage)}
+    replaced = {u.id: u for u in updates if not isinstance(u, RemoveMessage)}
+    return [replaced.get(m.id, m) for m in messages if m.id not in removed]
+
+
+# --- tracemalloc 报告 ---
+def _deep_size(obj, seen: set[int]) -> int:
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(_deep_size(k, seen) + _deep_size(v, seen) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(_deep_size(v, seen) for v in obj)
+    elif hasattr(obj, "__dict__"):
+        size += _deep_size(vars(obj), seen)
+    return size
+
+
+def session_bytes(state: dict) -> int:
+    """单个会话 state 的近似内存占用 (递归 sys.getsizeof，共享对象只计一次)"""
+    return _deep_size(state, set())
+
+
+def memory_report(sessions: dict[str, dict] | None = None, top: int = 10) -> dict:
+    """
+    tracemalloc 报告：进程当前 / 峰值追踪内存、按分配位置的 Top N，以及每个会话的字节数。
+    需要先 tracemalloc.start() (或设置 PYTHONTRACEMALLOC=1)，否则只返回会话字节数。
+    """
+    report: dict = {"tracing": tracemalloc.is_tracing()}
+    if tracemalloc.is_tracing():
+        current, peak = tracemalloc.get_traced_memory()
+        stats = tracemalloc.take_snapshot().statistics("lineno")[:top]
+        report.update({
+            "traced_current_bytes": current,
+            "traced_peak_bytes": peak,
+            "top_allocations": [{"where": str(s.traceback), "bytes": s.size, "blocks": s.count} for s in stats],
+        })
+    if sessions is not None:
+        per_session = {sid: session_bytes(state) for sid, state in sessions.items()}
+        report["sessions"] = per_session
+        report["session_bytes_total"] = sum(per_session.values())
+    return report
+
+
+def _simulate(turns: int, compact: bool, max_messages: int, keep_full_turns: int) -> dict:
+    from bench_history import build_session
+
+    tracemalloc.start()
+    messages: list[BaseMessage] = []
+    for _ in range(turns):
+        if compact:
+            messages = apply_updates(messages, compaction_updates(messages, max_messages, keep_full_turns))
+        # 每轮 human -> ai(tool_call) -> tool -> ai(answer)，在追踪开启后分配
+        messages.extend(build_session(4))
+    report = memory_report({"session": {"messages": messages}}, top=5)
+    tracemalloc.stop()
+    report["messages"] = len(messages)
+    return report
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Compare session memory with and without compaction.")
+    parser.add_argument("--turns", type=int, default=1000)
+    parser.add_argument("--max-messages", type=int, default=SESSION_MAX_MESSAGES)
+    parser.add_argument("--keep-full-turns", type=int, default=SESSION_KEEP_FULL_TURNS)
+    args = parser.parse_args(argv)
+
+    for compact in (False, True):
+        r = _simulate(args.turns, compact, args.max_messages, args.keep_full_turns)
+        print(f"compact={compact!s:<5} messages={r['messages']:<6} session_bytes={r['session_bytes_total']:<10} "
+              f"traced_current={r['traced_current_bytes']} traced_peak={r['traced_peak_bytes']}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
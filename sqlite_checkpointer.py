@@ -0,0 +1,329 @@
+"""
+SQLite 持久化 Checkpointer：会话状态跨进程 / 重启保留
+
+app = graph.compile() 原本不带 checkpointer，CLI 只把 state 放在局部变量里，重启后 last_task_id、
+last_task_config、global_config 全部丢失。这里实现一个 LangGraph BaseCheckpointSaver：
+- checkpoint 中除 messages 以外的通道值用 serde.dumps_typed (msgpack) + zlib 压缩后存一行
+- messages 通道增量存储：每条消息按 (thread_id, checkpoint_ns, message_id, rev) 只写一次，
+  checkpoint 行只记录 [message_id, rev] 列表；同 id 的消息被替换 (例如 session_memory 压缩) 时 rev + 1，
+  旧 checkpoint 仍能还原当时的内容。每一步只序列化新增 / 变化的消息，而不是整段历史
+- pending writes 单独成表，与 langgraph 自带 SqliteSaver 的语义一致
+
+仅在设置 SESSION_CHECKPOINT_DB 时启用 (见 from_env)；LangGraph Server 部署使用平台自带的持久化。
+
+环境变量：
+    SESSION_CHECKPOINT_DB=sessions.db
+    SESSION_THREAD_ID=cli          CLI 会话的 thread_id (重启后按此恢复)
+"""
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import zlib
+from collections import OrderedDict
+from typing import Any, AsyncIterator, Iterator, Sequence
+
+from langgraph.checkpoint.base import (
+    WRITES_IDX_MAP,
+    BaseCheckpointSaver,
+    ChannelVersions,
+    Checkpoint,
+    CheckpointMetadata,
+    CheckpointTuple,
+)
+from logger_util import get_logger
+
+logger = get_logger("mynamechat.checkpointer")
+
+MESSAGES_CHANNEL = "messages"
+DEFAULT_THREAD_ID = "cli"
+# 最多为多少个会话缓存 "已落盘消息" 的对象引用 (LRU)，超出后该会话下一次 get_tuple 时重建
+MAX_CACHED_THREADS = 256
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS checkpoints (
+    thread_id TEXT NOT NULL,
+    checkpoint_ns TEXT NOT NULL DEFAULT '',
+    checkpoint_id TEXT NOT NULL,
+    parent_checkpoint_id TEXT,
+    type TEXT,
+    checkpoint BLOB,
+    metadata_type TEXT,
+    metadata BLOB,
+    message_refs TEXT,
+    PRIMARY KEY (thread_id, checkpoint_ns, checkpoint_id)
+);
+CREATE TABLE IF NOT EXISTS messages (
+    thread_id TEXT NOT NULL,
+    checkpoint_ns TEXT NOT NULL DEFAULT '',
+    message_id TEXT NOT NULL,
+    rev INTEGER NOT NULL,
+    type TEXT,
+    value BLOB,
+    PRIMARY KEY (thread_id, checkpoint_ns, message_id, rev)
+);
+CREATE TABLE IF NOT EXISTS writes (
+    thread_id TEXT NOT NULL,
+    checkpoint_ns TEXT NOT NULL DEFAULT '',
+    checkpoint_id TEXT NOT NULL,
+    task_id TEXT NOT NULL,
+    idx INTEGER NOT NULL,
+    channel TEXT NOT NULL,
+    type TEXT,
+    value BLOB,
+    task_path TEXT NOT NULL DEFAULT '',
+    PRIMARY KEY (thread_id, checkpoint_ns, checkpoint_id, task_id, idx)
+);
+"""
+
+
+class SqliteCheckpointSaver(BaseCheckpointSaver):
+    def __init__(self, path: str, compress_level: int = 6):
+        super().__init__()
+        self.path = path
+        self.compress_level = compress_level
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+        self._lock = threading.Lock()
+        # (thread_id, ns) -> {message_id: (message 对象, rev)}：判断消息是否已落盘，避免重复序列化
+        self._saved_messages: "OrderedDict[tuple[str, str], dict[str, tuple[Any, int]]]" = OrderedDict()
+
+    def _message_cache(self, thread_id: str, ns: str, reset: bool = False) -> dict[str, tuple[Any, int]]:
+        key = (thread_id, ns)
+        if reset or key not in self._saved_messages:
+            self._saved_messages[key] = {}
+        self._saved_messages.move_to_end(key)
+        while len(self._saved_messages) > MAX_CACHED_THREADS:
+            self._saved_messages.popitem(last=False)
+        return self._saved_messages[key]
+
+    # --- 编解码 ---
+    def _dump(self, value: Any) -> tuple[str, bytes]:
+        type_, data = self.serde.dumps_typed(value)
+        return type_, zlib.compress(data, self.compress_level)
+
+    def _load(self, type_: str, data: bytes) -> Any:
+        return self.serde.loads_typed((type_, zlib.decompress(data)))
+
+    # --- messages 增量存储 ---
+    def _store_messages(self, thread_id: str, ns: str, messages: list) -> list[list]:
+        saved = self._message_cache(thread_id, ns)
+        refs, rows = [], []
+        for msg in messages:
+            cached = saved.get(msg.id)
+            if cached is not None and cached[0] is msg:
+                refs.append([msg.id, cached[1]])
+                continue
+            if cached is None:
+                row = self._conn.execute(
+                    "SELECT MAX(rev) FROM messages WHERE thread_id = ? AND checkpoint_ns = ? AND message_id = ?",
+                    (thread_id, ns, msg.id),
+                ).fetchone()
+                rev = (row[0] + 1) if row and row[0] is not None else 0
+            else:
+                rev = cached[1] + 1
+            type_, blob = self._dump(msg)
+            rows.append((thread_id, ns, msg.id, rev, type_, blob))
+            saved[msg.id] = (msg, rev)
+            refs.append([msg.id, rev])
+        if rows:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO messages (thread_id, checkpoint_ns, message_id, rev, type, value) "
+                "VALUES (?, ?, ?, ?, ?, ?)", rows,
+            )
+        # 只保留当前 checkpoint 仍引用的消息，被截断移除的消息不再占用缓存
+        live = {ref[0] for ref in refs}
+        for message_id in [mid for mid in saved if mid not in live]:
+            del saved[message_id]
+        return refs
+
+    def _load_messages(self, thread_id: str, ns: str, refs: list[list]) -> list:
+        if not refs:
+            return []
+        wanted = {(mid, rev) for mid, rev in refs}
+        loaded: dict[tuple[str, int], Any] = {}
+        for mid, rev, type_, blob in self._conn.execute(
+            "SELECT message_id, rev, type, value FROM messages WHERE thread_id = ? AND checkpoint_ns = ?",
+            (thread_id, ns),
+        ):
+            if (mid, rev) in wanted:
+                loaded[(mid, rev)] = self._load(type_, blob)
+        messages = [loaded[(mid, rev)] for mid, rev in refs]
+        # 载入后的对象即为已落盘版本，下一次 put 只会写入新增 / 变化的消息
+        self._message_cache(thread_id, ns, reset=True).update(
+            {m.id: (m, rev) for m, (_, rev) in zip(messages, refs)})
+        return messages
+
+    # --- BaseCheckpointSaver 接口 ---
+    def put(self, config: dict, checkpoint: Checkpoint, metadata: CheckpointMetadata,
+            new_versions: ChannelVersions) -> dict:
+        configurable = config["configurable"]
+        thread_id = configurable["thread_id"]
+        ns = configurable.get("checkpoint_ns", "")
+        parent_id = configurable.get("checkpoint_id")
+
+        channel_values = dict(checkpoint.get("channel_values") or {})
+        messages = channel_values.get(MESSAGES_CHANNEL)
+        incremental = isinstance(messages, list) and all(getattr(m, "id", None) for m in messages)
+        with self._lock, self._conn:
+            refs = None
+            if incremental:
+                refs = self._store_messages(thread_id, ns, channel_values.pop(MESSAGES_CHANNEL))
+            type_, blob = self._dump({**checkpoint, "channel_values": channel_values})
+            metadata_type, metadata_blob = self._dump(dict(metadata or {}))
+            self._conn.execute(
+                "INSERT OR REPLACE INTO checkpoints (thread_id, checkpoint_ns, checkpoint_id, parent_checkpoint_id, "
+                "type, checkpoint, metadata_type, metadata, message_refs) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (thread_id, ns, checkpoint["id"], parent_id, type_, blob, metadata_type, metadata_blob,
+                 json.dumps(refs) if refs is not None else None),
+            )
+        return {"configurable": {"thread_id": thread_id, "checkpoint_ns": ns, "checkpoint_id": checkpoint["id"]}}
+
+    def put_writes(self, config: dict, writes: Sequence[tuple[str, Any]], task_id: str, task_path: str = "") -> None:
+        configurable = config["configurable"]
+        thread_id = configurable["thread_id"]
+        ns = configurable.get("checkpoint_ns", "")
+        checkpoint_id = configurable["checkpoint_id"]
+        # 特殊通道 (错误 / 中断) 允许覆盖，普通写入只保留第一次
+        verb = "INSERT OR REPLACE" if all(w[0] in WRITES_IDX_MAP for w in writes) else "INSERT OR IGNORE"
+        rows = []
+        for idx, (channel, value) in enumerate(writes):
+            type_, blob = self._dump(value)
+            rows.append((thread_id, ns, checkpoint_id, task_id, WRITES_IDX_MAP.get(channel, idx), channel,
+                         type_, blob, task_path))
+        with self._lock, self._conn:
+            self._conn.executemany(
+                f"{verb} INTO writes (thread_id, checkpoint_ns, checkpoint_id, task_id, idx, channel, type, value, "
+                "task_path) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", rows,
+            )
+
+    def _row_to_tuple(self, row) -> CheckpointTuple:
+        thread_id, ns, checkpoint_id, parent_id, type_, blob, metadata_type, metadata_blob, refs = row
+        checkpoint = self._load(type_, blob)
+        if refs is not None:
+            checkpoint["channel_values"][MESSAGES_CHANNEL] = self._load_messages(thread_id, ns, json.loads(refs))
+        writes = self._conn.execute(
+            "SELECT task_id, channel, type, value FROM writes "
+            "WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ? ORDER BY task_id, idx",
+            (thread_id, ns, checkpoint_id),
+        ).fetchall()
+        return CheckpointTuple(
+            config={"configurable": {"thread_id": thread_id, "checkpoint_ns": ns, "checkpoint_id": checkpoint_id}},
+            checkpoint=checkpoint,
+            metadata=self._load(metadata_type, metadata_blob),
+            parent_config={"configurable": {"thread_id": thread_id, "checkpoint_ns": ns,
+                                            "checkpoint_id": parent_id}} if parent_id else None,
+            pending_writes=[(task_id, channel, self._load(t, v)) for task_id, channel, t, v in writes],
+        )
+
+    _COLUMNS = ("thread_id, checkpoint_ns, checkpoint_id, parent_checkpoint_id, type, checkpoint, "
+                "metadata_type, metadata, message_refs")
+
+    def get_tuple(self, config: dict) -> CheckpointTuple | None:
+        configurable = config["configurable"]
+        thread_id = configurable["thread_id"]
+        ns = configurable.get("checkpoint_ns", "")
+        checkpoint_id = configurable.get("checkpoint_id")
+        with self._lock:
+            if checkpoint_id:
+                row = self._conn.execute(
+                    f"SELECT {self._COLUMNS} FROM checkpoints "
+                    "WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ?",
+                    (thread_id, ns, checkpoint_id),
+                ).fetchone()
+            else:
+                row = self._conn.execute(
+                    f"SELECT {self._COLUMNS} FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ? "
+                    "ORDER BY checkpoint_id DESC LIMIT 1",
+                    (thread_id, ns),
+                ).fetchone()
+            return self._row_to_tuple(row) if row else None
+
+    def list(self, config: dict | None, *, filter: dict[str, Any] | None = None, before: dict | None = None,
+             limit: int | None = None) -> Iterator[CheckpointTuple]:
+        clauses, params = [], []
+        if config:
+            clauses.append("thread_id = ?")
+            params.append(config["configurable"]["thread_id"])
+            if config["configurable"].get("checkpoint_ns") is not None:
+                clauses.append("checkpoint_ns = ?")
+                params.append(config["configurable"]["checkpoint_ns"])
+        if before and before.get("configurable", {}).get("checkpoint_id"):
+            clauses.append("checkpoint_id < ?")
+            params.append(before["configurable"]["checkpoint_id"])
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT {self._COLUMNS} FROM checkpoints {where} ORDER BY checkpoint_id DESC", params,
+            ).fetchall()
+        yielded = 0
+        for row in rows:
+            if limit is not None and yielded >= limit:
+                break
+            with self._lock:
+                item = self._row_to_tuple(row)
+            if filter and any(item.metadata.get(k) != v for k, v in filter.items()):
+                continue
+            yielded += 1
+            yield item
+
+    def delete_thread(self, thread_id: str) -> None:
+        with self._lock, self._conn:
+            for table in ("checkpoints", "messages", "writes"):
+                self._conn.execute(f"DELETE FROM {table} WHERE thread_id = ?", (thread_id,))
+            for key in [k for k in self._saved_messages if k[0] == thread_id]:
+                del self._saved_messages[key]
+
+    # --- 异步接口 (astream_events 使用)：SQLite 调用放到线程中执行 ---
+    async def aget_tuple(self, config: dict) -> CheckpointTuple | None:
+        return await asyncio.to_thread(self.get_tuple, config)
+
+    async def alist(self, config: dict | None, *, filter: dict[str, Any] | None = None, before: dict | None = None,
+                    limit: int | None = None) -> AsyncIterator[CheckpointTuple]:
+        items = await asyncio.to_thread(lambda: list(self.list(config, filter=filter, before=before, limit=limit)))
+        for item in items:
+            yield item
+
+    async def aput(self, config: dict, checkpoint: Checkpoint, metadata: CheckpointMetadata,
+                   new_versions: ChannelVersions) -> dict:
+        return await asyncio.to_thread(self.put, config, checkpoint, metadata, new_versions)
+
+    async def aput_writes(self, config: dict, writes: Sequence[tuple[str, Any]], task_id: str,
+                          task_path: str = "") -> None:
+        await asyncio.to_thread(self.put_writes, config, writes, task_id, task_path)
+
+    async def adelete_thread(self, thread_id: str) -> None:
+        await asyncio.to_thread(self.delete_thread, thread_id)
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+_SAVER: SqliteCheckpointSaver | None = None
+_SAVER_LOCK = threading.Lock()
+
+
+def from_env() -> SqliteCheckpointSaver | None:
+    """设置 SESSION_CHECKPOINT_DB 时返回进程内共享的 saver (三个图共用一个数据库)，否则返回 None"""
+    global _SAVER
+    path = os.getenv("SESSION_CHECKPOINT_DB")
+    if not path:
+        return None
+    with _SAVER_LOCK:
+        if _SAVER is None:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            _SAVER = SqliteCheckpointSaver(path)
+            logger.info("Session checkpointer enabled: %s", path)
+    return _SAVER
+
+
+def session_config(graph_name: str, thread_id: str | None = None) -> dict | None:
+    """启用 checkpointer 时返回带 thread_id 的 RunnableConfig (按图名区分，三个图共用一个数据库)，否则返回 None"""
+    if not os.getenv("SESSION_CHECKPOINT_DB"):
+        return None
+    thread_id = thread_id or os.getenv("SESSION_THREAD_ID") or DEFAULT_THREAD_ID
+    return {"configurable": {"thread_id": f"{graph_name}:{thread_id}"}}
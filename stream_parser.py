@@ -0,0 +1,185 @@
+"""
+结构化输出 (with_structured_output, method="json_schema") 的增量 JSON 解析器
+
+on_chat_model_stream 推送的是 AgentResponse 的原始 JSON 片段，直接打印只会看到
+`{"answer": "...` 之类的字符。这里逐字符扫描 JSON，在 `answer` 字段的字符串值
+到达时立即解码转义并吐出干净的文本增量；整个对象闭合后再一次性解析出 suggestions。
+"""
+import json
+
+
+class AnswerStreamParser:
+    """
+    增量提取顶层对象中某个字符串字段（默认 `answer`）。
+
+    用法：
+        parser = AnswerStreamParser()
+        for chunk in chunks:
+            print(parser.feed(chunk), end="")
+        if parser.done:
+            suggestions = parser.result.get("suggestions")
+
+    如果流的第一个非空白字符不是 `{`（模型没有按 JSON 输出），自动切换为直通模式，
+    原样返回文本。
+    """
+
+    _SIMPLE_ESCAPES = {
+        '"': '"', "\\": "\\", "/": "/",
+        "b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t",
+    }
+
+    def __init__(self, field: str = "answer"):
+        self.field = field
+        self.done = False
+        self.passthrough = False
+        self.result: dict | None = None
+
+        self._raw: list[str] = []
+        self._started = False
+        # 容器栈：每层为 [类型('{' 或 '['), 是否正在等待 key]
+        self._stack: list[list] = []
+        self._in_string = False
+        self._string_is_key = False
+        self._capturing = False
+        self._escape = False
+        self._unicode_buf: str | None = None
+        self._pending_high: int | None = None
+        self._key_buf: list[str] = []
+        self._current_key: str | None = None
+
+    def feed(self, chunk: str) -> str:
+        """喂入一个文本片段，返回本次新增的字段文本"""
+        if not chunk:
+            return ""
+        if self.passthrough:
+            return chunk
+        if self.done:
+            # 对象已闭合，后续内容（通常为空白）忽略
+            return ""
+
+        out: list[str] = []
+        for i, c in enumerate(chunk):
+            if not self._started:
+                if c.isspace():
+                    continue
+                if c != "{":
+                    self.passthrough = True
+                    return "".join(out) + chunk[i:]
+                self._started = True
+
+            self._raw.append(c)
+            if self._in_string:
+                self._consume_string_char(c, out)
+            else:
+                self._consume_structural_char(c)
+                if self.done:
+                    self._finalize()
+                    break
+        return "".join(out)
+
+    # --- 内部状态机 ---
+    def _emit(self, text: str, out: list[str]) -> None:
+        if self._capturing:
+            out.append(text)
+        elif self._string_is_key:
+            self._key_buf.append(text)
+
+    def _consume_string_char(self, c: str, out: list[str]) -> None:
+        if self._unicode_buf is not None:
+            self._unicode_buf += c
+            if len(self._unicode_buf) == 4:
+                self._emit_codepoint(int(self._unicode_buf, 16), out)
+                self._unicode_buf = None
+            return
+
+        if self._escape:
+            self._escape = False
+            if c == "u":
+                self._unicode_buf = ""
+                return
+            self._flush_pending_high(out)
+            self._emit(self._SIMPLE_ESCAPES.get(c, c), out)
+            return
+
+        if c == "\\":
+            self._escape = True
+            return
+
+        self._flush_pending_high(out)
+        if c == '"':
+            self._in_string = False
+            if self._string_is_key:
+                self._current_key = "".join(self._key_buf)
+                self._key_buf = []
+            self._string_is_key = False
+            self._capturing = False
+            return
+        self._emit(c, out)
+
+    def _emit_codepoint(self, code: int, out: list[str]) -> None:
+        if 0xD800 <= code <= 0xDBFF:
+            self._flush_pending_high(out)
+            self._pending_high = code
+            return
+        if 0xDC00 <= code <= 0xDFFF and self._pending_high is not None:
+            combined = 0x10000 + ((self._pending_high - 0xD800) << 10) + (code - 0xDC00)
+            self._pending_high = None
+            self._emit(chr(combined), out)
+            return
+        self._flush_pending_high(out)
+        self._emit(chr(code), out)
+
+    def _flush_pending_high(self, out: list[str]) -> None:
+        # 孤立的高代理项无法单独编码，用替换字符占位
+        if self._pending_high is not None:
+            self._pending_high = None
+            self._emit("�", out)
+
+    def _consume_structural_char(self, c: str) -> None:
+        top = self._stack[-1] if self._stack else None
+        if c == '"':
+            self._in_string = True
+            self._string_is_key = bool(top and top[0] == "{" and top[1])
+            self._capturing = (
+                not self._string_is_key
+                and len(self._stack) == 1
+                and top[0] == "{"
+                and self._current_key == self.field
+            )
+        elif c in "{[":
+            self._stack.append([c, c == "{"])
+        elif c in "}]":
+            if self._stack:
+                self._stack.pop()
+            if not self._stack:
+                self.done = True
+        elif c == ":":
+            if top:
+                top[1] = False
+        elif c == ",":
+            if top and top[0] == "{":
+                top[1] = True
+                if len(self._stack) == 1:
+                    self._current_key = None
+
+    def _finalize(self) -> None:
+        try:
+            parsed = json.loads("".join(self._raw))
+        except json.JSONDecodeError:
+            parsed = None
+        self.result = parsed if isinstance(parsed, dict) else None
+
+
+def chunk_text(content) -> str:
+    """兼容 AIMessageChunk.content 为 str 或内容块列表两种形式"""
+    if isinstance(content, str):
+        return content
+    if isinstance(content, list):
+        parts = []
+        for block in content:
+            if isinstance(block, str):
+                parts.append(block)
+            elif isinstance(block, dict) and block.get("type") == "text":
+                parts.append(block.get("text", ""))
+        return "".join(parts)
+    return ""
@@ -0,0 +1,205 @@
+"""
+建议生成引擎：缓存 -> 模板库 -> LLM 三级兜底
+
+SUGGESTION_SYSTEM_PROMPT 要求的输出形状固定（2 条 Refinement + 1 条 Advance），
+大部分回合（尤其是刚提交完生成任务的回合）完全可以由模板直接给出，
+只有纯对话/澄清类回合才需要真正调用 suggestion_llm。
+LLM 结果按 (本轮工具, 任务类型, 归一化意图) 缓存，跨会话复用：建议只是下一步操作的短句，
+key 中的意图已去掉 URL 与系统注入内容，同一句话的不同会话拿到相同建议。
+各级命中计入 mynamechat_suggestion_source_total{source}。
+"""
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Sequence
+
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage
+
+import metrics
+from logger_util import get_logger
+from text_signals import RETRY_KEYWORDS, user_text
+
+logger = get_logger("mynamechat.suggestion")
+
+# 缓存配置
+DEFAULT_CACHE_SIZE = 512
+DEFAULT_CACHE_TTL = 3600.0  # 秒
+
+# 任务类型 -> 模板建议 (Option 1 & 2: Refinement, Option 3: Advance)
+TEMPLATE_BANK = {
+    "image_edit": [
+        "微调人物面部细节",
+        "把光线改成黄昏暖色调",
+        "确认画面，用这张图生成视频",
+    ],
+    "image_edit_retry": [
+        "换一个随机种子再试一次",
+        "保持构图，只调整色彩风格",
+        "确认画面，用这张图生成视频",
+    ],
+    "remove_watermark": [
+        "再检查一遍边角是否残留水印",
+        "顺便提升画面清晰度",
+        "用去水印后的图片继续编辑",
+    ],
+    "text_to_image": [
+        "调整画面构图和视角",
+        "换成电影感的光影风格",
+        "以这张图为基础继续编辑",
+    ],
+    "video": [
+        "把视频时长改为 15 秒",
+        "让镜头运动更缓慢柔和",
+        "继续创作下一个分镜",
+    ],
+}
+
+_NOISE_PATTERN = re.compile(r"[\s\W_]+", re.U)
+
+
+def classify_task_type(tool_name: str | None) -> str:
+    """根据工具名推断任务类型（与 recorder_node 记录的 last_tool_name 对应）"""
+    name = (tool_name or "").lower()
+    if not name:
+        return "chat"
+    if "watermark" in name:
+        return "remove_watermark"
+    if "video" in name:
+        return "video"
+    if "image_edit" in name:
+        return "image_edit"
+    if "text_to_image" in name:
+        return "text_to_image"
+    return "other"
+
+
+def normalize_intent(text: str) -> str:
+    """归一化用户意图：去掉系统注入前缀、URL、标点与空白，统一小写"""
+    return _NOISE_PATTERN.sub("", user_text(text)).lower()[:200]
+
+
+def _last_human_text(messages: Sequence[BaseMessage]) -> str:
+    for msg in reversed(messages):
+        if isinstance(msg, HumanMessage):
+            return msg.content if isinstance(msg.content, str) else str(msg.content)
+    return ""
+
+
+def _tool_called_this_turn(messages: Sequence[BaseMessage]) -> str:
+    """本轮 (最后一条 HumanMessage 之后) 最近一次调用的工具名；state.last_tool_name 可能是更早轮次的生成任务"""
+    for msg in reversed(messages):
+        if isinstance(msg, HumanMessage):
+            break
+        if isinstance(msg, AIMessage) and msg.tool_calls:
+            return msg.tool_calls[-1]["name"]
+    return ""
+
+
+class SuggestionEngine:
+    """
+    三级建议生成：
+    1. LRU 缓存，key = (本轮工具, task_type, 归一化意图)
+    2. 模板库：本轮刚执行过工具时，按任务类型直接给出模板建议
+    3. LLM：以上都未命中时才调用，结果写回缓存
+    """
+
+    def __init__(self, cache_size: int = DEFAULT_CACHE_SIZE, cache_ttl: float = DEFAULT_CACHE_TTL):
+        self.cache_size = cache_size
+        self.cache_ttl = cache_ttl
+        self._cache: "OrderedDict[tuple, tuple[float, list[str]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"cache_hit": 0, "template_hit": 0, "llm_call": 0, "llm_error": 0}
+
+    # --- 缓存 ---
+    def _cache_get(self, key: tuple) -> list[str] | None:
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry is None:
+                return None
+            stored_at, suggestions = entry
+            if time.monotonic() - stored_at > self.cache_ttl:
+                del self._cache[key]
+                return None
+            self._cache.move_to_end(key)
+            return list(suggestions)
+
+    def _cache_put(self, key: tuple, suggestions: list[str]) -> None:
+        with self._lock:
+            self._cache[key] = (time.monotonic(), list(suggestions))
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    # --- 模板库 ---
+    @staticmethod
+    def _template_lookup(task_type: str, intent: str) -> list[str] | None:
+        if task_type == "image_edit" and any(k in intent for k in RETRY_KEYWORDS):
+            task_type = "image_edit_retry"
+        suggestions = TEMPLATE_BANK.get(task_type)
+        return list(suggestions) if suggestions else None
+
+    def generate(
+        self,
+        state: dict,
+        llm_fallback: Callable[[], list[str]],
+    ) -> tuple[list[str], str]:
+        """
+        返回 (suggestions, source)，source 为 cache / template / llm / error。
+        llm_fallback 只在缓存与模板都未命中时才会被调用。
+        """
+        messages = state.get("messages") or []
+        turn_tool = _tool_called_this_turn(messages)
+        task_type = classify_task_type(turn_tool)
+        intent = normalize_intent(_last_human_text(messages))
+        key = (turn_tool, task_type, intent)
+
+        cached = self._cache_get(key)
+        if cached is not None:
+            self._record("cache_hit")
+            return cached, "cache"
+
+        # 本轮执行过工具时，建议形状完全由任务类型决定 (模板与会话无关，可跨用户复用)
+        if turn_tool:
+            templated = self._template_lookup(task_type, intent)
+            if templated is not None:
+                self._record("template_hit")
+                return templated, "template"
+
+        try:
+            suggestions = list(llm_fallback())
+        except Exception as e:
+            self._record("llm_error")
+            logger.error("Suggestion LLM fallback failed: %s", e)
+            return [], "error"
+
+        self._record("llm_call")
+        if suggestions:
+            self._cache_put(key, suggestions)
+        return suggestions, "llm"
+
+    # --- 统计 ---
+    def _record(self, field: str) -> None:
+        with self._lock:
+            self._stats[field] += 1
+        metrics.SUGGESTION_SOURCES.inc(source=field)
+
+    def stats(self) -> dict:
+        """返回各级命中次数与命中率"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats["cache_size"] = len(self._cache)
+        total = stats["cache_hit"] + stats["template_hit"] + stats["llm_call"] + stats["llm_error"]
+        stats["total"] = total
+        stats["cache_hit_rate"] = stats["cache_hit"] / total if total else 0.0
+        stats["template_hit_rate"] = stats["template_hit"] / total if total else 0.0
+        stats["llm_rate"] = (stats["llm_call"] + stats["llm_error"]) / total if total else 0.0
+        return stats
+
+    def clear(self) -> None:
+        with self._lock:
+            self._cache.clear()
+
+
+# 进程级共享实例
+suggestion_engine = SuggestionEngine()
@@ -0,0 +1,16 @@
+"""
+用户输入的文本信号：suggestion_engine (意图归一化、重试模板) 与 effort_policy (推理档位打分) 共用
+
+自动加载会在用户输入前注入 "（系统自动注入：...）" 前缀 (见 graph_factory.model_call)，其中带有图片 URL；
+按用户意图判断时需要先去掉这部分以及 URL，只看用户自己输入的文字。
+"""
+import re
+
+RETRY_KEYWORDS = ("retry", "regenerate", "重试", "重新生成", "再来", "再试", "换一张")
+INJECTED_PREFIX_PATTERN = re.compile(r"^（系统自动注入：.*?）\s*", re.S)
+URL_PATTERN = re.compile(r"https?://\S+")
+
+
+def user_text(text: str) -> str:
+    """去掉系统注入前缀与 URL 后的用户原始输入"""
+    return URL_PATTERN.sub("", INJECTED_PREFIX_PATTERN.sub("", text or "")).strip()
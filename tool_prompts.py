@@ -9,6 +9,7 @@ Arguments:
 - prompt (str): The user's image description.
 - resolution (str): Image resolution. Options: ["1K", "2K", "4K"].
 - aspect_ratio (str): Image aspect ratio (e.g., "landscape_16_9").
+- max_images (int): How many candidate images (1-6) this single task should output. Default 1. Use >1 ONLY when the user asks for several candidates to choose from (e.g. "出几张让我挑").
 """
 
 # 图像编辑工具描述
@@ -20,6 +21,8 @@ Arguments:
 - seed (int): Random number. CHANGE THIS whenever the user asks to “retry” or “regenerate”.
 - resolution (str): Image resolution. Options: ["1K", "2K", "4K"].
 - aspect_ratio (str): Image aspect ratio. (e.g., "landscape_16_9").
+- num_variants (int): How many variants (1-4) to generate in parallel in this single call. Default 1. Use >1 ONLY when the user explicitly asks for several versions/takes (e.g. "来4张", "多出几个版本").
+- max_images (int): How many candidate images (1-6) each task outputs. Default 1. Prefer this over num_variants when the user just wants several candidates from the same edit: one task yields all of them.
 """
 
 # Banana Pro 图像编辑工具描述
@@ -32,6 +35,25 @@ Arguments:
 - seed (int): Random number. CHANGE THIS whenever the user asks to “retry” or “regenerate”.
 - resolution (str): Image resolution. MUST be one of: ["1K", "2K", "4K"].
 - aspect_ratio (str): Image aspect ratio. MUST be one of: ["16:9", "9:16", "1:1", "4:3", "3:4", "21:9"].
+- num_variants (int): How many variants (1-4) to generate in parallel in this single call. Default 1. Use >1 ONLY when the user explicitly asks for several versions/takes (e.g. "来4张", "多出几个版本").
+"""
+
+# 自动路由的图像编辑工具描述
+IMAGE_EDIT_ROUTED_DESC = """
+Create an image editing task on the currently fastest healthy editing backend (Seedream or Nano Banana Pro, chosen automatically). Use this for image edits unless the user explicitly names a model. Returns the Task ID.
+CRITICAL: This tool REQUIRES a reference image.
+Arguments:
+- prompt (str): Describe ONLY the latest user's query. DO NOT include any other CONTEXT. Always append a clause such as “保持其余元素不变。”
+- image_urls (list[str]): The source image URLs. MUST retrieve from the `[REFERENCES]` section in context if available.
+- seed (int): Random number. CHANGE THIS whenever the user asks to “retry” or “regenerate”.
+- resolution (str): Image resolution. MUST be one of: ["1K", "2K", "4K"].
+- aspect_ratio (str): Image aspect ratio. MUST be one of: ["16:9", "9:16", "1:1", "4:3", "3:4", "21:9"].
+- num_variants (int): How many variants (1-4) to generate in parallel in this single call. Default 1. Use >1 ONLY when the user explicitly asks for several versions/takes (e.g. "来4张", "多出几个版本").
+- min_quality (str): Leave empty to use the deployment default. Set "high" ONLY when the user explicitly asks for the best quality (e.g. "最高画质", "精修").
+"""
+
+# 路由工具的 max_images 参数说明：只有质量下限允许多图后端 (Seedream) 时才追加到 IMAGE_EDIT_ROUTED_DESC
+IMAGE_EDIT_ROUTED_MAX_IMAGES_ARG = """- max_images (int): How many candidate images (1-6) the task outputs. Default 1. Values >1 route to a backend that supports multi-image output.
 """
 
 # 统一任务状态查询工具描述
@@ -41,7 +63,7 @@ Arguments:
 - task_id (str): The ID of the task to check.
 - 
 Returns:
-- If the task is successful: Returns the URL of the generated image.
+- If the task is successful: Returns the URL of the generated image, or a list of URLs when the task produced several candidate images.
 - If processing: Returns "Task is processing..."
 - If failed/not found: Returns error message.
 """
@@ -55,6 +77,7 @@ Arguments:
 - resolution (str): Video resolution (e.g., "720P", "1080P").
 - aspect_ratio (str): Video aspect ratio. Options: ["landscape", "portrait"]. If the user use the default value "16:9", you should use the aspect ratio parameter "landscape". If the user use the default value "9:16", you should use the aspect ratio parameter "portrait".
 - n_frames (str): Number of frames. Options: ["10", "15"].
+- num_variants (int): How many video variants (1-4) to generate in parallel in this single call. Default 1. Each variant is a separate paid video job: use >1 ONLY when the user explicitly asks for several versions of the video (e.g. "出几个版本的视频").
 """
 
 # 首帧生成视频工具描述
@@ -66,6 +89,7 @@ Arguments:
 - seed (int): A random number. CHANGE THIS whenever the user asks to "retry" or "regenerate".
 - aspect_ratio (str): Video aspect ratio. Options: ["landscape", "portrait"]. If the user use the default value "16:9", you should use the aspect ratio parameter "landscape". If the user use the default value "9:16", you should use the aspect ratio parameter "portrait".
 - n_frames (str): Number of frames. Options: ["10", "15"].
+- num_variants (int): How many video variants (1-4) to generate in parallel in this single call. Default 1. Each variant is a separate paid video job: use >1 ONLY when the user explicitly asks for several versions of the video (e.g. "出几个版本的视频").
 """
 
 # 去除水印工具描述
@@ -0,0 +1,256 @@
+"""
+结构化 Tracing：图节点 / 工具 / Provider 调用 / LLM 调用的耗时 span
+
+目前只有 log_system_message 的自由文本，定位慢轮次 (自动加载? LLM? 工具? Supabase?) 要人工翻日志。
+这里用 contextvars 维护当前 span，嵌套调用 (节点 -> 工具 -> HTTP) 自动形成父子关系，
+结束的 span 以 OTLP JSON 的字段命名逐行写入本地 JSONL 文件：
+    {"traceId", "spanId", "parentSpanId", "name", "kind", "startTimeUnixNano", "endTimeUnixNano",
+     "attributes": [{"key": ..., "value": {"stringValue": ...}}], "status": {"code": ...}}
+
+- 每轮对话一个 trace：入口节点 (admission) 生成 trace_id 写入 AgentState，后续节点沿用
+- span 属性中带 session.id (LangGraph thread_id)，可按会话聚合
+- 未设置 TRACE_EXPORT 时所有接口都是空操作，节点不做包装
+
+环境变量：
+    TRACE_EXPORT=traces/spans.jsonl
+"""
+import contextvars
+import inspect
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Any, Callable
+
+from logger_util import get_logger
+
+logger = get_logger("mynamechat.tracing")
+
+SERVICE_NAME = "mynamechat"
+
+# OTLP SpanKind
+KIND_INTERNAL = "SPAN_KIND_INTERNAL"
+KIND_CLIENT = "SPAN_KIND_CLIENT"
+
+STATUS_OK = "STATUS_CODE_OK"
+STATUS_ERROR = "STATUS_CODE_ERROR"
+
+
+class Span:
+    __slots__ = ("trace_id", "span_id", "parent_span_id", "name", "kind", "start_ns", "end_ns",
+                 "attributes", "status", "status_message")
+
+    def __init__(self, name: str, trace_id: str, parent_span_id: str | None, kind: str, attributes: dict):
+        self.trace_id = trace_id
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_span_id = parent_span_id
+        self.name = name
+        self.kind = kind
+        self.start_ns = time.time_ns()
+        self.end_ns: int | None = None
+        self.attributes = {k: v for k, v in attributes.items() if v is not None}
+        self.status = STATUS_OK
+        self.status_message = ""
+
+    def set(self, **attributes) -> None:
+        self.attributes.update({k: v for k, v in attributes.items() if v is not None})
+
+    @property
+    def duration_ms(self) -> float | None:
+        return None if self.end_ns is None else (self.end_ns - self.start_ns) / 1e6
+
+    def to_otlp(self) -> dict:
+        return {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "parentSpanId": self.parent_span_id or "",
+            "name": self.name,
+            "kind": self.kind,
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns),
+            "attributes": [{"key": k, "value": _otlp_value(v)} for k, v in self.attributes.items()],
+            "status": {"code": self.status, "message": self.status_message} if self.status_message
+            else {"code": self.status},
+            "resource": {"service.name": SERVICE_NAME},
+        }
+
+
+def _otlp_value(value: Any) -> dict:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    if isinstance(value, (list, tuple)):
+        return {"arrayValue": {"values": [_otlp_value(v) for v in value]}}
+    return {"stringValue": str(value)}
+
+
+class JsonlSpanExporter:
+    """把结束的 span 追加写入 JSONL 文件 (线程安全)"""
+
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._file = open(path, "a", encoding="utf-8", buffering=1)
+        self._lock = threading.Lock()
+
+    def export(self, span: Span) -> None:
+        line = json.dumps(span.to_otlp(), ensure_ascii=False)
+        with self._lock:
+            self._file.write(line + "\n")
+
+    def close(self) -> None:
+        with self._lock:
+            self._file.close()
+
+
+_exporter: JsonlSpanExporter | None = None
+_exporter_loaded = False
+_exporter_lock = threading.Lock()
+
+# 当前 span (节点之间通过 AgentState.trace_id 传递 trace，节点内部通过 contextvars 传递父子关系)
+_current_span: contextvars.ContextVar[Span | None] = contextvars.ContextVar("mynamechat_span", default=None)
+
+
+def exporter() -> JsonlSpanExporter | None:
+    global _exporter, _exporter_loaded
+    if not _exporter_loaded:
+        with _exporter_lock:
+            if not _exporter_loaded:
+                path = os.getenv("TRACE_EXPORT")
+                if path:
+                    _exporter = JsonlSpanExporter(path)
+                    logger.info("Tracing enabled, exporting spans to %s", path)
+                _exporter_loaded = True
+    return _exporter
+
+
+def enabled() -> bool:
+    return exporter() is not None
+
+
+def configure(path: str | None) -> None:
+    """在代码中开启 / 关闭导出 (需在导入图模块之前调用，节点包装在编译时决定)"""
+    global _exporter, _exporter_loaded
+    with _exporter_lock:
+        if _exporter is not None:
+            _exporter.close()
+        _exporter = JsonlSpanExporter(path) if path else None
+        _exporter_loaded = True
+
+
+def new_trace_id() -> str:
+    return uuid.uuid4().hex
+
+
+def current_span() -> Span | None:
+    return _current_span.get()
+
+
+def set_attributes(**attributes) -> None:
+    """给当前 span 追加属性 (例如创建任务后补充 task_id)"""
+    current = _current_span.get()
+    if current is not None:
+        current.set(**attributes)
+
+
+@contextmanager
+def span(name: str, kind: str = KIND_INTERNAL, trace_id: str | None = None, session_id: str | None = None,
+         **attributes):
+    """
+    开启一个 span；未启用 tracing 时 yield None。
+    parent 取当前 contextvar 中的 span；显式传入 trace_id 且与 parent 不同 trace 时作为该 trace 的根。
+    """
+    export = exporter()
+    if export is None:
+        yield None
+        return
+
+    parent = _current_span.get()
+    if trace_id:
+        parent_id = parent.span_id if parent is not None and parent.trace_id == trace_id else None
+    elif parent is not None:
+        trace_id, parent_id = parent.trace_id, parent.span_id
+    else:
+        trace_id, parent_id = new_trace_id(), None
+    if session_id is None and parent is not None:
+        session_id = parent.attributes.get("session.id")
+
+    s = Span(name, trace_id, parent_id, kind, dict(attributes, **{"session.id": session_id}))
+    token = _current_span.set(s)
+    try:
+        yield s
+    except Exception as e:
+        s.status = STATUS_ERROR
+        s.status_message = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        _current_span.reset(token)
+        s.end_ns = time.time_ns()
+        s.attributes["duration_ms"] = round(s.duration_ms, 3)
+        try:
+            export.export(s)
+        except Exception as e:
+            logger.warning("Span export failed: %s", e)
+
+
+def _session_id(config: dict | None) -> str | None:
+    return ((config or {}).get("configurable") or {}).get("thread_id")
+
+
+def node_caller(node) -> Callable:
+    """统一为 (state, config) 调用：Runnable 走 invoke，声明了 config 参数的函数透传 config"""
+    if hasattr(node, "invoke"):
+        return node.invoke
+    if "config" in inspect.signature(node).parameters:
+        return node
+    return lambda state, config: node(state)
+
+
+def traced_node(name: str, node, graph_name: str | None = None, new_trace: bool = False):
+    """
+    包装图节点 (函数或 ToolNode 等 Runnable)。
+    new_trace=True 用于图的入口节点 (admission)：每轮生成新的 trace_id 并写入返回的状态。
+    未启用 tracing 时原样返回，不增加任何开销。
+    注意：包装函数显式声明 config 参数，以便 LangGraph 传入 RunnableConfig (取 thread_id)。
+    """
+    if not enabled():
+        return node
+
+    call = node_caller(node)
+
+    def _node(state, config):
+        trace_id = new_trace_id() if new_trace else (state.get("trace_id") if isinstance(state, dict) else None)
+        with span(f"node.{name}", trace_id=trace_id, session_id=_session_id(config),
+                  **{"graph.name": graph_name, "graph.node": name}) as s:
+            result = call(state, config)
+        if new_trace and isinstance(result, dict):
+            result["trace_id"] = s.trace_id
+        return result
+
+    _node.__name__ = getattr(node, "__name__", name)
+    return _node
+
+
+def propagate(fn: Callable) -> Callable:
+    """把当前 contextvars (包含当前 span) 带入后台线程 / 线程池；每次调用使用独立副本，可并发执行"""
+    ctx = contextvars.copy_context()
+    return lambda *args, **kwargs: ctx.copy().run(fn, *args, **kwargs)
+
+
+def record_llm_usage(s: Span | None, message) -> None:
+    """把 AIMessage.usage_metadata 中的 token 数写入 span"""
+    if s is None:
+        return
+    usage = getattr(message, "usage_metadata", None) or {}
+    details = usage.get("output_token_details") or {}
+    s.set(**{
+        "llm.input_tokens": usage.get("input_tokens"),
+        "llm.output_tokens": usage.get("output_tokens"),
+        "llm.reasoning_tokens": details.get("reasoning"),
+        "llm.tool_calls": len(getattr(message, "tool_calls", None) or []),
+    })